@@ -29,12 +29,14 @@ class DeepResearcher:
                  chat_mdl: LLMBundle,
                  prompt_config: dict,
                  kb_retrieve: partial = None,
-                 kg_retrieve: partial = None
+                 kg_retrieve: partial = None,
+                 kb_retrieve_many: partial = None
                  ):
         self.chat_mdl = chat_mdl
         self.prompt_config = prompt_config
         self._kb_retrieve = kb_retrieve
         self._kg_retrieve = kg_retrieve
+        self._kb_retrieve_many = kb_retrieve_many
 
     def _remove_tags(text: str, start_tag: str, end_tag: str) -> str:
         """General Tag Removal Method"""
@@ -95,14 +97,25 @@ class DeepResearcher:
         
         return truncated_prev_reasoning.strip('\n')
 
-    def _retrieve_information(self, search_query):
-        """Retrieve information from different sources"""
-        # 1. Knowledge base retrieval
-        kbinfos = []
+    def _prefetch_kb_information(self, search_queries):
+        """Knowledge base retrieval of all queries of a step at once, by query"""
+        if not self._kb_retrieve_many or len(search_queries) <= 1:
+            return {}
         try:
-            kbinfos = self._kb_retrieve(question=search_query) if self._kb_retrieve else {"chunks": [], "doc_aggs": []}
+            return dict(zip(search_queries, self._kb_retrieve_many(questions=search_queries)))
         except Exception as e:
             logging.error(f"Knowledge base retrieval error: {e}")
+            return {}
+
+    def _retrieve_information(self, search_query, kbinfos=None):
+        """Retrieve information from different sources"""
+        # 1. Knowledge base retrieval, unless prefetched
+        if kbinfos is None:
+            kbinfos = []
+            try:
+                kbinfos = self._kb_retrieve(question=search_query) if self._kb_retrieve else {"chunks": [], "doc_aggs": []}
+            except Exception as e:
+                logging.error(f"Knowledge base retrieval error: {e}")
 
         # 2. Web retrieval (if Tavily API is configured)
         try:
@@ -193,6 +206,10 @@ class DeepResearcher:
                 # If not the first step and no queries, end the search process
                 break
 
+            # The knowledge bases are searched for all new queries of the step together
+            prefetched = self._prefetch_kb_information(
+                [q for q in dict.fromkeys(queries) if q not in executed_search_queries])
+
             # Process each search query
             for search_query in queries:
                 logging.info(f"[THINK]Query: {step_index}. {search_query}")
@@ -215,7 +232,7 @@ class DeepResearcher:
                 truncated_prev_reasoning = self._truncate_previous_reasoning(all_reasoning_steps)
                 
                 # Step 4: Retrieve information
-                kbinfos = self._retrieve_information(search_query)
+                kbinfos = self._retrieve_information(search_query, prefetched.pop(search_query, None))
                 
                 # Step 5: Update chunk information
                 self._update_chunk_info(chunk_info, kbinfos)
@@ -14,7 +14,6 @@
 #  limitations under the License.
 #
 import datetime
-import json
 import re
 
 import xxhash
@@ -33,8 +32,9 @@ from rag.app.tag import label_question
 from rag.nlp import rag_tokenizer, search
 from rag.prompts.generator import gen_meta_filter, cross_languages, keyword_extraction
 from common.string_utils import remove_redundant_spaces
-from common.constants import RetCode, LLMType, ParserType, PAGERANK_FLD
+from common.constants import RetCode, LLMType, ParserType, PAGERANK_FLD, CHUNK_DIGEST_FLD
 from common import settings
+from graphrag.utils import load_graph_data
 from api.apps import login_required, current_user
 
 
@@ -170,6 +170,8 @@ async def set():
         v, c = embd_mdl.encode([doc.name, req["content_with_weight"] if not d.get("question_kwd") else "\n".join(d["question_kwd"])])
         v = 0.1 * v[0] + 0.9 * v[1] if doc.parser_id != ParserType.QA else v[1]
         d["q_%d_vec" % len(v)] = v.tolist()
+        # Re-parsing indexes an edited chunk again instead of keeping it.
+        d[CHUNK_DIGEST_FLD] = ""
         settings.docStoreConn.update({"id": req["chunk_id"]}, d, search.index_name(tenant_id), doc.kb_id)
         return get_json_result(data=True)
     except Exception as e:
@@ -351,7 +353,8 @@ async def retrieval_test():
                                top,
                                doc_ids, rerank_mdl=rerank_mdl,
                                              highlight=req.get("highlight", False),
-                               rank_feature=labels
+                               rank_feature=labels,
+                               return_vector=False
                                )
         if use_kg:
             ck = settings.kg_retriever.retrieval(question,
@@ -389,7 +392,7 @@ def knowledge_graph():
     for id in sres.ids[:2]:
         ty = sres.field[id]["knowledge_graph_kwd"]
         try:
-            content_json = json.loads(sres.field[id]["content_with_weight"])
+            content_json = load_graph_data(sres.field[id]["content_with_weight"])
         except Exception:
             continue
 
@@ -13,7 +13,6 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-import json
 import logging
 import random
 import re
@@ -36,6 +35,7 @@ from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.db_models import File
 from api.utils.api_utils import get_json_result
 from rag.nlp import search
+from graphrag.utils import load_graph_data
 from api.constants import DATASET_NAME_LIMIT
 from rag.utils.redis_conn import REDIS_CONN
 from rag.utils.doc_store_conn import OrderByExpr
@@ -347,7 +347,7 @@ def knowledge_graph(kb_id):
     for id in sres.ids[:1]:
         ty = sres.field[id]["knowledge_graph_kwd"]
         try:
-            content_json = json.loads(sres.field[id]["content_with_weight"])
+            content_json = load_graph_data(sres.field[id]["content_with_weight"])
         except Exception:
             continue
 
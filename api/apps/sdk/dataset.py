@@ -17,7 +17,6 @@
 
 import logging
 import os
-import json
 from quart import request
 from peewee import OperationalError
 from api.db.db_models import File
@@ -48,6 +47,7 @@ from api.utils.validation_utils import (
     validate_and_parse_request_args,
 )
 from rag.nlp import search
+from graphrag.utils import load_graph_data
 from common.constants import PAGERANK_FLD
 from common import settings
 
@@ -504,7 +504,7 @@ def knowledge_graph(tenant_id, dataset_id):
     for id in sres.ids[:1]:
         ty = sres.field[id]["knowledge_graph_kwd"]
         try:
-            content_json = json.loads(sres.field[id]["content_with_weight"])
+            content_json = load_graph_data(sres.field[id]["content_with_weight"])
         except Exception:
             continue
 
@@ -33,7 +33,7 @@ from api.db.services.file_service import FileService
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.llm_service import LLMBundle
 from api.db.services.tenant_llm_service import TenantLLMService
-from api.db.services.task_service import TaskService, queue_tasks
+from api.db.services.task_service import INCREMENTAL_REPARSE, TaskService, queue_tasks
 from api.db.services.dialog_service import meta_filter, convert_conditions
 from api.utils.api_utils import check_duplicate_ids, construct_json_result, get_error_data_result, get_parser_config, get_result, server_error_response, token_required, \
     request_json
@@ -42,7 +42,7 @@ from rag.app.tag import label_question
 from rag.nlp import rag_tokenizer, search
 from rag.prompts.generator import cross_languages, keyword_extraction
 from common.string_utils import remove_redundant_spaces
-from common.constants import RetCode, LLMType, ParserType, TaskStatus, FileSource
+from common.constants import RetCode, LLMType, ParserType, TaskStatus, FileSource, CHUNK_DIGEST_FLD
 from common import settings
 
 MAXIMUM_OF_UPLOADING_FILES = 256
@@ -761,8 +761,10 @@ async def parse(tenant_id, dataset_id):
             return get_error_data_result("Can't parse document that is currently being processed")
         info = {"run": "1", "progress": 0, "progress_msg": "", "chunk_num": 0, "token_num": 0}
         DocumentService.update_by_id(id, info)
-        settings.docStoreConn.delete({"doc_id": id}, search.index_name(tenant_id), dataset_id)
-        TaskService.filter_delete([Task.doc_id == id])
+        if not INCREMENTAL_REPARSE:
+            # With INCREMENTAL_REPARSE, queue_tasks hands the previous tasks' chunks over and deletes the rest.
+            settings.docStoreConn.delete({"doc_id": id}, search.index_name(tenant_id), dataset_id)
+            TaskService.filter_delete([Task.doc_id == id])
         e, doc = DocumentService.get_by_id(id)
         doc = doc.to_dict()
         doc["tenant_id"] = tenant_id
@@ -1324,6 +1326,8 @@ async def update_chunk(tenant_id, dataset_id, document_id, chunk_id):
     v, c = embd_mdl.encode([doc.name, d["content_with_weight"] if not d.get("question_kwd") else "\n".join(d["question_kwd"])])
     v = 0.1 * v[0] + 0.9 * v[1] if doc.parser_id != ParserType.QA else v[1]
     d["q_%d_vec" % len(v)] = v.tolist()
+    # Re-parsing indexes an edited chunk again instead of keeping it.
+    d[CHUNK_DIGEST_FLD] = ""
     settings.docStoreConn.update({"id": chunk_id}, d, search.index_name(tenant_id), dataset_id)
     return get_result()
 
@@ -1484,6 +1488,7 @@ async def retrieval_test(tenant_id):
             rerank_mdl=rerank_mdl,
             highlight=highlight,
             rank_feature=label_question(question, kbs),
+            return_vector=False,
         )
         if use_kg:
             ck = settings.kg_retriever.retrieval(question, [k.tenant_id for k in kbs], kb_ids, embd_mdl, LLMBundle(kb.tenant_id, LLMType.CHAT))
@@ -1017,7 +1017,7 @@ async def retrieval_test_embedded():
         labels = label_question(question, [kb])
         ranks = settings.retriever.retrieval(
             question, embd_mdl, tenant_ids, kb_ids, page, size, similarity_threshold, vector_similarity_weight, top,
-            doc_ids, rerank_mdl=rerank_mdl, highlight=req.get("highlight"), rank_feature=labels
+            doc_ids, rerank_mdl=rerank_mdl, highlight=req.get("highlight"), rank_feature=labels, return_vector=False
         )
         if use_kg:
             ck = settings.kg_retriever.retrieval(question, tenant_ids, kb_ids, embd_mdl,
@@ -14,7 +14,9 @@
 #  limitations under the License.
 #
 import binascii
+import concurrent.futures
 import logging
+import os
 import re
 import time
 from copy import deepcopy
@@ -45,6 +47,10 @@ from rag.utils.tavily_conn import Tavily
 from common.string_utils import remove_redundant_spaces
 from common import settings
 
+KB_RETRIEVAL_TIMEOUT = int(os.environ.get("KB_RETRIEVAL_TIMEOUT", "120"))
+WEB_SEARCH_TIMEOUT = int(os.environ.get("WEB_SEARCH_TIMEOUT", "20"))
+KG_RETRIEVAL_TIMEOUT = int(os.environ.get("KG_RETRIEVAL_TIMEOUT", "60"))
+
 
 class DialogService(CommonService):
     model = Dialog
@@ -337,6 +343,44 @@ def meta_filter(metas: dict, filters: list[dict]):
     return list(doc_ids)
 
 
+def run_retrieval_sources(sources: dict, time_costs: dict, required=()) -> dict:
+    """Run independent retrieval sources concurrently.
+
+    `sources` maps a source name to (function, timeout in seconds). Returns the results of the
+    sources that finished in time, and sets the time each one took, in ms, in `time_costs`.
+    A source that times out is left out of the results, unless it is `required`, which raises
+    TimeoutError; errors of a source are raised.
+    Every call has threads of its own, so each source starts at once, and a source still running
+    after its timeout only keeps its own thread busy.
+    """
+    if not sources:
+        return {}
+    st = timer()
+
+    def timed(name, func):
+        try:
+            return func()
+        finally:
+            # A source that timed out already has its time set.
+            time_costs.setdefault(name, (timer() - st) * 1000)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="retrieval_source")
+    try:
+        futures = {name: executor.submit(timed, name, func) for name, (func, _) in sources.items()}
+        results = {}
+        for name, (_, timeout) in sources.items():
+            try:
+                results[name] = futures[name].result(timeout=max(0., st + timeout - timer()))
+            except concurrent.futures.TimeoutError:
+                time_costs[name] = (timer() - st) * 1000
+                if name in required:
+                    raise TimeoutError(f"Retrieval source '{name}' did not finish in {timeout}s.")
+                logging.warning(f"Retrieval source '{name}' did not finish in {timeout}s and is skipped.")
+        return results
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def chat(dialog, messages, stream=True, **kwargs):
     assert messages[-1]["role"] == "user", "The last content of this conversation is not from user."
     if not dialog.kb_ids and not dialog.prompt_config.get("tavily_api_key"):
@@ -424,6 +468,7 @@ def chat(dialog, messages, stream=True, **kwargs):
     thought = ""
     kbinfos = {"total": 0, "chunks": [], "doc_aggs": []}
     knowledges = []
+    retrieval_source_time_costs = {}
 
     if attachments is not None and "knowledge" in [p["key"] for p in prompt_config["parameters"]]:
         tenant_ids = list(set([kb.tenant_id for kb in kbs]))
@@ -443,6 +488,17 @@ def chat(dialog, messages, stream=True, **kwargs):
                     vector_similarity_weight=0.3,
                     doc_ids=attachments,
                 ),
+                kb_retrieve_many=partial(
+                    retriever.retrieval_many,
+                    embd_mdl=embd_mdl,
+                    tenant_ids=tenant_ids,
+                    kb_ids=dialog.kb_ids,
+                    page=1,
+                    page_size=dialog.top_n,
+                    similarity_threshold=0.2,
+                    vector_similarity_weight=0.3,
+                    doc_ids=attachments,
+                ),
             )
 
             for think in reasoner.thinking(kbinfos, " ".join(questions)):
@@ -452,7 +508,9 @@ def chat(dialog, messages, stream=True, **kwargs):
                 elif stream:
                     yield think
         else:
-            if embd_mdl:
+            # The knowledge bases, the web and the knowledge graph are searched concurrently,
+            # then merged in a fixed order: knowledge base chunks, web chunks, and the graph chunk first.
+            def kb_retrieval():
                 kbinfos = retriever.retrieval(
                     " ".join(questions),
                     embd_mdl,
@@ -472,16 +530,26 @@ def chat(dialog, messages, stream=True, **kwargs):
                     cks = retriever.retrieval_by_toc(" ".join(questions), kbinfos["chunks"], tenant_ids, chat_mdl, dialog.top_n)
                     if cks:
                         kbinfos["chunks"] = cks
+                return kbinfos
+
+            sources = {}
+            if embd_mdl:
+                sources["Knowledge base"] = (kb_retrieval, KB_RETRIEVAL_TIMEOUT)
             if prompt_config.get("tavily_api_key"):
-                tav = Tavily(prompt_config["tavily_api_key"])
-                tav_res = tav.retrieve_chunks(" ".join(questions))
-                kbinfos["chunks"].extend(tav_res["chunks"])
-                kbinfos["doc_aggs"].extend(tav_res["doc_aggs"])
+                sources["Web search"] = (lambda: Tavily(prompt_config["tavily_api_key"]).retrieve_chunks(" ".join(questions)), WEB_SEARCH_TIMEOUT)
             if prompt_config.get("use_kg"):
-                ck = settings.kg_retriever.retrieval(" ".join(questions), tenant_ids, dialog.kb_ids, embd_mdl,
-                                                       LLMBundle(dialog.tenant_id, LLMType.CHAT))
-                if ck["content_with_weight"]:
-                    kbinfos["chunks"].insert(0, ck)
+                sources["Knowledge graph"] = (lambda: settings.kg_retriever.retrieval(" ".join(questions), tenant_ids, dialog.kb_ids, embd_mdl,
+                                                                                     LLMBundle(dialog.tenant_id, LLMType.CHAT)), KG_RETRIEVAL_TIMEOUT)
+            # Answering without the knowledge bases would go unnoticed, so their timeout is an error.
+            results = run_retrieval_sources(sources, retrieval_source_time_costs, required=("Knowledge base",))
+
+            if results.get("Knowledge base"):
+                kbinfos = results["Knowledge base"]
+            if results.get("Web search"):
+                kbinfos["chunks"].extend(results["Web search"]["chunks"])
+                kbinfos["doc_aggs"].extend(results["Web search"]["doc_aggs"])
+            if results.get("Knowledge graph") and results["Knowledge graph"]["content_with_weight"]:
+                kbinfos["chunks"].insert(0, results["Knowledge graph"])
 
             knowledges = kb_prompt(kbinfos, max_tokens)
 
@@ -560,6 +628,7 @@ def chat(dialog, messages, stream=True, **kwargs):
         refine_question_time_cost = (refine_question_ts - bind_models_ts) * 1000
         retrieval_time_cost = (retrieval_ts - refine_question_ts) * 1000
         generate_result_time_cost = (finish_chat_ts - retrieval_ts) * 1000
+        retrieval_sources_time_cost = "".join(f"    - {source}: {cost:.1f}ms\n" for source, cost in retrieval_source_time_costs.items())
 
         tk_num = num_tokens_from_string(think + answer)
         prompt += "\n\n### Query:\n%s" % " ".join(questions)
@@ -572,6 +641,7 @@ def chat(dialog, messages, stream=True, **kwargs):
             f"  - Bind models: {bind_embedding_time_cost:.1f}ms\n"
             f"  - Query refinement(LLM): {refine_question_time_cost:.1f}ms\n"
             f"  - Retrieval: {retrieval_time_cost:.1f}ms\n"
+            f"{retrieval_sources_time_cost}"
             f"  - Generate answer: {generate_result_time_cost:.1f}ms\n\n"
             "## Token usage:\n"
             f"  - Generated tokens(approximately): {tk_num}\n"
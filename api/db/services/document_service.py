@@ -15,8 +15,10 @@
 #
 import json
 import logging
+import os
 import random
 import re
+import time
 from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
@@ -34,13 +36,28 @@ from api.db.db_utils import bulk_insert_into_db
 from api.db.services.common_service import CommonService
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from common.misc_utils import get_uuid
-from common.time_utils import current_timestamp, get_format_time
+from common.time_utils import current_timestamp, datetime_format, get_format_time
 from common.constants import LLMType, ParserType, StatusEnum, TaskStatus, SVR_CONSUMER_GROUP_NAME
 from rag.nlp import rag_tokenizer, search
 from rag.utils.redis_conn import REDIS_CONN
 from rag.utils.doc_store_conn import OrderByExpr
 from common import settings
 
+# Documents whose tasks were created or reported progress since their progress was last aggregated.
+DOC_PROGRESS_CHANGED_KEY = "doc_progress:changed"
+# Documents waiting in the task queue, whose "tasks are ahead in the queue" message is refreshed.
+DOC_PROGRESS_QUEUED_KEY = "doc_progress:queued"
+DOC_PROGRESS_BATCH_SIZE = int(os.environ.get("DOC_PROGRESS_BATCH_SIZE", "500"))
+DOC_PROGRESS_QUEUED_REFRESH = int(os.environ.get("DOC_PROGRESS_QUEUED_REFRESH", "30"))
+DOC_PROGRESS_FULL_SYNC = int(os.environ.get("DOC_PROGRESS_FULL_SYNC", "600"))
+
+_progress_synced_at = {"queued": 0.0, "all": 0.0}
+
+
+def mark_doc_progress_changed(*doc_ids):
+    """Have the progress of the documents aggregated again from their tasks by `DocumentService.update_progress`."""
+    REDIS_CONN.sadd(DOC_PROGRESS_CHANGED_KEY, *[doc_id for doc_id in doc_ids if doc_id])
+
 
 class DocumentService(CommonService):
     model = Document
@@ -373,17 +390,18 @@ class DocumentService(CommonService):
     def get_unfinished_docs(cls):
         fields = [cls.model.id, cls.model.process_begin_at, cls.model.parser_config, cls.model.progress_msg,
                   cls.model.run, cls.model.parser_id]
+        docs = cls.model.select(*fields).where(cls._unfinished())
+        return list(docs.dicts())
+
+    @classmethod
+    def _unfinished(cls):
         unfinished_task_query = Task.select(Task.doc_id).where(
             (Task.progress >= 0) & (Task.progress < 1)
         )
-
-        docs = cls.model.select(*fields) \
-            .where(
-            cls.model.status == StatusEnum.VALID.value,
-            ~(cls.model.type == FileType.VIRTUAL.value),
-            (((cls.model.progress < 1) & (cls.model.progress > 0)) |
-             (cls.model.id.in_(unfinished_task_query)))) # including unfinished tasks like GraphRAG, RAPTOR and Mindmap
-        return list(docs.dicts())
+        return ((cls.model.status == StatusEnum.VALID.value) &
+                ~(cls.model.type == FileType.VIRTUAL.value) &
+                (((cls.model.progress < 1) & (cls.model.progress > 0)) |
+                 (cls.model.id.in_(unfinished_task_query))))  # including unfinished tasks like GraphRAG, RAPTOR and Mindmap
 
     @classmethod
     @DB.connection_context()
@@ -663,9 +681,25 @@ class DocumentService(CommonService):
     @classmethod
     @DB.connection_context()
     def update_progress(cls):
-        docs = cls.get_unfinished_docs()
+        """Aggregate the progress of the documents whose tasks changed, of those waiting in the queue every
+        DOC_PROGRESS_QUEUED_REFRESH seconds, and of all unfinished documents every DOC_PROGRESS_FULL_SYNC seconds."""
+        now = time.monotonic()
+        doc_ids = set()
+        while True:
+            popped = REDIS_CONN.spop(DOC_PROGRESS_CHANGED_KEY, DOC_PROGRESS_BATCH_SIZE)
+            doc_ids.update(popped)
+            if len(popped) < DOC_PROGRESS_BATCH_SIZE:
+                break
+        if now - _progress_synced_at["queued"] >= DOC_PROGRESS_QUEUED_REFRESH:
+            _progress_synced_at["queued"] = now
+            doc_ids.update(REDIS_CONN.smembers(DOC_PROGRESS_QUEUED_KEY) or [])
+        # Catches up with changes made without an event, e.g. by task executors of a former version.
+        if DOC_PROGRESS_FULL_SYNC > 0 and now - _progress_synced_at["all"] >= DOC_PROGRESS_FULL_SYNC:
+            _progress_synced_at["all"] = now
+            doc_ids.update(d["id"] for d in cls.get_unfinished_docs())
 
-        cls._sync_progress(docs)
+        # As get_unfinished_docs, events only re-aggregate unfinished documents: a canceled one stays canceled.
+        cls._sync_progress([{"id": doc_id} for doc_id in doc_ids], unfinished_only=True)
 
 
     @classmethod
@@ -679,63 +713,120 @@ class DocumentService(CommonService):
 
     @classmethod
     @DB.connection_context()
-    def _sync_progress(cls, docs:list[dict]):
-        from api.db.services.task_service import TaskService
+    def _sync_progress(cls, docs:list[dict], unfinished_only=False):
+        doc_ids = list(dict.fromkeys(d["id"] for d in docs))
+        for i in range(0, len(doc_ids), DOC_PROGRESS_BATCH_SIZE):
+            batch = doc_ids[i:i + DOC_PROGRESS_BATCH_SIZE]
+            try:
+                cls._sync_progress_batch(batch, unfinished_only)
+            except Exception:
+                # Marked as changed again, so the next pass retries them rather than the next full sync.
+                logging.exception("DocumentService._sync_progress got exception")
+                REDIS_CONN.sadd(DOC_PROGRESS_CHANGED_KEY, *batch)
 
-        for d in docs:
+    @classmethod
+    def _sync_progress_batch(cls, doc_ids: list[str], unfinished_only=False):
+        fields = [cls.model.id, cls.model.process_begin_at, cls.model.progress, cls.model.progress_msg, cls.model.run]
+        condition = cls.model.id.in_(doc_ids)
+        if unfinished_only:
+            condition &= cls._unfinished()
+        docs = list(cls.model.select(*fields).where(condition))
+        tasks = {}
+        for t in Task.select(Task.doc_id, Task.task_type, Task.progress, Task.progress_msg, Task.priority).where(
+                Task.doc_id.in_(doc_ids)).order_by(Task.create_time):
+            tasks.setdefault(t.doc_id, []).append(t)
+
+        queue_lengths = {}
+
+        def queue_length(priority):
+            if priority not in queue_lengths:
+                queue_lengths[priority] = get_queue_length(priority)
+            return queue_lengths[priority]
+
+        changed, queued, not_queued = [], [], []
+        # Documents left out are no longer waiting in the queue either.
+        not_queued.extend(set(doc_ids) - {doc.id for doc in docs})
+        for doc in docs:
             try:
-                tsks = TaskService.query(doc_id=d["id"], order_by=Task.create_time)
-                if not tsks:
-                    continue
-                msg = []
-                prg = 0
-                finished = True
-                bad = 0
-                e, doc = DocumentService.get_by_id(d["id"])
-                status = doc.run  # TaskStatus.RUNNING.value
-                doc_progress = doc.progress if doc and doc.progress else 0.0
-                special_task_running = False
-                priority = 0
-                for t in tsks:
-                    task_type = (t.task_type or "").lower()
-                    if task_type in PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES:
-                        special_task_running = True
-                    if 0 <= t.progress < 1:
-                        finished = False
-                    if t.progress == -1:
-                        bad += 1
-                    prg += t.progress if t.progress >= 0 else 0
-                    if t.progress_msg.strip():
-                        msg.append(t.progress_msg)
-                    priority = max(priority, t.priority)
-                prg /= len(tsks)
-                if finished and bad:
-                    prg = -1
-                    status = TaskStatus.FAIL.value
-                elif finished:
-                    prg = 1
-                    status = TaskStatus.DONE.value
-
-                # only for special task and parsed docs and unfinished
-                freeze_progress = special_task_running and doc_progress >= 1 and not finished
-                msg = "\n".join(sorted(msg))
-                info = {
-                    "process_duration": datetime.timestamp(
-                        datetime.now()) -
-                                       d["process_begin_at"].timestamp(),
-                    "run": status}
-                if prg != 0 and not freeze_progress:
-                    info["progress"] = prg
-                if msg:
-                    info["progress_msg"] = msg
-                    if msg.endswith("created task graphrag") or msg.endswith("created task raptor") or msg.endswith("created task mindmap"):
-                        info["progress_msg"] += "\n%d tasks are ahead in the queue..."%get_queue_length(priority)
-                else:
-                    info["progress_msg"] = "%d tasks are ahead in the queue..."%get_queue_length(priority)
-                cls.update_by_id(d["id"], info)
+                info = cls._aggregate_progress(doc, tasks.get(doc.id), queue_length)
             except Exception as e:
                 if str(e).find("'0'") < 0:
                     logging.exception("fetch task exception")
+                continue
+            if info is None:
+                not_queued.append(doc.id)
+                continue
+            (queued if info.pop("queued") else not_queued).append(doc.id)
+            if (info["run"], info.get("progress", doc.progress), info["progress_msg"]) == (doc.run, doc.progress, doc.progress_msg):
+                continue
+            info["update_time"] = current_timestamp()
+            info["update_date"] = datetime_format(datetime.now())
+            for k, v in info.items():
+                setattr(doc, k, v)
+            changed.append(doc)
+
+        if changed:
+            # Only the documents whose aggregate changed are written, a batch of them per statement.
+            with DB.atomic():
+                cls.model.bulk_update(changed, fields=[cls.model.progress, cls.model.progress_msg, cls.model.run,
+                                                       cls.model.process_duration, cls.model.update_time,
+                                                       cls.model.update_date], batch_size=100)
+        REDIS_CONN.sadd(DOC_PROGRESS_QUEUED_KEY, *queued)
+        REDIS_CONN.srem(DOC_PROGRESS_QUEUED_KEY, *not_queued)
+
+    @staticmethod
+    def _aggregate_progress(doc, tsks, queue_length) -> dict | None:
+        """Fields of `doc` summing up the progress of its tasks, and whether it waits in the queue; None without tasks."""
+        if not tsks:
+            return None
+        msg = []
+        prg = 0
+        finished = True
+        bad = 0
+        status = doc.run  # TaskStatus.RUNNING.value
+        doc_progress = doc.progress if doc.progress else 0.0
+        special_task_running = False
+        priority = 0
+        for t in tsks:
+            task_type = (t.task_type or "").lower()
+            if task_type in PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES:
+                special_task_running = True
+            if 0 <= t.progress < 1:
+                finished = False
+            if t.progress == -1:
+                bad += 1
+            prg += t.progress if t.progress >= 0 else 0
+            if t.progress_msg.strip():
+                msg.append(t.progress_msg)
+            priority = max(priority, t.priority)
+        prg /= len(tsks)
+        if finished and bad:
+            prg = -1
+            status = TaskStatus.FAIL.value
+        elif finished:
+            prg = 1
+            status = TaskStatus.DONE.value
+
+        # only for special task and parsed docs and unfinished
+        freeze_progress = special_task_running and doc_progress >= 1 and not finished
+        msg = "\n".join(sorted(msg))
+        info = {
+            "process_duration": datetime.timestamp(
+                datetime.now()) -
+                               doc.process_begin_at.timestamp(),
+            "run": status,
+            "queued": False}
+        if prg != 0 and not freeze_progress:
+            info["progress"] = prg
+        if msg:
+            info["progress_msg"] = msg
+            if msg.endswith("created task graphrag") or msg.endswith("created task raptor") or msg.endswith("created task mindmap"):
+                info["progress_msg"] += "\n%d tasks are ahead in the queue..."%queue_length(priority)
+                info["queued"] = True
+        else:
+            info["progress_msg"] = "%d tasks are ahead in the queue..."%queue_length(priority)
+            info["queued"] = True
+        return info
 
     @classmethod
     @DB.connection_context()
@@ -876,6 +967,7 @@ def queue_raptor_o_graphrag_tasks(sample_doc_id, ty, priority, fake_doc_id="", d
     task["doc_ids"] = doc_ids
     DocumentService.begin2parse(sample_doc_id["id"], keep_progress=True)
     assert REDIS_CONN.queue_product(settings.get_svr_queue_name(priority), message=task), "Can't access Redis. Please check the Redis' status."
+    mark_doc_progress_changed(sample_doc_id["id"])
     return task["id"]
 
 
@@ -16,27 +16,33 @@
 import logging
 import os
 import random
+from collections import Counter
 import xxhash
 from datetime import datetime
 
 from api.db.db_utils import bulk_insert_into_db
 from deepdoc.parser import PdfParser
-from peewee import JOIN
+from peewee import JOIN, fn
 from api.db.db_models import DB, File2Document, File
 from api.db import FileType
 from api.db.db_models import Task, Document, Knowledgebase, Tenant
 from api.db.services.common_service import CommonService
-from api.db.services.document_service import DocumentService
+from api.db.services.document_service import DocumentService, mark_doc_progress_changed
 from common.misc_utils import get_uuid
 from common.time_utils import current_timestamp
 from common.constants import StatusEnum, TaskStatus
 from deepdoc.parser.excel_parser import RAGFlowExcelParser
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.task_cost import TASK_SPLIT_BY_COST, cost_estimate, pdf_page_features, split_by_cost
 from common import settings
 from rag.nlp import search
 
 CANVAS_DEBUG_DOC_ID = "dataflow_x"
 GRAPH_RAPTOR_FAKE_DOC_ID = "graph_raptor_x"
+# Re-parsing a document only re-indexes the chunks which changed, see rag/svr/incremental_chunks.py.
+INCREMENTAL_REPARSE = int(os.environ.get("INCREMENTAL_REPARSE", "0"))
+# Ids of the chunks built by the tasks of the current parse of a document.
+DOC_BUILT_CHUNKS_KEY = "doc_built_chunks:{}"
 
 def trim_header_by_lines(text: str, max_length) -> str:
     # Trim header text to maximum length while preserving line breaks
@@ -159,6 +165,7 @@ class TaskService(CommonService):
         fields = [
             cls.model.id,
             cls.model.from_page,
+            cls.model.to_page,
             cls.model.progress,
             cls.model.digest,
             cls.model.chunk_ids,
@@ -186,6 +193,20 @@ class TaskService(CommonService):
         """
         cls.model.update(chunk_ids=chunk_ids).where(cls.model.id == id).execute()
 
+    @classmethod
+    @DB.connection_context()
+    def append_chunk_ids(cls, id: str, chunk_ids: str):
+        """Append chunk IDs to those already associated with a task.
+
+        Unlike `update_chunk_ids`, only the new IDs are sent to the database, so recording
+        the chunks of a large document batch by batch does not rewrite the whole list each time.
+
+        Args:
+            id (str): The unique identifier of the task.
+            chunk_ids (str): Space-separated string of the new chunk identifiers.
+        """
+        cls.model.update(chunk_ids=fn.CONCAT(fn.COALESCE(cls.model.chunk_ids, ""), " " + chunk_ids)).where(cls.model.id == id).execute()
+
     @classmethod
     @DB.connection_context()
     def get_ongoing_doc_name(cls):
@@ -315,6 +336,7 @@ class TaskService(CommonService):
 
         process_duration = (datetime.now() - task.begin_at).total_seconds()
         cls.model.update(process_duration=process_duration).where(cls.model.id == id).execute()
+        mark_doc_progress_changed(task.doc_id)
 
     @classmethod
     @DB.connection_context()
@@ -342,6 +364,10 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         - For Excel documents, tasks are created per row range
         - Task digests are calculated for optimization and reuse
         - Previous task chunks may be reused if available
+        - With INCREMENTAL_REPARSE, the chunks of previous tasks are handed over to the new tasks
+          of the same pages, which only index the chunks that changed
+        - With TASK_SPLIT_BY_COST, PDF page ranges are cut to balance the estimated cost of their pages
+          rather than their number, see rag/utils/task_cost.py
     """
 
     def new_task():
@@ -355,27 +381,41 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         }
 
     parse_task_array = []
+    # Estimated costs of the tasks, only queued along with them.
+    cost_estimates = {}
 
     if doc["type"] == FileType.PDF.value:
-        file_bin = settings.STORAGE_IMPL.get(bucket, name)
         do_layout = doc["parser_config"].get("layout_recognize", "DeepDOC")
-        pages = PdfParser.total_page_number(doc["name"], file_bin)
-        if pages is None:
-            pages = 0
         page_size = doc["parser_config"].get("task_page_size") or 12
         if doc["parser_id"] == "paper":
             page_size = doc["parser_config"].get("task_page_size") or 22
         if doc["parser_id"] in ["one", "knowledge_graph"] or do_layout != "DeepDOC" or doc["parser_config"].get("toc_extraction", False):
             page_size = 10 ** 9
+        features = None
+        if TASK_SPLIT_BY_COST and page_size < 10 ** 9:
+            features = pdf_page_features(doc, bucket, name, lambda: settings.STORAGE_IMPL.get(bucket, name))
+        if features is not None:
+            pages = len(features)
+        else:
+            file_bin = settings.STORAGE_IMPL.get(bucket, name)
+            pages = PdfParser.total_page_number(doc["name"], file_bin)
+        if pages is None:
+            pages = 0
         page_ranges = doc["parser_config"].get("pages") or [(1, 10 ** 5)]
         for s, e in page_ranges:
             s -= 1
             s = max(0, s)
             e = min(e - 1, pages)
-            for p in range(s, e, page_size):
+            if features is not None:
+                ranges = split_by_cost(features, s, e, page_size)
+            else:
+                ranges = [(p, min(p + page_size, e)) for p in range(s, e, page_size)]
+            for p, q in ranges:
                 task = new_task()
                 task["from_page"] = p
-                task["to_page"] = min(p + page_size, e)
+                task["to_page"] = q
+                if features is not None:
+                    cost_estimates[task["id"]] = cost_estimate(features, p, q)
                 parse_task_array.append(task)
 
     elif doc["parser_id"] == "table":
@@ -410,6 +450,8 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     if prev_tasks:
         for task in parse_task_array:
             ck_num += reuse_prev_task_chunks(task, prev_tasks, chunking_config)
+        if INCREMENTAL_REPARSE:
+            inherit_prev_task_chunks(parse_task_array, prev_tasks)
         TaskService.filter_delete([Task.doc_id == doc["id"]])
         pre_chunk_ids = []
         for pre_task in prev_tasks:
@@ -424,10 +466,19 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     DocumentService.begin2parse(doc["id"])
 
     unfinished_task_array = [task for task in parse_task_array if task["progress"] < 1.0]
+    if INCREMENTAL_REPARSE:
+        REDIS_CONN.delete(DOC_BUILT_CHUNKS_KEY.format(doc["id"]))
     for unfinished_task in unfinished_task_array:
+        if INCREMENTAL_REPARSE:
+            # The executor reads the inherited chunk ids from the task itself.
+            unfinished_task = {k: v for k, v in unfinished_task.items() if k != "chunk_ids"}
+            unfinished_task["incremental_reparse"] = True
+        if unfinished_task["id"] in cost_estimates:
+            unfinished_task = {**unfinished_task, "cost_estimate": cost_estimates[unfinished_task["id"]]}
         assert REDIS_CONN.queue_product(
             settings.get_svr_queue_name(priority), message=unfinished_task
         ), "Can't access Redis. Please check the Redis' status."
+    mark_doc_progress_changed(doc["id"])
 
 
 def reuse_prev_task_chunks(task: dict, prev_tasks: list[dict], chunking_config: dict):
@@ -477,6 +528,29 @@ def reuse_prev_task_chunks(task: dict, prev_tasks: list[dict], chunking_config:
     return len(task["chunk_ids"].split())
 
 
+def inherit_prev_task_chunks(tasks: list[dict], prev_tasks: list[dict]):
+    """Hand the chunks of previous tasks over to the new tasks of the same pages, instead of deleting them.
+
+    The executor then only indexes the chunks which changed, and deletes those no longer built. A chunk
+    listed by several previous tasks is handed over to none, so that exactly one task may delete it.
+
+    Args:
+        tasks (list[dict]): New tasks of the document, some of which may reuse previous chunks already.
+        prev_tasks (list[dict]): Previous tasks of the document. The chunk ids handed over are removed from them.
+    """
+    owners = Counter(chunk_id for t in prev_tasks + tasks for chunk_id in set((t.get("chunk_ids") or "").split()))
+    for task in tasks:
+        if task["progress"] >= 1.0:
+            continue
+        for prev_task in prev_tasks:
+            if prev_task["chunk_ids"] and prev_task.get("from_page", 0) == task.get("from_page", 0) \
+                    and prev_task.get("to_page") == task.get("to_page"):
+                chunk_ids = prev_task["chunk_ids"].split()
+                task["chunk_ids"] = " ".join(i for i in chunk_ids if owners[i] == 1)
+                prev_task["chunk_ids"] = " ".join(i for i in chunk_ids if owners[i] > 1)
+                break
+
+
 def cancel_all_task_of(doc_id):
     for t in TaskService.query(doc_id=doc_id):
         try:
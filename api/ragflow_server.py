@@ -46,6 +46,7 @@ from rag.utils.redis_conn import RedisDistributedLock
 stop_event = threading.Event()
 
 RAGFLOW_DEBUGPY_LISTEN = int(os.environ.get('RAGFLOW_DEBUGPY_LISTEN', "0"))
+DOC_PROGRESS_INTERVAL = float(os.environ.get("DOC_PROGRESS_INTERVAL", "2"))
 
 def update_progress():
     lock_value = str(uuid.uuid4())
@@ -63,7 +64,7 @@ def update_progress():
                 redis_lock.release()
             except Exception:
                 logging.exception("update_progress exception")
-            stop_event.wait(6)
+            stop_event.wait(DOC_PROGRESS_INTERVAL)
 
 def signal_handler(sig, frame):
     logging.info("Received interrupt signal, shutting down...")
@@ -193,6 +193,7 @@ class Storage(Enum):
 # ENV_WORKER_HEARTBEAT_TIMEOUT = "WORKER_HEARTBEAT_TIMEOUT"
 # ENV_TRACE_MALLOC_ENABLED = "TRACE_MALLOC_ENABLED"
 
+CHUNK_DIGEST_FLD = "chunk_digest_kwd"
 PAGERANK_FLD = "pagerank_fea"
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_CONSUMER_GROUP_NAME = "rag_flow_svr_task_broker"
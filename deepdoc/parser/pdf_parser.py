@@ -21,7 +21,8 @@ import random
 import re
 import sys
 import threading
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
 from copy import deepcopy
 from io import BytesIO
 from timeit import default_timer as timer
@@ -36,7 +37,9 @@ from pypdf import PdfReader as pdf2_read
 
 from common.file_utils import get_project_base_directory
 from common.misc_utils import pip_install_torch
-from deepdoc.vision import OCR, AscendLayoutRecognizer, LayoutRecognizer, Recognizer, TableStructureRecognizer
+from deepdoc.vision import OCR, AscendLayoutRecognizer, LayoutRecognizer, Recognizer, SpatialIndex, TableStructureRecognizer
+from deepdoc.vision.ocr import OCR_DETECT_BATCH_SIZE
+from deepdoc.vision.ocr_pool import get_ocr_pool
 from rag.app.picture import vision_llm_chunk as picture_vision_llm_chunk
 from rag.nlp import rag_tokenizer
 from rag.prompts.generator import vision_llm_describe_prompt
@@ -46,6 +49,56 @@ LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
+# Render, extract the characters of and OCR this many pages at a time, keeping the pages already OCRed
+# PNG-compressed. 0 renders all pages up front.
+PDF_PAGE_WINDOW = int(os.environ.get("PDF_PAGE_WINDOW", "0"))
+
+
+class PageImages:
+    """
+    Page images kept as lossless PNG and decoded on access.
+
+    Layout and table recognition, `crop()` and `_extract_table_figure` read whole pages after OCR,
+    at positions only known once these have run, so pages are compressed rather than released:
+    memory still grows with the number of pages, by their PNG size rather than their bitmaps.
+    At most `cached` decoded pages are kept, the most recently used ones.
+    """
+
+    def __init__(self, cached: int):
+        self._pngs = []
+        self._decoded = OrderedDict()
+        self._cached = max(1, cached)
+        self._lock = threading.Lock()
+
+    def append(self, img):
+        buf = BytesIO()
+        img.save(buf, format="PNG", compress_level=1)
+        self._pngs.append(buf.getvalue())
+
+    def __len__(self):
+        return len(self._pngs)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = range(len(self))[i]
+        with self._lock:
+            img = self._decoded.get(i)
+            if img is not None:
+                self._decoded.move_to_end(i)
+                return img
+        img = Image.open(BytesIO(self._pngs[i]))
+        img.load()
+        with self._lock:
+            self._decoded[i] = img
+            while len(self._decoded) > self._cached:
+                self._decoded.popitem(last=False)
+        return img
+
 
 class RAGFlowPdfParser:
     def __init__(self, **kwargs):
@@ -62,9 +115,18 @@ class RAGFlowPdfParser:
         """
 
         self.ocr = OCR()
+        self.ocr_pool = None
         self.parallel_limiter = None
         if settings.PARALLEL_DEVICES > 1:
             self.parallel_limiter = [trio.CapacityLimiter(1) for _ in range(settings.PARALLEL_DEVICES)]
+        elif settings.PARALLEL_DEVICES == 0:
+            # Without GPUs, pages are OCRed in parallel by the OCR worker processes, if there are any.
+            self.ocr_pool = get_ocr_pool()
+            if self.ocr_pool:
+                self.parallel_limiter = [trio.CapacityLimiter(1) for _ in range(self.ocr_pool.workers)]
+            elif OCR_DETECT_BATCH_SIZE > 1:
+                # Pages are OCRed concurrently, so that their text detection is batched.
+                self.parallel_limiter = [trio.CapacityLimiter(OCR_DETECT_BATCH_SIZE)]
 
         layout_recognizer_type = os.getenv("LAYOUT_RECOGNIZER_TYPE", "onnx").lower()
         if layout_recognizer_type not in ["onnx", "ascend"]:
@@ -246,16 +308,19 @@ class RAGFlowPdfParser:
         spans = gather(r".*spanning")
         clmns = sorted([r for r in self.tb_cpns if re.match(r"table column$", r["label"])], key=lambda x: (x["pn"], x["layoutno"], x["x0"]))
         clmns = Recognizer.layouts_cleanup(self.boxes, clmns, 5, 0.5)
-        for b in self.boxes:
-            if b.get("layout_type", "") != "table":
-                continue
-            ii = Recognizer.find_overlapped_with_threshold(b, rows, thr=0.3)
+        tbl_boxes = [b for b in self.boxes if b.get("layout_type", "") == "table"]
+        row_ii = SpatialIndex(rows).find_overlapped_with_threshold(tbl_boxes, thr=0.3)
+        header_ii = SpatialIndex(headers).find_overlapped_with_threshold(tbl_boxes, thr=0.3)
+        clmn_ii = SpatialIndex(clmns).find_horizontally_tightest_fit(tbl_boxes)
+        span_ii = SpatialIndex(spans).find_overlapped_with_threshold(tbl_boxes, thr=0.3)
+        for k, b in enumerate(tbl_boxes):
+            ii = row_ii[k]
             if ii is not None:
                 b["R"] = ii
                 b["R_top"] = rows[ii]["top"]
                 b["R_bott"] = rows[ii]["bottom"]
 
-            ii = Recognizer.find_overlapped_with_threshold(b, headers, thr=0.3)
+            ii = header_ii[k]
             if ii is not None:
                 b["H_top"] = headers[ii]["top"]
                 b["H_bott"] = headers[ii]["bottom"]
@@ -263,13 +328,13 @@ class RAGFlowPdfParser:
                 b["H_right"] = headers[ii]["x1"]
                 b["H"] = ii
 
-            ii = Recognizer.find_horizontally_tightest_fit(b, clmns)
+            ii = clmn_ii[k]
             if ii is not None:
                 b["C"] = ii
                 b["C_left"] = clmns[ii]["x0"]
                 b["C_right"] = clmns[ii]["x1"]
 
-            ii = Recognizer.find_overlapped_with_threshold(b, spans, thr=0.3)
+            ii = span_ii[k]
             if ii is not None:
                 b["H_top"] = spans[ii]["top"]
                 b["H_bott"] = spans[ii]["bottom"]
@@ -278,14 +343,14 @@ class RAGFlowPdfParser:
                 b["SP"] = ii
 
     def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+        ocr = self.ocr_pool or self.ocr
         start = timer()
-        bxs = self.ocr.detect(np.array(img), device_id)
+        bxs = ocr.detect(np.array(img), device_id)
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
         if not bxs:
-            self.boxes.append([])
-            return
+            return []
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [
@@ -297,8 +362,7 @@ class RAGFlowPdfParser:
         )
 
         # merge chars in the same rect
-        for c in chars:
-            ii = Recognizer.find_overlapped(c, bxs)
+        for c, ii in zip(chars, SpatialIndex(bxs).find_overlapped(chars)):
             if ii is None:
                 self.lefted_chars.append(c)
                 continue
@@ -332,7 +396,7 @@ class RAGFlowPdfParser:
                 b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
                 boxes_to_reg.append(b)
             del b["txt"]
-        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
+        texts = ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
         for i in range(len(boxes_to_reg)):
             boxes_to_reg[i]["text"] = texts[i]
             del boxes_to_reg[i]["box_image"]
@@ -340,11 +404,17 @@ class RAGFlowPdfParser:
         bxs = [b for b in bxs if b["text"]]
         if self.mean_height[pagenum - 1] == 0:
             self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
-        self.boxes.append(bxs)
+        return bxs
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
-        self.boxes, self.page_layout = self.layouter(self.page_images, self.boxes, ZM, drop=drop)
+        layout_futures = getattr(self, "layout_futures", None)
+        if layout_futures and len(layout_futures) == len(self.page_images):
+            layouts = [f.result() for f in layout_futures]
+            self.boxes, self.page_layout = self.layouter(self.page_images, self.boxes, ZM, drop=drop, layouts=layouts)
+        else:
+            self.boxes, self.page_layout = self.layouter(self.page_images, self.boxes, ZM, drop=drop)
+        self.layout_futures = []
         # cumlative Y
         for i in range(len(self.boxes)):
             self.boxes[i]["top"] += self.page_cum_height[self.boxes[i]["page_number"] - 1]
@@ -1019,7 +1089,47 @@ class RAGFlowPdfParser:
         except Exception:
             logging.exception("total_page_number")
 
-    def __images__(self, fnm, zoomin=3, page_from=0, page_to=299, callback=None):
+    @staticmethod
+    def page_features(fnm, binary=None):
+        """(has a text layer, number of images) of each page, read from the page resources only:
+        content streams are neither parsed nor rendered."""
+
+        def resolve(obj):
+            return obj.get_object() if obj is not None else {}
+
+        def images(resources, depth=0):
+            n = 0
+            xobjects = resolve(resources.get("/XObject"))
+            for name in xobjects:
+                xobject = resolve(xobjects[name])
+                if xobject.get("/Subtype") == "/Image":
+                    n += 1
+                elif xobject.get("/Subtype") == "/Form" and depth < 2:
+                    n += images(resolve(xobject.get("/Resources")), depth + 1)
+            return n
+
+        try:
+            with pdf2_read(fnm if not binary else BytesIO(binary)) as pdf:
+                features = []
+                for page in pdf.pages:
+                    resources = resolve(page.get("/Resources"))
+                    features.append((bool(resolve(resources.get("/Font"))), images(resources)))
+                return features
+        except Exception:
+            logging.exception("page_features")
+
+    def __page_chars(self, page):
+        return [c for c in page.dedupe_chars().chars if self._has_color(c)]
+
+    @staticmethod
+    def __chars_english(chars):
+        return bool(re.search(r"[a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(random.choices([c["text"] for c in chars], k=min(100, len(chars))))))
+
+    def __images__(self, fnm, zoomin=3, page_from=0, page_to=299, callback=None, prefetch_layouts=False):
+        """
+        Render and OCR the pages. With `prefetch_layouts`, for callers running `_layouts_rec` next,
+        the layout of every page is recognized in the background while the following pages are OCRed.
+        """
         self.lefted_chars = []
         self.mean_height = []
         self.mean_width = []
@@ -1028,15 +1138,33 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
+        page_count = 0
+        page_english, page_has_chars = [], []
         start = timer()
         try:
             with sys.modules[LOCK_KEY_pdfplumber]:
                 with pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm)) as pdf:
                     self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
+                    page_count = len(self.pdf.pages[page_from:page_to])
+                    if PDF_PAGE_WINDOW > 0:
+                        self.page_images = PageImages(PDF_PAGE_WINDOW)
+                    else:
+                        self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
 
                     try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
+                        if PDF_PAGE_WINDOW > 0:
+                            # The chars of a window are extracted when it is rendered; up front, each page is
+                            # only sampled for the language, and its parsed objects are released.
+                            self.page_chars = []
+                            page_english, page_has_chars = [], []
+                            for page in self.pdf.pages[page_from:page_to]:
+                                chars = self.__page_chars(page)
+                                page_english.append(self.__chars_english(chars))
+                                page_has_chars.append(bool(chars))
+                                self.page_chars.append([])
+                                page.close()
+                        else:
+                            self.page_chars = [self.__page_chars(page) for page in self.pdf.pages[page_from:page_to]]
                     except Exception as e:
                         logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
                         self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
@@ -1070,14 +1198,19 @@ class RAGFlowPdfParser:
             logging.warning("Miss outlines")
 
         logging.debug("Images converted.")
-        self.is_english = [
-            re.search(r"[a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i])))))
-            for i in range(len(self.page_chars))
-        ]
-        if sum([1 if e else 0 for e in self.is_english]) > len(self.page_images) / 2:
+        if PDF_PAGE_WINDOW <= 0:
+            page_english = [self.__chars_english(chars) for chars in self.page_chars]
+            page_has_chars = [bool(chars) for chars in self.page_chars]
+        if sum([1 if e else 0 for e in page_english]) > page_count / 2:
             self.is_english = True
         else:
             self.is_english = False
+        has_chars = any(page_has_chars)
+        page_boxes = {}
+        self.layout_futures = []
+        layout_executor = None
+        if prefetch_layouts and isinstance(self.layouter, LayoutRecognizer) and not self.layouter.client:
+            layout_executor = ThreadPoolExecutor(max_workers=1)
 
         async def __img_ocr(i, id, img, chars, limiter):
             j = 0
@@ -1091,42 +1224,77 @@ class RAGFlowPdfParser:
                     chars[j]["text"] += " "
                 j += 1
 
+            # Pages OCRed in parallel finish out of order, their boxes are put back in page order below.
             if limiter:
                 async with limiter:
-                    await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
+                    page_boxes[i] = await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
             else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
+                page_boxes[i] = self.__ocr(i + 1, img, chars, zoomin, id)
 
             if callback and i % 6 == 5:
-                callback((i + 1) * 0.6 / len(self.page_images))
+                callback((i + 1) * 0.6 / page_count)
+
+        def __render(pages_from, pages_to):
+            with sys.modules[LOCK_KEY_pdfplumber]:
+                with pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm)) as pdf:
+                    pages = pdf.pages[pages_from:pages_to]
+                    imgs = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for p in pages]
+                    try:
+                        chars = [self.__page_chars(p) for p in pages]
+                    except Exception as e:
+                        logging.warning(f"Failed to extract characters for pages {pages_from}-{pages_to}: {str(e)}")
+                        chars = [[] for _ in pages]
+                    return imgs, chars
 
         async def __img_ocr_launcher():
-            def __ocr_preprocess():
+            def __ocr_preprocess(i, img):
                 chars = self.page_chars[i] if not self.is_english else []
                 self.mean_height.append(np.median(sorted([c["height"] for c in chars])) if chars else 0)
                 self.mean_width.append(np.median(sorted([c["width"] for c in chars])) if chars else 8)
                 self.page_cum_height.append(img.size[1] / zoomin)
+                if layout_executor:
+                    self.layout_futures.append(layout_executor.submit(self.layouter.forward, [img], 0.2))
                 return chars
 
-            if self.parallel_limiter:
-                async with trio.open_nursery() as nursery:
-                    for i, img in enumerate(self.page_images):
-                        chars = __ocr_preprocess()
+            async def __ocr_pages(first, imgs):
+                if self.parallel_limiter:
+                    async with trio.open_nursery() as nursery:
+                        for i, img in enumerate(imgs, start=first):
+                            chars = __ocr_preprocess(i, img)
 
-                        nursery.start_soon(__img_ocr, i, i % settings.PARALLEL_DEVICES, img, chars, self.parallel_limiter[i % settings.PARALLEL_DEVICES])
-                        await trio.sleep(0.1)
-            else:
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+                            nursery.start_soon(__img_ocr, i, i % len(self.parallel_limiter), img, chars, self.parallel_limiter[i % len(self.parallel_limiter)])
+                            await trio.sleep(0.1 if settings.PARALLEL_DEVICES > 1 else 0)
+                else:
+                    for i, img in enumerate(imgs, start=first):
+                        chars = __ocr_preprocess(i, img)
+                        await __img_ocr(i, 0, img, chars, None)
+
+            if not isinstance(self.page_images, PageImages):
+                await __ocr_pages(0, self.page_images)
+                return
+
+            # Each window is rendered with its own pdfplumber handle, which drops the page objects it parsed.
+            for s in range(0, page_count, PDF_PAGE_WINDOW):
+                e = min(s + PDF_PAGE_WINDOW, page_count)
+                imgs, self.page_chars[s:e] = await trio.to_thread.run_sync(__render, page_from + s, page_from + e)
+                await __ocr_pages(s, imgs)
+                wait(self.layout_futures[s:e])
+                for i, img in enumerate(imgs, start=s):
+                    self.page_images.append(img)
+                    self.page_chars[i] = []
 
         start = timer()
 
-        trio.run(__img_ocr_launcher)
+        try:
+            trio.run(__img_ocr_launcher)
+        finally:
+            if layout_executor:
+                layout_executor.shutdown(wait=False)
+        self.boxes = [page_boxes[i] for i in sorted(page_boxes)]
 
         logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
 
-        if not self.is_english and not any([c for c in self.page_chars]) and self.boxes:
+        if not self.is_english and not has_chars and self.boxes:
             bxes = [b for bxs in self.boxes for b in bxs]
             self.is_english = re.search(r"[\na-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join([b["text"] for b in random.choices(bxes, k=min(30, len(bxes)))]))
 
@@ -1135,10 +1303,10 @@ class RAGFlowPdfParser:
         self.page_cum_height = np.cumsum(self.page_cum_height)
         assert len(self.page_cum_height) == len(self.page_images) + 1
         if len(self.boxes) == 0 and zoomin < 9:
-            self.__images__(fnm, zoomin * 3, page_from, page_to, callback)
+            self.__images__(fnm, zoomin * 3, page_from, page_to, callback, prefetch_layouts)
 
     def __call__(self, fnm, need_image=True, zoomin=3, return_html=False):
-        self.__images__(fnm, zoomin)
+        self.__images__(fnm, zoomin, prefetch_layouts=True)
         self._layouts_rec(zoomin)
         self._table_transformer_job(zoomin)
         self._text_merge()
@@ -1149,7 +1317,7 @@ class RAGFlowPdfParser:
 
     def parse_into_bboxes(self, fnm, callback=None, zoomin=3):
         start = timer()
-        self.__images__(fnm, zoomin, callback=callback)
+        self.__images__(fnm, zoomin, callback=callback, prefetch_layouts=True)
         if callback:
             callback(0.40, "OCR finished ({:.2f}s)".format(timer() - start))
 
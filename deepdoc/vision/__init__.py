@@ -20,7 +20,7 @@ import threading
 import pdfplumber
 
 from .ocr import OCR
-from .recognizer import Recognizer
+from .recognizer import Recognizer, SpatialIndex
 from .layout_recognizer import AscendLayoutRecognizer
 from .layout_recognizer import LayoutRecognizer4YOLOv10 as LayoutRecognizer
 from .table_structure_recognizer import TableStructureRecognizer
@@ -83,6 +83,7 @@ def init_in_out(args):
 __all__ = [
     "OCR",
     "Recognizer",
+    "SpatialIndex",
     "LayoutRecognizer",
     "AscendLayoutRecognizer",
     "TableStructureRecognizer",
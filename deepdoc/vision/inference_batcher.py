@@ -0,0 +1,116 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Coalesces single-input model calls made concurrently by several threads into batched calls.
+
+Inputs are queued by bucket, e.g. a range of input shapes, and only inputs of the same bucket
+are batched together. The caller of the first queued input of a bucket waits until `max_batch_size`
+inputs are queued or `max_wait` seconds have passed, then runs the batch in its own thread and
+hands every caller its results. A caller may queue several inputs at once with `map`.
+"""
+import threading
+import time
+
+
+class _Request:
+    __slots__ = ("item", "enqueued_at", "taken", "result", "error", "done")
+
+    def __init__(self, item):
+        self.item = item
+        self.enqueued_at = time.monotonic()
+        self.taken = False
+        self.result = None
+        self.error = None
+        self.done = False
+
+
+class InferenceBatcher:
+    def __init__(self, run_batch, max_batch_size: int, max_wait: float):
+        """`run_batch` maps a list of inputs of one bucket to the list of their results."""
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._pending: dict[object, list[_Request]] = {}
+        self._leading = set()
+
+        self.batches = 0
+        self.inputs = 0
+
+    def __call__(self, bucket, item):
+        return self.map(bucket, [item])[0]
+
+    def map(self, bucket, items):
+        """Results of `items` of one bucket, which may be batched with each other and with those of other callers."""
+        reqs = [_Request(item) for item in items]
+        with self._cond:
+            self._pending.setdefault(bucket, []).extend(reqs)
+            self._cond.notify_all()
+        for req in reqs:
+            with self._cond:
+                # Wait until the batch that took this request has run, or until this is the first queued request of the bucket.
+                while not req.done and (req.taken or bucket in self._leading or self._pending[bucket][0] is not req):
+                    self._cond.wait()
+                batch = None if req.taken else self._take_batch(bucket, req)
+            if batch:
+                self._run(batch)
+        # Every request is run before raising, so that none is left at the head of the queue.
+        for req in reqs:
+            if req.error:
+                raise req.error
+        return [req.result for req in reqs]
+
+    def _take_batch(self, bucket, leader):
+        self._leading.add(bucket)
+        deadline = leader.enqueued_at + self.max_wait
+        while len(self._pending[bucket]) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        queue = self._pending[bucket]
+        batch = queue[:self.max_batch_size]
+        del queue[:len(batch)]
+        for r in batch:
+            r.taken = True
+        if not queue:
+            del self._pending[bucket]
+        # The next queued caller of the bucket may collect its batch while this one runs.
+        self._leading.discard(bucket)
+        self.batches += 1
+        self.inputs += len(batch)
+        self._cond.notify_all()
+        return batch
+
+    def _run(self, batch):
+        try:
+            results = self.run_batch([r.item for r in batch])
+            for r, res in zip(batch, results):
+                r.result = res
+        except Exception as e:
+            for r in batch:
+                r.error = e
+        with self._cond:
+            for r in batch:
+                r.done = True
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "inputs": self.inputs,
+            "fill_ratio": round(self.inputs / self.batches / self.max_batch_size, 4) if self.batches else 0.0,
+        }
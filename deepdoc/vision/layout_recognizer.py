@@ -26,7 +26,7 @@ import numpy as np
 from huggingface_hub import snapshot_download
 
 from common.file_utils import get_project_base_directory
-from deepdoc.vision import Recognizer
+from deepdoc.vision import Recognizer, SpatialIndex
 from deepdoc.vision.operators import nms
 
 
@@ -60,14 +60,15 @@ class LayoutRecognizer(Recognizer):
 
             self.client = DLAClient(os.environ["TENSORRT_DLA_SVR"])
 
-    def __call__(self, image_list, ocr_res, scale_factor=3, thr=0.2, batch_size=16, drop=True):
+    def __call__(self, image_list, ocr_res, scale_factor=3, thr=0.2, batch_size=16, drop=True, layouts=None):
+        """`layouts` are the results of `forward` on `image_list` if they were computed beforehand."""
         def __is_garbage(b):
             patt = [r"^•+$", "^[0-9]{1,2} / ?[0-9]{1,2}$", r"^[0-9]{1,2} of [0-9]{1,2}$", "^http://[^ ]{12,}", "\\(cid *: *[0-9]+ *\\)"]
             return any([re.search(p, b["text"]) for p in patt])
 
-        if self.client:
+        if layouts is None and self.client:
             layouts = self.client.predict(image_list)
-        else:
+        elif layouts is None:
             layouts = super().__call__(image_list, thr, batch_size)
         # save_results(image_list, layouts, self.labels, output_dir='output/', threshold=0.7)
         assert len(image_list) == len(ocr_res)
@@ -98,6 +99,8 @@ class LayoutRecognizer(Recognizer):
             def findLayout(ty):
                 nonlocal bxs, lts, self
                 lts_ = [lt for lt in lts if lt["type"] == ty]
+                unassigned = [b for b in bxs if not b.get("layout_type")]
+                matches = dict(zip(map(id, unassigned), SpatialIndex(lts_).find_overlapped_with_threshold(unassigned, thr=0.4)))
                 i = 0
                 while i < len(bxs):
                     if bxs[i].get("layout_type"):
@@ -107,7 +110,7 @@ class LayoutRecognizer(Recognizer):
                         bxs.pop(i)
                         continue
 
-                    ii = self.find_overlapped_with_threshold(bxs[i], lts_, thr=0.4)
+                    ii = matches[id(bxs[i])]
                     if ii is None:
                         bxs[i]["layout_type"] = ""
                         i += 1
@@ -399,6 +402,8 @@ class AscendLayoutRecognizer(Recognizer):
             def _tag_layout(ty):
                 nonlocal bxs, lts
                 lts_of_ty = [lt for lt in lts if lt["type"] == ty]
+                unassigned = [b for b in bxs if not b.get("layout_type")]
+                matches = dict(zip(map(id, unassigned), SpatialIndex(lts_of_ty).find_overlapped_with_threshold(unassigned, thr=0.4)))
                 i = 0
                 while i < len(bxs):
                     if bxs[i].get("layout_type"):
@@ -408,7 +413,7 @@ class AscendLayoutRecognizer(Recognizer):
                         bxs.pop(i)
                         continue
 
-                    ii = self.find_overlapped_with_threshold(bxs[i], lts_of_ty, thr=0.4)
+                    ii = matches[id(bxs[i])]
                     if ii is None:
                         bxs[i]["layout_type"] = ""
                         i += 1
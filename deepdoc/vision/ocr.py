@@ -16,6 +16,7 @@
 import gc
 import logging
 import copy
+import threading
 import time
 import os
 
@@ -31,9 +32,28 @@ import numpy as np
 import cv2
 import onnxruntime as ort
 
+from .inference_batcher import InferenceBatcher
 from .postprocess import build_post_process
 
 loaded_models = {}
+OCR_INTRA_OP_THREADS = int(os.environ.get("OCR_INTRA_OP_THREADS", "2"))
+# Text detection of pages OCRed concurrently, by one or several parsers, is batched by up to OCR_DETECT_BATCH_SIZE pages.
+OCR_DETECT_BATCH_SIZE = int(os.environ.get("OCR_DETECT_BATCH_SIZE", "1"))
+OCR_DETECT_BATCH_WAIT_MS = int(os.environ.get("OCR_DETECT_BATCH_WAIT_MS", "10"))
+# Detection inputs whose sides round up to the same multiple of this are padded to a shared shape and batched.
+DETECT_BUCKET_SIZE = 128
+detect_batchers = {}
+# Text crops are recognized by batches of up to OCR_REC_BATCH_SIZE crops of the same width class.
+# With OCR_REC_BATCH_WAIT_MS > 0, crops of pages recognized concurrently are batched together too.
+OCR_REC_BATCH_SIZE = int(os.environ.get("OCR_REC_BATCH_SIZE", "16"))
+OCR_REC_BATCH_WAIT_MS = int(os.environ.get("OCR_REC_BATCH_WAIT_MS", "0"))
+# Crops are padded to the next multiple of this width, or of a quarter of their width for long lines,
+# so a long line does not widen the batches of short ones.
+REC_WIDTH_STEP = 160
+# Input buffers of width classes up to this are kept for the next batches.
+REC_MAX_BUFFERED_WIDTH = 1600
+rec_batchers = {}
+rec_buckets = {}
 
 def transform(data, ops=None):
     """ transform """
@@ -96,7 +116,7 @@ def load_model(model_dir, nm, device_id: int | None = None):
     options = ort.SessionOptions()
     options.enable_cpu_mem_arena = False
     options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
+    options.intra_op_num_threads = OCR_INTRA_OP_THREADS
     options.inter_op_num_threads = 2
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
@@ -130,10 +150,45 @@ def load_model(model_dir, nm, device_id: int | None = None):
     return loaded_model
 
 
+class RecognitionBuckets:
+    """Reusable input buffers and timings of the width classes of a recognition session."""
+
+    def __init__(self, batch_size, image_shape):
+        self.batch_size = batch_size
+        self.image_shape = image_shape
+        self._lock = threading.Lock()
+        self._buffers: dict[int, list[np.ndarray]] = {}
+        self._stats: dict[int, dict] = {}
+
+    def acquire(self, width):
+        with self._lock:
+            if self._buffers.get(width):
+                return self._buffers[width].pop()
+        imgC, imgH = self.image_shape[:2]
+        return np.empty((self.batch_size, imgC, imgH, width), dtype=np.float32)
+
+    def release(self, width, buffer):
+        if width > REC_MAX_BUFFERED_WIDTH:
+            return
+        with self._lock:
+            self._buffers.setdefault(width, []).append(buffer)
+
+    def record(self, width, crops, elapsed):
+        with self._lock:
+            st = self._stats.setdefault(width, {"batches": 0, "crops": 0, "seconds": 0.0})
+            st["batches"] += 1
+            st["crops"] += crops
+            st["seconds"] += elapsed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {w: {**st, "seconds": round(st["seconds"], 4)} for w, st in sorted(self._stats.items())}
+
+
 class TextRecognizer:
     def __init__(self, model_dir, device_id: int | None = None):
         self.rec_image_shape = [int(v) for v in "3, 48, 320".split(",")]
-        self.rec_batch_num = 16
+        self.rec_batch_num = max(1, OCR_REC_BATCH_SIZE)
         postprocess_params = {
             'name': 'CTCLabelDecode',
             "character_dict_path": os.path.join(model_dir, "ocr.res"),
@@ -143,6 +198,42 @@ class TextRecognizer:
         self.predictor, self.run_options = load_model(model_dir, 'rec', device_id)
         self.input_tensor = self.predictor.get_inputs()[0]
 
+        # Recognizers of all parsers of a device share the session, and so the buffers and the batcher.
+        if id(self.predictor) not in rec_buckets:
+            rec_buckets[id(self.predictor)] = RecognitionBuckets(self.rec_batch_num, self.rec_image_shape)
+        self.buckets = rec_buckets[id(self.predictor)]
+        self.batcher = None
+        if OCR_REC_BATCH_WAIT_MS > 0:
+            if id(self.predictor) not in rec_batchers:
+                rec_batchers[id(self.predictor)] = InferenceBatcher(self.run_batch, self.rec_batch_num, OCR_REC_BATCH_WAIT_MS / 1000)
+            self.batcher = rec_batchers[id(self.predictor)]
+
+    def bucket_width(self, img):
+        """Width of the width class of a crop, i.e. of the batch inputs it is padded to."""
+        imgC, imgH, imgW = self.rec_image_shape
+        w = self.input_tensor.shape[3:][0]
+        if isinstance(w, int) and w > 0:
+            return w
+        h, w = img.shape[:2]
+        width = max(imgW, int(imgH * w / float(h)))
+        step = max(REC_WIDTH_STEP, (1 << (width.bit_length() - 1)) // 4)
+        return math.ceil(width / step) * step
+
+    def norm_img_into(self, img, out):
+        """Like `resize_norm_img`, but writes the padded crop into `out`, a row of a batch buffer."""
+        imgC, imgH, imgW = self.rec_image_shape
+
+        assert imgC == img.shape[2]
+        h, w = img.shape[:2]
+        resized_w = min(out.shape[2], int(math.ceil(imgH * w / float(h))))
+        resized_image = cv2.resize(img, (resized_w, imgH))
+        norm_img = out[:, :, :resized_w]
+        norm_img[...] = resized_image.transpose((2, 0, 1))
+        norm_img /= 255
+        norm_img -= 0.5
+        norm_img /= 0.5
+        out[:, :, resized_w:] = 0
+
     def resize_norm_img(self, img, max_wh_ratio):
         imgC, imgH, imgW = self.rec_image_shape
 
@@ -361,37 +452,36 @@ class TextRecognizer:
         gc.collect()
 
     def __call__(self, img_list):
-        img_num = len(img_list)
-        # Calculate the aspect ratio of all text bars
-        width_list = []
-        for img in img_list:
-            width_list.append(img.shape[1] / float(img.shape[0]))
-        # Sorting can speed up the recognition process
-        indices = np.argsort(np.array(width_list))
-        rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
+        rec_res = [['', 0.0]] * len(img_list)
         st = time.time()
 
-        for beg_img_no in range(0, img_num, batch_num):
-            end_img_no = min(img_num, beg_img_no + batch_num)
-            norm_img_batch = []
-            imgC, imgH, imgW = self.rec_image_shape[:3]
-            max_wh_ratio = imgW / imgH
-            # max_wh_ratio = 0
-            for ino in range(beg_img_no, end_img_no):
-                h, w = img_list[indices[ino]].shape[0:2]
-                wh_ratio = w * 1.0 / h
-                max_wh_ratio = max(max_wh_ratio, wh_ratio)
-            for ino in range(beg_img_no, end_img_no):
-                norm_img = self.resize_norm_img(img_list[indices[ino]],
-                                                max_wh_ratio)
-                norm_img = norm_img[np.newaxis, :]
-                norm_img_batch.append(norm_img)
-            norm_img_batch = np.concatenate(norm_img_batch)
-            norm_img_batch = norm_img_batch.copy()
+        buckets = {}
+        for i, img in enumerate(img_list):
+            buckets.setdefault(self.bucket_width(img), []).append(i)
+        for width, indices in sorted(buckets.items()):
+            imgs = [img_list[i] for i in indices]
+            if self.batcher:
+                rec_result = self.batcher.map(width, imgs)
+            else:
+                rec_result = []
+                for beg_img_no in range(0, len(imgs), self.rec_batch_num):
+                    rec_result.extend(self.run_batch(imgs[beg_img_no: beg_img_no + self.rec_batch_num]))
+            for i, res in zip(indices, rec_result):
+                rec_res[i] = res
+
+        return rec_res, time.time() - st
+
+    def run_batch(self, img_list):
+        """Recognition results of up to `rec_batch_num` crops of the same width class."""
+        st = time.time()
+        width = self.bucket_width(img_list[0])
+        buffer = self.buckets.acquire(width)
+        try:
+            for ino, img in enumerate(img_list):
+                self.norm_img_into(img, buffer[ino])
 
             input_dict = {}
-            input_dict[self.input_tensor.name] = norm_img_batch
+            input_dict[self.input_tensor.name] = buffer[:len(img_list)]
             for i in range(100000):
                 try:
                     outputs = self.predictor.run(None, input_dict, self.run_options)
@@ -400,12 +490,16 @@ class TextRecognizer:
                     if i >= 3:
                         raise e
                     time.sleep(5)
-            preds = outputs[0]
-            rec_result = self.postprocess_op(preds)
-            for rno in range(len(rec_result)):
-                rec_res[indices[beg_img_no + rno]] = rec_result[rno]
+        finally:
+            self.buckets.release(width, buffer)
+        preds = outputs[0]
+        rec_result = self.postprocess_op(preds)
+        self.buckets.record(width, len(img_list), time.time() - st)
+        return rec_result
 
-        return rec_res, time.time() - st
+    def stats(self) -> dict:
+        """Batches, crops and seconds spent by width class, for all recognizers sharing the session."""
+        return self.buckets.stats()
 
     def __del__(self):
         self.close()
@@ -450,6 +544,14 @@ class TextDetector:
             }
         self.preprocess_op = create_operators(pre_process_list)
 
+        # Detectors of all parsers of a device share the session, and so the batcher.
+        self.batcher = None
+        batch_dim = self.input_tensor.shape[0]
+        if OCR_DETECT_BATCH_SIZE > 1 and (not isinstance(batch_dim, int) or batch_dim <= 0):
+            if id(self.predictor) not in detect_batchers:
+                detect_batchers[id(self.predictor)] = InferenceBatcher(self.run_batch, OCR_DETECT_BATCH_SIZE, OCR_DETECT_BATCH_WAIT_MS / 1000)
+            self.batcher = detect_batchers[id(self.predictor)]
+
     def order_points_clockwise(self, pts):
         rect = np.zeros((4, 2), dtype="float32")
         s = pts.sum(axis=1)
@@ -509,11 +611,26 @@ class TextDetector:
         img, shape_list = data
         if img is None:
             return None, 0
-        img = np.expand_dims(img, axis=0)
         shape_list = np.expand_dims(shape_list, axis=0)
-        img = img.copy()
+        if self.batcher:
+            bucket = tuple(math.ceil(n / DETECT_BUCKET_SIZE) for n in img.shape[1:])
+            maps = self.batcher(bucket, img)
+        else:
+            maps = self.run_batch([img])[0]
+
+        post_result = self.postprocess_op({"maps": maps}, shape_list)
+        dt_boxes = post_result[0]['points']
+        dt_boxes = self.filter_tag_det_res(dt_boxes, ori_im.shape)
+
+        return dt_boxes, time.time() - st
+
+    def run_batch(self, img_list):
+        """Detection maps of preprocessed images, edge-padded to a shared shape for one session run."""
+        h = max(img.shape[1] for img in img_list)
+        w = max(img.shape[2] for img in img_list)
+        batch = np.stack([np.pad(img, ((0, 0), (0, h - img.shape[1]), (0, w - img.shape[2])), mode="edge") for img in img_list])
         input_dict = {}
-        input_dict[self.input_tensor.name] = img
+        input_dict[self.input_tensor.name] = batch
         for i in range(100000):
             try:
                 outputs = self.predictor.run(None, input_dict, self.run_options)
@@ -522,12 +639,7 @@ class TextDetector:
                 if i >= 3:
                     raise e
                 time.sleep(5)
-
-        post_result = self.postprocess_op({"maps": outputs[0]}, shape_list)
-        dt_boxes = post_result[0]['points']
-        dt_boxes = self.filter_tag_det_res(dt_boxes, ori_im.shape)
-
-        return dt_boxes, time.time() - st
+        return [outputs[0][k:k + 1, :, :img.shape[1], :img.shape[2]] for k, img in enumerate(img_list)]
 
     def __del__(self):
         self.close()
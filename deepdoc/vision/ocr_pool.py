@@ -0,0 +1,124 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+OCR worker processes for hosts without GPUs.
+
+Each of the OCR_WORKERS processes holds its own ONNX sessions running OCR_WORKER_THREADS threads,
+so pages of a document, and of concurrent documents, are detected and recognized in parallel.
+OCR_WORKERS=auto starts one worker per OCR_WORKER_THREADS cores.
+Page images are handed to the workers through shared memory rather than pickled.
+A worker dying, e.g. killed for running out of memory, fails the calls in flight with
+BrokenProcessPool and the workers are started again for the next calls.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+OCR_WORKERS = os.environ.get("OCR_WORKERS", "0")
+OCR_WORKER_THREADS = int(os.environ.get("OCR_WORKER_THREADS", "2"))
+
+_ocr = None
+
+
+def _init_worker(threads):
+    global _ocr
+    from deepdoc.vision import ocr
+
+    ocr.OCR_INTRA_OP_THREADS = threads
+    _ocr = ocr.OCR()
+
+
+def _worker_detect(shm_name, shape, dtype):
+    # Spawned workers share the resource tracker of the parser process, which unlinks the block.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        img = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        res = _ocr.detect(img)
+        del img
+    finally:
+        shm.close()
+    if isinstance(res, tuple):
+        return res
+    return list(res)
+
+
+def _worker_recognize_batch(img_list):
+    return _ocr.recognize_batch(img_list)
+
+
+class OCRPool:
+    """Stands in for `OCR.detect` and `OCR.recognize_batch`; calls block until a worker is done."""
+
+    def __init__(self, workers: int, threads: int):
+        self.workers = workers
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(self.threads,))
+
+    def _run(self, fn, *args):
+        executor = self._executor
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    logging.error("An OCR worker process died, restarting the OCR workers")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._start()
+            raise
+
+    def detect(self, img, device_id: int | None = None):
+        img = np.ascontiguousarray(img)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+        try:
+            np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)[...] = img
+            return self._run(_worker_detect, shm.name, img.shape, img.dtype.str)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def recognize_batch(self, img_list, device_id: int | None = None):
+        return self._run(_worker_recognize_batch, img_list)
+
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+
+def get_ocr_pool() -> OCRPool | None:
+    """The OCR worker pool shared by all parsers of this process, None if OCR_WORKERS is 0."""
+    global _ocr_pool
+    if OCR_WORKERS.lower() == "auto":
+        workers = max(1, (os.cpu_count() or 1) // max(1, OCR_WORKER_THREADS))
+    else:
+        workers = int(OCR_WORKERS)
+    if workers <= 0:
+        return None
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            logging.info(f"Start {workers} OCR worker processes of {OCR_WORKER_THREADS} threads")
+            _ocr_pool = OCRPool(workers, OCR_WORKER_THREADS)
+    return _ocr_pool
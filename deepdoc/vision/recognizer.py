@@ -139,6 +139,7 @@ class Recognizer:
                         a["bottom"] < b["top"],
                         a["top"] > b["bottom"]])
 
+        index = None
         i = 0
         while i + 1 < len(layouts):
             j = i + 1
@@ -161,12 +162,10 @@ class Recognizer:
                     layouts.pop(i)
                 continue
 
-            area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not not_overlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not not_overlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            if index is None:
+                index = SpatialIndex(boxes)
+            area_i = index.overlapped_area_sum(layouts[i])
+            area_i_1 = index.overlapped_area_sum(layouts[j])
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -412,22 +411,29 @@ class Recognizer:
             del self.ort_sess
         gc.collect()
 
+    def _can_stack(self, inputs):
+        # Models taking a scale factor return the boxes of a batch flattened together.
+        batch_dim = self.ort_sess.get_inputs()[0].shape[0]
+        if len(inputs) < 2 or "scale_factor" in self.input_names or (isinstance(batch_dim, int) and batch_dim > 0):
+            return False
+        return all(ins[k].shape == inputs[0][k].shape for ins in inputs for k in self.input_names)
+
     def __call__(self, image_list, thr=0.7, batch_size=16):
         res = []
-        images = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                images.append(np.array(image_list[i]))
-            else:
-                images.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        # Pages are converted batch by batch, so only one batch of them is held as arrays.
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(images))
-            batch_image_list = images[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            batch_image_list = [im if isinstance(im, np.ndarray) else np.array(im) for im in image_list[start_index:end_index]]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
+            if self._can_stack(inputs):
+                # Inputs are resized to the model's input shape, so the batch runs as one session call.
+                outputs = self.ort_sess.run(None, {k: np.concatenate([ins[k] for ins in inputs]) for k in self.input_names}, self.run_options)[0]
+                for j, ins in enumerate(inputs):
+                    res.append(self.postprocess(outputs[j:j + 1], ins, thr))
+                continue
             for ins in inputs:
                 bb = self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
                 res.append(bb)
@@ -440,3 +446,131 @@ class Recognizer:
         self.close()
 
 
+
+
+class SpatialIndex:
+    """
+    The coordinates of a list of boxes as NumPy arrays, answering the overlap queries of `Recognizer`
+    for many boxes at once. Results are the same as calling the `Recognizer` functions box by box:
+    the same arithmetic is done in float64, and ties are broken the same way.
+    """
+
+    # Query boxes are compared with all indexed boxes in blocks of about this many pairs.
+    BLOCK_PAIRS = 1 << 20
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.x0, self.x1, self.top, self.bottom = self._coords(boxes)
+
+    @staticmethod
+    def _coords(boxes):
+        arr = np.array([[b["x0"], b["x1"], b["top"], b["bottom"]] for b in boxes], dtype=np.float64).reshape(-1, 4)
+        return arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3]
+
+    @staticmethod
+    def overlapped_area(a, b, ratio=True):
+        """`Recognizer.overlapped_area` of broadcastable (x0, x1, top, bottom) arrays."""
+        x0, x1, tp, btm = a
+        bx0, bx1, btp, bbtm = b
+        disjoint = (bx0 > x1) | (bx1 < x0) | (bbtm < tp) | (btp > btm)
+        ov = (np.minimum(bbtm, btm) - np.maximum(btp, tp)) * (np.minimum(bx1, x1) - np.maximum(bx0, x0))
+        area = (x1 - x0) * (btm - tp)
+        ov = np.where(disjoint | (x1 - x0 == 0) | (btm - tp == 0), 0.0, ov)
+        if ratio:
+            ov = np.divide(ov, area, out=ov, where=ov > 0)
+        return ov
+
+    def _blocks(self, queries):
+        n = max(1, self.BLOCK_PAIRS // max(1, len(self.boxes)))
+        for s in range(0, len(queries), n):
+            q = self._coords(queries[s: s + n])
+            yield s, tuple(c[:, None] for c in q)
+
+    def _columns(self):
+        return self.x0[None, :], self.x1[None, :], self.top[None, :], self.bottom[None, :]
+
+    def find_overlapped(self, queries, naive=False):
+        """`Recognizer.find_overlapped(q, self.boxes, naive)` of every query box, the boxes being sorted by y."""
+        res = [None] * len(queries)
+        n = len(self.boxes)
+        if not n or not queries:
+            return res
+        qx0, qx1, qtop, qbottom = self._coords(queries)
+        s = np.zeros(len(queries), dtype=np.int64)
+        e = np.full(len(queries), n, dtype=np.int64)
+        ii = np.zeros(len(queries), dtype=np.int64)
+        # The binary search stops at the first box overlapping the query vertically.
+        active = (s < e) & (not naive)
+        while active.any():
+            ii = np.where(active, (e + s) // 2, ii)
+            above = active & (qbottom < self.top[ii])
+            below = active & ~above & (qtop > self.bottom[ii])
+            e = np.where(above, ii, e)
+            s = np.where(below, ii + 1, s)
+            active = (above | below) & (s < e)
+        # Then each end of the range is moved inwards by at most one box.
+        s = np.where((s < ii) & (qtop > self.bottom[np.minimum(s, n - 1)]), s + 1, s)
+        e = np.where((e - 1 > ii) & (qbottom < self.top[np.maximum(e - 1, 0)]), e - 1, e)
+
+        cols = np.arange(n)[None, :]
+        for start, (qx0, qx1, qtop, qbottom) in self._blocks(queries):
+            rows = slice(start, start + len(qx0))
+            # Most pairs are apart, so the overlaps are only computed for the others.
+            near = (cols >= s[rows, None]) & (cols < e[rows, None]) & (self.x0 <= qx1) & (self.x1 >= qx0) & (self.top <= qbottom) & (self.bottom >= qtop)
+            qi, bi = np.nonzero(near)
+            ov = self.overlapped_area((self.x0[bi], self.x1[bi], self.top[bi], self.bottom[bi]), (qx0[qi, 0], qx1[qi, 0], qtop[qi, 0], qbottom[qi, 0]))
+            qi, bi, ov = qi[ov > 0], bi[ov > 0], ov[ov > 0]
+            # The first box with the largest overlap wins.
+            order = np.lexsort((bi, -ov, qi))
+            qi, first = np.unique(qi[order], return_index=True)
+            for k, i in zip(qi, bi[order][first]):
+                res[start + k] = int(i)
+        return res
+
+    def find_overlapped_with_threshold(self, queries, thr=0.3):
+        """`Recognizer.find_overlapped_with_threshold(q, self.boxes, thr)` of every query box."""
+        res = [None] * len(queries)
+        n = len(self.boxes)
+        if not n or not queries:
+            return res
+        for start, q in self._blocks(queries):
+            ov = self.overlapped_area(q, self._columns())
+            _ov = self.overlapped_area(self._columns(), q)
+            # The last box with the greatest (ov, _ov) at least (thr, 0) wins.
+            cand = (ov > thr) | ((ov == thr) & (_ov >= 0))
+            m = np.where(cand, ov, -np.inf).max(axis=1, keepdims=True)
+            cand &= ov == m
+            m = np.where(cand, _ov, -np.inf).max(axis=1, keepdims=True)
+            cand &= _ov == m
+            last = n - 1 - np.argmax(cand[:, ::-1], axis=1)
+            for k, i in enumerate(last):
+                if cand[k, i]:
+                    res[start + k] = int(i)
+        return res
+
+    def find_horizontally_tightest_fit(self, queries):
+        """`Recognizer.find_horizontally_tightest_fit(q, self.boxes)` of every query box."""
+        res = [None] * len(queries)
+        n = len(self.boxes)
+        if not n or not queries:
+            return res
+        layoutnos = np.empty(n, dtype=object)
+        layoutnos[:] = [b.get("layoutno", "0") for b in self.boxes]
+        for start, (qx0, qx1, _, _) in self._blocks(queries):
+            q_layoutnos = np.empty((len(qx0), 1), dtype=object)
+            q_layoutnos[:, 0] = [b.get("layoutno", "0") for b in queries[start: start + len(qx0)]]
+            dis = np.minimum(np.minimum(np.abs(qx0 - self.x0[None, :]), np.abs(qx1 - self.x1[None, :])),
+                             np.abs(qx0 + qx1 - self.x1[None, :] - self.x0[None, :]) / 2)
+            dis = np.where((q_layoutnos == layoutnos[None, :]).astype(bool) & (dis < 1000000), dis, np.inf)
+            best = np.argmin(dis, axis=1)
+            for k, i in enumerate(best):
+                if dis[k, i] < np.inf:
+                    res[start + k] = int(i)
+        return res
+
+    def overlapped_area_sum(self, box):
+        """The sum of `Recognizer.overlapped_area(b, box, False)` over the indexed boxes, added up in order."""
+        if not len(self.boxes):
+            return 0
+        ov = self.overlapped_area((self.x0, self.x1, self.top, self.bottom), tuple(np.float64(box[k]) for k in ("x0", "x1", "top", "bottom")), False)
+        return float(np.cumsum(ov)[-1])
@@ -14,7 +14,6 @@
 #  limitations under the License.
 #
 import logging
-import itertools
 import os
 import re
 from dataclasses import dataclass
@@ -26,6 +25,7 @@ import trio
 from graphrag.general.extractor import Extractor
 from rag.nlp import is_english
 import editdistance
+from graphrag.entity_resolution_candidates import similar_pairs
 from graphrag.entity_resolution_prompt import ENTITY_RESOLUTION_PROMPT
 from rag.llm.chat_model import Base as CompletionLLM
 from graphrag.utils import perform_variable_replacements, chat_limiter, GraphChange
@@ -95,7 +95,7 @@ class EntityResolution(Extractor):
 
         candidate_resolution = {entity_type: [] for entity_type in entity_types}
         for k, v in node_clusters.items():
-            candidate_resolution[k] = [(a, b) for a, b in itertools.combinations(v, 2) if (a in subgraph_nodes or b in subgraph_nodes) and self.is_similarity(a, b)]
+            candidate_resolution[k] = similar_pairs(v, subgraph_nodes)
         num_candidates = sum([len(candidates) for _, candidates in candidate_resolution.items()])
         callback(msg=f"Identified {num_candidates} candidate pairs")
         remain_candidates_to_resolve = num_candidates
@@ -238,6 +238,7 @@ class EntityResolution(Extractor):
 
         return any(any(c.isdigit() for c in pair) for pair in diff)
 
+    # Candidate pairs are those this accepts, as found by graphrag.entity_resolution_candidates.similar_pairs.
     def is_similarity(self, a, b):
         if self._has_digit_in_2gram_diff(a, b):
             return False
@@ -0,0 +1,120 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Benchmark of the candidate pairs of entity resolution (graphrag/entity_resolution_candidates.py)
+against checking every pair of names with `EntityResolution.is_similarity`, on synthetic entity names.
+
+    python -m graphrag.entity_resolution_benchmark --entities 5000 --new 1.0
+    python -m graphrag.entity_resolution_benchmark --entities 50000 --new 0.005
+
+Beyond --legacy_pairs pairs, the time of checking every pair is extrapolated from that of the first ones.
+"""
+import argparse
+import itertools
+import random
+import string
+import time
+
+from graphrag.entity_resolution import EntityResolution
+from graphrag.entity_resolution_candidates import similar_pairs
+
+LETTERS = "etaoinshrdlcumwfgypbvkjxqz"
+LETTER_FREQ = [12.7, 9.1, 8.2, 7.5, 7.0, 6.7, 6.3, 6.1, 6.0, 4.3, 4.0, 2.8, 2.8, 2.4, 2.4, 2.2, 2.0, 2.0, 1.9, 1.5,
+               1.0, 0.8, 0.15, 0.15, 0.1, 0.07]
+ENGLISH_SUFFIXES = ["Inc", "Ltd", "Group", "Holdings", "Corp", "Co.", "LLC", "Partners", "Capital", "Systems"]
+CHINESE_CHARS = "中国华新东方天海金信联合科技电力建设银行发展实业环球恒达通宏盛安泰和平丰利源兴隆长城光明远大鑫汇"
+CHINESE_SUFFIXES = ["公司", "集团", "有限公司", "股份有限公司", "研究院", "银行"]
+
+
+def synthetic_entities(n, chinese, seed=0):
+    rnd = random.Random(seed)
+    words = ["".join(rnd.choices(LETTERS, LETTER_FREQ, k=rnd.randint(3, 10))).capitalize() for _ in range(5000)]
+
+    def english():
+        name = " ".join(rnd.choices(words, k=rnd.randint(1, 3)))
+        if rnd.random() < 0.05:
+            name += f" {rnd.randint(1, 99)}"
+        if rnd.random() < 0.7:
+            name += " " + rnd.choice(ENGLISH_SUFFIXES)
+        return name
+
+    def chinese_name():
+        name = "".join(rnd.choices(CHINESE_CHARS, k=rnd.randint(2, 6)))
+        if rnd.random() < 0.7:
+            name += rnd.choice(CHINESE_SUFFIXES)
+        return name
+
+    def variant(name):
+        # The same entity spelled differently: a few characters inserted, deleted or replaced.
+        chars = list(name)
+        pool = string.ascii_lowercase if name.isascii() else CHINESE_CHARS
+        for _ in range(rnd.randint(1, 2)):
+            i = rnd.randrange(len(chars))
+            op = rnd.random()
+            if op < 0.4:
+                chars[i] = rnd.choice(pool)
+            elif op < 0.7 and len(chars) > 1:
+                del chars[i]
+            else:
+                chars.insert(i, rnd.choice(pool))
+        return "".join(chars)
+
+    names, seen = [], set()
+    while len(names) < n:
+        if names and rnd.random() < 0.2:
+            name = variant(rnd.choice(names[-100:]))
+        else:
+            name = chinese_name() if rnd.random() < chinese else english()
+        if name.strip() and name not in seen:
+            seen.add(name)
+            names.append(name)
+    return sorted(names)
+
+
+def legacy_pairs(er, names, new_names, limit=None):
+    # Candidate pairs as EntityResolution built them before, from the first `limit` pairs only.
+    pairs = itertools.islice(itertools.combinations(names, 2), limit)
+    return [(a, b) for a, b in pairs if (a in new_names or b in new_names) and er.is_similarity(a, b)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the candidate pairs of EntityResolution")
+    parser.add_argument("--entities", type=int, default=5000)
+    parser.add_argument("--new", type=float, default=1.0, help="fraction of the entities which are new")
+    parser.add_argument("--chinese", type=float, default=0.3, help="fraction of the entities with Chinese names")
+    parser.add_argument("--legacy_pairs", type=int, default=20_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    names = synthetic_entities(args.entities, args.chinese, args.seed)
+    new_names = set(random.Random(args.seed).sample(names, round(len(names) * args.new)))
+    er = EntityResolution.__new__(EntityResolution)
+
+    st = time.perf_counter()
+    pairs = similar_pairs(names, new_names)
+    t1 = time.perf_counter() - st
+
+    total = len(names) * (len(names) - 1) // 2
+    checked = min(total, args.legacy_pairs)
+    st = time.perf_counter()
+    legacy = legacy_pairs(er, names, new_names, checked)
+    t0 = (time.perf_counter() - st) * total / max(1, checked)
+    # Both lists are in the order of the pairs, so the candidate pairs start with those found among the checked ones.
+    assert pairs[:len(legacy)] == legacy and (checked < total or len(pairs) == len(legacy))
+
+    print(f"entities={len(names)} new={len(new_names)} pairs={total} candidates={len(pairs)}")
+    print(f"all pairs: {t0:.2f} s" + ("" if checked == total else " (extrapolated)"))
+    print(f"indexed:   {t1:.2f} s ({t0 / t1:.1f}x)")
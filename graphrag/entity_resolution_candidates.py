@@ -0,0 +1,227 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Candidate pairs of entity resolution, i.e. the pairs of entity names `EntityResolution.is_similarity`
+accepts, found through indexes rather than by comparing every pair of names.
+
+    - Names differing in a bigram containing a digit are never similar, so names are partitioned
+      by their bigrams containing a digit, and only names of the same part are compared.
+    - Two English names are similar when their edit distance is at most half the length of the
+      shorter one. Each edit changes the counts of at most two characters, so such names have
+      close character counts; this bound is checked for a block of names against all others at
+      once by a product of character count matrices, and the edit distances of the pairs left are
+      computed in bulk by the bit-parallel algorithm of Myers.
+    - Other pairs are similar when they share 80% of their distinct characters, or 2 of them if
+      neither has more than 3. Such names share one of the rarest few characters of each of them,
+      so only these are kept in the inverted index of characters the pairs are looked up in.
+
+Only pairs with at least one of the new names, i.e. those of the documents being added, are generated.
+"""
+from collections import Counter, defaultdict
+
+import editdistance
+import numpy as np
+
+from rag.nlp import is_english
+
+BLOCK_SIZE = 128
+# Characters beyond the most frequent ones share a column of the count matrices, and counts are
+# capped: both only loosen the bound on the edit distance.
+CHAR_COLUMNS = 64
+CHAR_COUNT_CAP = 4
+# Longest name whose edit distances are computed with 64-bit masks.
+MAX_PATTERN_LEN = 64
+
+
+def _digit_bigrams(name: str) -> frozenset:
+    if not any(map(str.isdigit, name)):
+        return frozenset()
+    return frozenset(name[i:i + 2] for i in range(len(name) - 1) if any(c.isdigit() for c in name[i:i + 2]))
+
+
+def _min_overlap(size: int) -> int:
+    # Fewest distinct characters a name of `size` distinct characters shares with any name similar to it.
+    if size < 4:
+        return 2
+    return next(o for o in range(size + 1) if o * 1. / size >= 0.8)
+
+
+def _overlap_similar(a: set, b: set) -> bool:
+    max_l = max(len(a), len(b))
+    if max_l < 4:
+        return len(a & b) > 1
+    return len(a & b) * 1. / max_l >= 0.8
+
+
+def similar_pairs(names: list[str], new_names: set[str]) -> list[tuple[str, str]]:
+    """Pairs of `names`, at least one of them in `new_names`, which `EntityResolution.is_similarity` accepts,
+    in the order of `itertools.combinations(names, 2)`."""
+    parts = defaultdict(list)
+    for i, name in enumerate(names):
+        parts[_digit_bigrams(name)].append(i)
+
+    pairs = set()
+    for idx in parts.values():
+        part = [names[i] for i in idx]
+        new = [name in new_names for name in part]
+        if not any(new):
+            continue
+        english = [is_english(name) for name in part]
+        for i, j in _overlap_pairs(part, english, new) + _edit_distance_pairs(part, english, new):
+            pairs.add((idx[i], idx[j]))
+    return [(names[i], names[j]) for i, j in sorted(pairs)]
+
+
+def _overlap_pairs(names: list[str], english: list[bool], new: list[bool]) -> list[tuple[int, int]]:
+    """Similar pairs of `names`, not both English, by character overlap."""
+    if all(english):
+        return []
+    char_sets = [set(name) for name in names]
+    df = Counter(c for s in char_sets for c in s)
+    prefixes = []
+    index, other_index = defaultdict(list), defaultdict(list)
+    for i, s in enumerate(char_sets):
+        prefix = sorted(s, key=lambda c: (df[c], c))[:max(0, len(s) - _min_overlap(len(s)) + 1)]
+        prefixes.append(prefix)
+        for c in prefix:
+            index[c].append(i)
+            if not english[i]:
+                other_index[c].append(i)
+
+    pairs = []
+    for i in range(len(names)):
+        if not new[i]:
+            continue
+        # An English name is only compared by overlap with the names which are not.
+        postings = other_index if english[i] else index
+        candidates = {j for c in prefixes[i] for j in postings[c]}
+        for j in candidates:
+            # A pair of two new names is generated from the first one.
+            if j == i or (new[j] and j < i):
+                continue
+            if _overlap_similar(char_sets[i], char_sets[j]):
+                pairs.append((min(i, j), max(i, j)))
+    return pairs
+
+
+def _edit_distance_pairs(names: list[str], english: list[bool], new: list[bool]) -> list[tuple[int, int]]:
+    """Similar pairs of English `names`, by edit distance."""
+    cols = [i for i, e in enumerate(english) if e]
+    rows = [k for k, i in enumerate(cols) if new[i]]
+    if not rows:
+        return []
+    texts = [names[i] for i in cols]
+    lens = np.array([len(t) for t in texts], dtype=np.int32)
+    is_new = np.array([new[i] for i in cols])
+    # Characters of all names, as ids by decreasing frequency.
+    code_points = np.frombuffer("".join(texts).encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    _, chars, freq = np.unique(code_points, return_inverse=True, return_counts=True)
+    rank = np.empty(len(freq), dtype=np.int32)
+    rank[np.argsort(-freq, kind="stable")] = np.arange(len(freq), dtype=np.int32)
+    chars = rank[chars]
+    of_text = np.repeat(np.arange(len(texts)), lens)
+    pos = np.arange(len(chars)) - np.repeat(np.cumsum(lens) - lens, lens)
+
+    # Presence of the 1st..CHAR_COUNT_CAP-th occurrence of each character column, so that the product
+    # of two rows is the number of characters the names have in common.
+    col = np.minimum(chars, CHAR_COLUMNS - 1)
+    key = of_text * CHAR_COLUMNS + col
+    order = np.argsort(key, kind="stable")
+    first = np.searchsorted(key[order], key[order])
+    occurrence = np.empty(len(key), dtype=np.int64)
+    occurrence[order] = np.arange(len(key)) - first
+    capped = occurrence < CHAR_COUNT_CAP
+    counts = np.zeros((len(texts), CHAR_COLUMNS * CHAR_COUNT_CAP), dtype=np.float32)
+    counts[of_text[capped], col[capped] * CHAR_COUNT_CAP + occurrence[capped]] = 1
+    counted = counts.sum(axis=1)
+    # Character ids of the names, padded with an id matching no character. Names longer than
+    # 1.5 * MAX_PATTERN_LEN are only compared with names too long for the masks.
+    width = min(int(lens.max()), MAX_PATTERN_LEN * 3 // 2)
+    text_ids = np.full((len(texts), width), len(freq), dtype=np.int32)
+    kept = pos < width
+    text_ids[of_text[kept], pos[kept]] = chars[kept]
+
+    pairs = []
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = np.array(rows[start:start + BLOCK_SIZE])
+        la, lb = lens[block, None], lens[None, :]
+        k = np.minimum(la, lb) // 2
+        shared = counts[block] @ counts.T
+        ok = np.abs(la - lb) <= k
+        ok &= counted[block, None] + counted[None, :] - 2 * shared <= 2 * k
+        ok &= ~is_new[None, :] | (np.arange(len(texts))[None, :] > block[:, None])
+        r, b = np.nonzero(ok)
+        a = block[r]
+        dist = _edit_distances(texts, text_ids, lens, len(freq), a, b)
+        keep = dist <= np.minimum(lens[a], lens[b]) // 2
+        for x, y in zip(a[keep].tolist(), b[keep].tolist()):
+            pairs.append((min(cols[x], cols[y]), max(cols[x], cols[y])))
+    return pairs
+
+
+def _edit_distances(texts, text_ids, lens, n_chars, a, b) -> np.ndarray:
+    """Edit distances between texts[a[p]] and texts[b[p]]."""
+    dist = np.empty(len(a), dtype=np.int64)
+    fits = lens[a] <= MAX_PATTERN_LEN
+    for p in np.nonzero(~fits)[0]:
+        dist[p] = editdistance.eval(texts[a[p]], texts[b[p]])
+    p = np.nonzero(fits)[0]
+    if len(p):
+        dist[p] = _myers(text_ids, lens, n_chars, a[p], b[p])
+    return dist
+
+
+def _myers(text_ids, lens, n_chars, a, b) -> np.ndarray:
+    """Edit distances between the patterns of up to 64 characters text_ids[a[p]] and the texts text_ids[b[p]],
+    by the bit-vector algorithm of Myers, as extended to edit distance by Hyyro, run for all pairs at once."""
+    patterns, pattern_of = np.unique(a, return_inverse=True)
+    # Bit i of peq[k, c] is set when the i-th character of the k-th pattern is c.
+    pos = np.arange(MAX_PATTERN_LEN)
+    k, i = np.nonzero(pos[None, :] < lens[patterns, None])
+    peq = np.zeros((len(patterns), n_chars + 1), dtype=np.uint64)
+    np.bitwise_or.at(peq, (k, text_ids[patterns[k], i]), np.left_shift(np.uint64(1), i.astype(np.uint64)))
+
+    # Pairs by decreasing text length, so that those still running at each step come first.
+    order = np.argsort(-lens[b], kind="stable")
+    text_lens = lens[b[order]]
+    running = np.searchsorted(-text_lens, -np.arange(text_lens[0] if len(b) else 0), side="left")
+    # Offsets in peq of the patterns, and ids of the t-th characters of the texts in row t.
+    offsets = pattern_of[order] * peq.shape[1]
+    chars = np.ascontiguousarray(text_ids[b[order], :len(running)].T)
+    peq = peq.ravel()
+
+    one = np.uint64(1)
+    last_bit = one << (lens[a[order]] - 1).astype(np.uint64)
+    pv = np.full(len(b), ~np.uint64(0), dtype=np.uint64)
+    mv = np.zeros(len(b), dtype=np.uint64)
+    score = lens[a[order]].astype(np.int64)
+    for t, n in enumerate(running.tolist()):
+        eq = peq[offsets[:n] + chars[t, :n]]
+        p, m = pv[:n], mv[:n]
+        xv = eq | m
+        xh = (((eq & p) + p) ^ p) | eq
+        ph = m | ~(xh | p)
+        mh = p & xh
+        score[:n] += (ph & last_bit[:n]) != 0
+        score[:n] -= (mh & last_bit[:n]) != 0
+        ph = (ph << one) | one
+        mh = mh << one
+        pv[:n] = mh | ~(xv | ph)
+        mv[:n] = ph & xv
+
+    dist = np.empty(len(b), dtype=np.int64)
+    dist[order] = score
+    return dist
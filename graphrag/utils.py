@@ -6,14 +6,20 @@ Reference:
  - [LightRag](https://github.com/HKUDS/LightRAG)
 """
 
+import base64
 import dataclasses
+import gc
 import html
 import json
 import logging
 import os
+import pickle
 import re
+import struct
 import time
+import zlib
 from collections import defaultdict
+from contextlib import contextmanager
 from hashlib import md5
 from typing import Any, Callable, Set, Tuple
 
@@ -21,17 +27,24 @@ import networkx as nx
 import numpy as np
 import trio
 import xxhash
+from cachetools import LRUCache
 from networkx.readwrite import json_graph
 
 from common.misc_utils import get_uuid
 from common.connection_utils import timeout
 from rag.nlp import rag_tokenizer, search
+from rag.utils import ndjson_bulk
 from rag.utils.doc_store_conn import OrderByExpr
 from rag.utils.redis_conn import REDIS_CONN
 from common import settings
 
 GRAPH_FIELD_SEP = "<SEP>"
 
+# Graph and subgraph records hold node-link data compressed by zlib, base64-encoded after this prefix.
+GRAPH_SNAPSHOT_PREFIX = "zlib:"
+# The number of knowledge graphs kept loaded by `get_graph` and `set_graph`, 0 to load them from the doc store every time.
+GRAPH_CACHE_SIZE = int(os.environ.get("GRAPH_CACHE_SIZE", "4"))
+
 ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
 chat_limiter = trio.CapacityLimiter(int(os.environ.get("MAX_CONCURRENT_CHATS", 10)))
@@ -90,44 +103,114 @@ def dict_has_keys_with_types(data: dict, expected_fields: list[tuple[str, type]]
     return True
 
 
-def get_llm_cache(llmnm, txt, history, genconf):
+CACHE_EXPIRE = 24 * 3600
+# Embeddings are cached as raw little-endian float32 (or float16) bytes behind a small header
+# instead of JSON text: about 5x smaller and nothing to parse.
+EMBED_CACHE_DTYPE = os.environ.get("EMBED_CACHE_DTYPE", "float32")
+_EMBED_CACHE_MAGIC = b"EB1"
+_EMBED_CACHE_DTYPES = {b"f": np.dtype("<f4"), b"e": np.dtype("<f2")}
+
+_cache_stats = {"llm": {"hit": 0, "miss": 0}, "embed": {"hit": 0, "miss": 0}}
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters of the LLM and embedding caches of this process."""
+    return {k: dict(v) for k, v in _cache_stats.items()}
+
+
+def _count_cache(kind, hits, total):
+    _cache_stats[kind]["hit"] += hits
+    _cache_stats[kind]["miss"] += total - hits
+
+
+def _llm_cache_key(llmnm, txt, history, genconf):
     hasher = xxhash.xxh64()
     hasher.update((str(llmnm)+str(txt)+str(history)+str(genconf)).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
+
+def _embed_cache_key(llmnm, txt):
+    hasher = xxhash.xxh64()
+    hasher.update(str(llmnm).encode("utf-8"))
+    hasher.update(str(txt).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def encode_embedding(arr, dtype=None) -> bytes:
+    """Header `EB1` + dtype code (`f` float32, `e` float16) + uint32 dimension, then the raw vector."""
+    code = b"e" if (dtype or EMBED_CACHE_DTYPE) == "float16" else b"f"
+    arr = np.asarray(arr, dtype=_EMBED_CACHE_DTYPES[code]).reshape(-1)
+    return _EMBED_CACHE_MAGIC + code + struct.pack("<I", arr.shape[0]) + arr.tobytes()
+
+
+def decode_embedding(bin):
+    """The vector of a cache entry, None if there is none or it is malformed."""
+    if not bin:
+        return None
+    if isinstance(bin, bytes) and bin.startswith(_EMBED_CACHE_MAGIC):
+        dtype = _EMBED_CACHE_DTYPES.get(bin[3:4])
+        if dtype is None or len(bin) < 8:
+            return None
+        dim = struct.unpack("<I", bin[4:8])[0]
+        # A truncated entry, or one whose dimension does not match its length.
+        if len(bin) != 8 + dim * dtype.itemsize:
+            return None
+        arr = np.frombuffer(bin, dtype=dtype, count=dim, offset=8)
+        return arr.astype(np.float32) if dtype.itemsize != 4 else arr.copy()
+    # Entries written before the binary format were JSON lists.
+    try:
+        arr = np.array(json.loads(bin), dtype=np.float64)
+    except (ValueError, TypeError):
+        return None
+    return arr if arr.ndim == 1 else None
+
+
+def get_llm_cache(llmnm, txt, history, genconf):
+    bin = REDIS_CONN.get(_llm_cache_key(llmnm, txt, history, genconf))
+    _count_cache("llm", 1 if bin else 0, 1)
     if not bin:
         return None
     return bin
 
 
+def get_llm_cache_many(llmnm, txts: list, history, genconf) -> list:
+    """`get_llm_cache` for many texts in one MGET. Returns None for misses."""
+    bins = REDIS_CONN.mget([_llm_cache_key(llmnm, txt, history, genconf) for txt in txts])
+    bins = [bin if bin else None for bin in bins]
+    _count_cache("llm", sum(1 for bin in bins if bin), len(bins))
+    return bins
+
+
 def set_llm_cache(llmnm, txt, v, history, genconf):
-    hasher = xxhash.xxh64()
-    hasher.update((str(llmnm)+str(txt)+str(history)+str(genconf)).encode("utf-8"))
-    k = hasher.hexdigest()
-    REDIS_CONN.set(k, v.encode("utf-8"), 24 * 3600)
+    k = _llm_cache_key(llmnm, txt, history, genconf)
+    REDIS_CONN.set(k, v.encode("utf-8"), CACHE_EXPIRE)
+
+
+def set_llm_cache_many(llmnm, txt_values: list[tuple], history, genconf):
+    """`set_llm_cache` for many (txt, value) pairs in one pipelined round-trip."""
+    REDIS_CONN.set_many({_llm_cache_key(llmnm, txt, history, genconf): v.encode("utf-8") for txt, v in txt_values if v}, CACHE_EXPIRE)
 
 
 def get_embed_cache(llmnm, txt):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
+    arr = decode_embedding(REDIS_CONN.get_bytes(_embed_cache_key(llmnm, txt)))
+    _count_cache("embed", 0 if arr is None else 1, 1)
+    return arr
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
-    if not bin:
-        return
-    return np.array(json.loads(bin))
+
+def get_embed_cache_many(llmnm, txts: list) -> list:
+    """`get_embed_cache` for many texts in one MGET. Returns None for misses."""
+    arrs = [decode_embedding(bin) for bin in REDIS_CONN.mget([_embed_cache_key(llmnm, txt) for txt in txts], binary=True)]
+    _count_cache("embed", sum(1 for arr in arrs if arr is not None), len(arrs))
+    return arrs
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
+    REDIS_CONN.set(_embed_cache_key(llmnm, txt), encode_embedding(arr), CACHE_EXPIRE)
 
-    k = hasher.hexdigest()
-    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24 * 3600)
+
+def set_embed_cache_many(llmnm, txts: list, arrs):
+    """`set_embed_cache` for many texts in one pipelined round-trip."""
+    REDIS_CONN.set_many({_embed_cache_key(llmnm, txt): encode_embedding(arr) for txt, arr in zip(txts, arrs)}, CACHE_EXPIRE)
 
 
 def get_tags_from_cache(kb_ids):
@@ -294,7 +377,7 @@ def chunk_id(chunk):
     return xxhash.xxh64((chunk["content_with_weight"] + chunk["kb_id"]).encode("utf-8")).hexdigest()
 
 
-async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
+async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks, embed_cache: dict | None = None):
     global chat_limiter
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
     chunk = {
@@ -311,13 +394,16 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
+    ebd = embed_cache.get(ent_name) if embed_cache is not None else get_embed_cache(embd_mdl.llm_name, ent_name)
     if ebd is None:
         async with chat_limiter:
             with trio.fail_after(3 if enable_timeout_assertion else 30000000):
                 ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([ent_name]))
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
+        if embed_cache is not None:
+            embed_cache[ent_name] = ebd
+        else:
+            set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -345,7 +431,7 @@ def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
     return res
 
 
-async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
+async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks, embed_cache: dict | None = None):
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
     chunk = {
         "id": get_uuid(),
@@ -362,13 +448,16 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
     txt = f"{from_ent_name}->{to_ent_name}"
-    ebd = get_embed_cache(embd_mdl.llm_name, txt)
+    ebd = embed_cache.get(txt) if embed_cache is not None else get_embed_cache(embd_mdl.llm_name, txt)
     if ebd is None:
         async with chat_limiter:
             with trio.fail_after(3 if enable_timeout_assertion else 300000000):
                 ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([txt + f": {meta['description']}"]))
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, txt, ebd)
+        if embed_cache is not None:
+            embed_cache[txt] = ebd
+        else:
+            set_embed_cache(embd_mdl.llm_name, txt, ebd)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -381,7 +470,7 @@ async def does_graph_contains(tenant_id, kb_id, doc_id):
         "knowledge_graph_kwd": ["graph"],
         "removed_kwd": "N",
     }
-    res = await trio.to_thread.run_sync(lambda: settings.docStoreConn.search(fields, [], condition, [], OrderByExpr(), 0, 1, search.index_name(tenant_id), [kb_id]))
+    res = await settings.docStoreConn.aio.search(fields, [], condition, [], OrderByExpr(), 0, 1, search.index_name(tenant_id), [kb_id])
     fields2 = settings.docStoreConn.get_fields(res, fields)
     graph_doc_ids = set()
     for chunk_id in fields2.keys():
@@ -400,16 +489,76 @@ async def get_graph_doc_ids(tenant_id, kb_id) -> list[str]:
     return doc_ids
 
 
+def dump_graph(graph: nx.Graph) -> str:
+    """Content of the graph or subgraph record of `graph`."""
+    data = ndjson_bulk.dumps(nx.node_link_data(graph, edges="edges"))
+    return GRAPH_SNAPSHOT_PREFIX + base64.b64encode(zlib.compress(data, 6)).decode("ascii")
+
+
+def load_graph_data(content: str) -> dict:
+    """Node-link data of a graph or subgraph record, compressed or, as written by earlier versions, plain JSON."""
+    if content.startswith(GRAPH_SNAPSHOT_PREFIX):
+        return json.loads(zlib.decompress(base64.b64decode(content[len(GRAPH_SNAPSHOT_PREFIX):])))
+    return json.loads(content)
+
+
+@contextmanager
+def _gc_paused():
+    # Loading a graph allocates millions of objects, none of them garbage; collecting meanwhile only costs time.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# Loaded graphs by (kb_id, id of their graph record), pickled, so that every `get_graph` hands out its own copy.
+# Every write of a graph gives its record a new id.
+_graph_cache = LRUCache(GRAPH_CACHE_SIZE) if GRAPH_CACHE_SIZE > 0 else None
+
+
+def _uncache_graph(kb_id):
+    if _graph_cache is None:
+        return
+    for key in [k for k in _graph_cache if k[0] == kb_id]:
+        _graph_cache.pop(key, None)
+
+
+def _cache_graph(kb_id, version, graph: nx.Graph):
+    if _graph_cache is None:
+        return
+    _uncache_graph(kb_id)
+    _graph_cache[(kb_id, version)] = pickle.dumps(graph, pickle.HIGHEST_PROTOCOL)
+
+
+def _cached_graph(kb_id, version) -> nx.Graph | None:
+    if _graph_cache is None:
+        return None
+    data = _graph_cache.get((kb_id, version))
+    if data is None:
+        return None
+    with _gc_paused():
+        return pickle.loads(data)
+
+
 async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
-    conds = {"fields": ["content_with_weight", "removed_kwd", "source_id"], "size": 1, "knowledge_graph_kwd": ["graph"]}
+    conds = {"fields": ["removed_kwd", "source_id"], "size": 1, "knowledge_graph_kwd": ["graph"]}
     res = await trio.to_thread.run_sync(settings.retriever.search, conds, search.index_name(tenant_id), [kb_id])
     if not res.total == 0:
         for id in res.ids:
             try:
                 if res.field[id]["removed_kwd"] == "N":
-                    g = json_graph.node_link_graph(json.loads(res.field[id]["content_with_weight"]), edges="edges")
-                    if "source_id" not in g.graph:
-                        g.graph["source_id"] = res.field[id]["source_id"]
+                    g = _cached_graph(kb_id, id)
+                    if g is None:
+                        # Only the record found to be current is fetched with its content.
+                        chunk = await settings.docStoreConn.aio.get(id, search.index_name(tenant_id), [kb_id])
+                        with _gc_paused():
+                            g = json_graph.node_link_graph(load_graph_data(chunk["content_with_weight"]), edges="edges")
+                        if "source_id" not in g.graph:
+                            g.graph["source_id"] = res.field[id]["source_id"]
+                        _cache_graph(kb_id, id, g)
                 else:
                     g = await rebuild_graph(tenant_id, kb_id, exclude_rebuild)
                 return g
@@ -419,22 +568,41 @@ async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
     return result
 
 
+def _changed_sources(graph: nx.Graph, change: GraphChange) -> set[str]:
+    """
+    Sources whose subgraphs `change` touches. A node removed by merging it into another, as entity resolution does,
+    leaves its sources to the node it is merged into.
+    """
+    nodes = set(change.added_updated_nodes)
+    for from_node, to_node in change.added_updated_edges:
+        nodes.add(from_node)
+        nodes.add(to_node)
+    sources = set()
+    for node in nodes:
+        if graph.has_node(node):
+            sources.update(graph.nodes[node].get("source_id", []))
+    return sources & set(graph.graph.get("source_id", []))
+
+
 async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, change: GraphChange, callback):
-    global chat_limiter
     start = trio.current_time()
 
-    await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["graph", "subgraph"]}, search.index_name(tenant_id), kb_id)
+    # Only the subgraphs of the sources of changed nodes and edges are rewritten.
+    changed_sources = sorted(_changed_sources(graph, change))
+    _uncache_graph(kb_id)
+    await settings.docStoreConn.aio.delete({"knowledge_graph_kwd": ["graph"]}, search.index_name(tenant_id), kb_id)
+    if changed_sources:
+        await settings.docStoreConn.aio.delete({"knowledge_graph_kwd": ["subgraph"], "source_id": changed_sources}, search.index_name(tenant_id), kb_id)
 
     if change.removed_nodes:
-        await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)}, search.index_name(tenant_id), kb_id)
+        await settings.docStoreConn.aio.delete({"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)}, search.index_name(tenant_id), kb_id)
 
     if change.removed_edges:
 
         async def del_edges(from_node, to_node):
-            async with chat_limiter:
-                await trio.to_thread.run_sync(
-                    settings.docStoreConn.delete, {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": to_node}, search.index_name(tenant_id), kb_id
-                )
+            await settings.docStoreConn.aio.delete(
+                {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": to_node}, search.index_name(tenant_id), kb_id
+            )
 
         async with trio.open_nursery() as nursery:
             for from_node, to_node in change.removed_edges:
@@ -448,7 +616,7 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
     chunks = [
         {
             "id": get_uuid(),
-            "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False),
+            "content_with_weight": dump_graph(graph),
             "knowledge_graph_kwd": "graph",
             "kb_id": kb_id,
             "source_id": graph.graph.get("source_id", []),
@@ -458,27 +626,40 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
     ]
 
     # generate updated subgraphs
-    for source in graph.graph["source_id"]:
-        subgraph = graph.subgraph([n for n in graph.nodes if source in graph.nodes[n]["source_id"]]).copy()
-        subgraph.graph["source_id"] = [source]
-        for n in subgraph.nodes:
-            subgraph.nodes[n]["source_id"] = [source]
-        chunks.append(
-            {
-                "id": get_uuid(),
-                "content_with_weight": json.dumps(nx.node_link_data(subgraph, edges="edges"), ensure_ascii=False),
-                "knowledge_graph_kwd": "subgraph",
-                "kb_id": kb_id,
-                "source_id": [source],
-                "available_int": 0,
-                "removed_kwd": "N",
-            }
-        )
+    if changed_sources:
+        nodes_of_source = defaultdict(list)
+        for n, attrs in graph.nodes(data=True):
+            for source in attrs["source_id"]:
+                nodes_of_source[source].append(n)
+        for source in changed_sources:
+            subgraph = graph.subgraph(nodes_of_source[source]).copy()
+            subgraph.graph["source_id"] = [source]
+            for n in subgraph.nodes:
+                subgraph.nodes[n]["source_id"] = [source]
+            chunks.append(
+                {
+                    "id": get_uuid(),
+                    "content_with_weight": dump_graph(subgraph),
+                    "knowledge_graph_kwd": "subgraph",
+                    "kb_id": kb_id,
+                    "source_id": [source],
+                    "available_int": 0,
+                    "removed_kwd": "N",
+                }
+            )
+
+    # Look up the cached embeddings of all nodes and edges in one round-trip, and write the missing ones back in another.
+    embed_txts = list(change.added_updated_nodes) + [f"{from_node}->{to_node}" for from_node, to_node in change.added_updated_edges]
+    embed_cache = {}
+    for txt, ebd in zip(embed_txts, await trio.to_thread.run_sync(get_embed_cache_many, embd_mdl.llm_name, embed_txts)):
+        if ebd is not None:
+            embed_cache[txt] = ebd
+    missed_txts = [txt for txt in embed_txts if txt not in embed_cache]
 
     async with trio.open_nursery() as nursery:
         for ii, node in enumerate(change.added_updated_nodes):
             node_attrs = graph.nodes[node]
-            nursery.start_soon(graph_node_to_chunk, kb_id, embd_mdl, node, node_attrs, chunks)
+            nursery.start_soon(graph_node_to_chunk, kb_id, embd_mdl, node, node_attrs, chunks, embed_cache)
             if ii % 100 == 9 and callback:
                 callback(msg=f"Get embedding of nodes: {ii}/{len(change.added_updated_nodes)}")
 
@@ -492,6 +673,9 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
             if ii % 100 == 9 and callback:
                 callback(msg=f"Get embedding of edges: {ii}/{len(change.added_updated_edges)}")
 
+    missed_txts = [txt for txt in missed_txts if txt in embed_cache]
+    await trio.to_thread.run_sync(set_embed_cache_many, embd_mdl.llm_name, missed_txts, [embed_cache[txt] for txt in missed_txts])
+
     now = trio.current_time()
     if callback:
         callback(msg=f"set_graph converted graph change to {len(chunks)} chunks in {now - start:.2f}s.")
@@ -501,12 +685,13 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
     es_bulk_size = 4
     for b in range(0, len(chunks), es_bulk_size):
         with trio.fail_after(3 if enable_timeout_assertion else 30000000):
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b : b + es_bulk_size], search.index_name(tenant_id), kb_id))
+            doc_store_result = await settings.docStoreConn.aio.insert(chunks[b : b + es_bulk_size], search.index_name(tenant_id), kb_id)
         if b % 100 == es_bulk_size and callback:
             callback(msg=f"Insert chunks: {b}/{len(chunks)}")
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             raise Exception(error_message)
+    _cache_graph(kb_id, chunks[0]["id"], graph)
     now = trio.current_time()
     if callback:
         callback(msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index in {now - start:.2f}s.")
@@ -588,8 +773,8 @@ async def rebuild_graph(tenant_id, kb_id, exclude_rebuild=None):
     flds = ["knowledge_graph_kwd", "content_with_weight", "source_id"]
     bs = 256
     for i in range(0, 1024 * bs, bs):
-        es_res = await trio.to_thread.run_sync(
-            lambda: settings.docStoreConn.search(flds, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["subgraph"]}, [], OrderByExpr(), i, bs, search.index_name(tenant_id), [kb_id])
+        es_res = await settings.docStoreConn.aio.search(
+            flds, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["subgraph"]}, [], OrderByExpr(), i, bs, search.index_name(tenant_id), [kb_id]
         )
         # tot = settings.docStoreConn.get_total(es_res)
         es_res = settings.docStoreConn.get_fields(es_res, flds)
@@ -605,7 +790,7 @@ async def rebuild_graph(tenant_id, kb_id, exclude_rebuild=None):
             elif exclude_rebuild in d["source_id"]:
                 continue
 
-            next_graph = json_graph.node_link_graph(json.loads(d["content_with_weight"]), edges="edges")
+            next_graph = json_graph.node_link_graph(load_graph_data(d["content_with_weight"]), edges="edges")
             merged_graph = nx.compose(graph, next_graph)
             merged_source = {n: graph.nodes[n]["source_id"] + next_graph.nodes[n]["source_id"] for n in graph.nodes & next_graph.nodes}
             nx.set_node_attributes(merged_graph, merged_source, "source_id")
@@ -39,7 +39,8 @@ class Pdf(PdfParser):
             zoomin,
             from_page,
             to_page,
-            callback
+            callback,
+            prefetch_layouts=True
         )
         callback(msg="OCR finished ({:.2f}s)".format(timer() - start))
 
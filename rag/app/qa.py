@@ -86,7 +86,8 @@ class Pdf(PdfParser):
             zoomin,
             from_page,
             to_page,
-            callback
+            callback,
+            prefetch_layouts=True
         )
         callback(msg="OCR finished ({:.2f}s)".format(timer() - start))
         logging.debug("OCR({}~{}): {:.2f}s".format(from_page, to_page, timer() - start))
@@ -293,18 +294,33 @@ def beAdocDocx(d, q, a, eng, image, row_num=-1):
     return d
 
 
-def beAdoc(d, q, a, eng, row_num=-1):
+def _qa_content(d, q, a, eng, row_num=-1):
     qprefix = "Question: " if eng else "问题："
     aprefix = "Answer: " if eng else "回答："
     d["content_with_weight"] = "\t".join(
         [qprefix + rmPrefix(q), aprefix + rmPrefix(a)])
-    d["content_ltks"] = rag_tokenizer.tokenize(q)
-    d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
     if row_num >= 0:
         d["top_int"] = [row_num]
     return d
 
 
+def beAdoc(d, q, a, eng, row_num=-1):
+    _qa_content(d, q, a, eng, row_num)
+    d["content_ltks"] = rag_tokenizer.tokenize(q)
+    d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    return d
+
+
+def beAdocs(doc, qas, eng):
+    """`beAdoc` for a list of (question, answer, row_num) on copies of `doc`, tokenizing the questions in one batch."""
+    res = [_qa_content(deepcopy(doc), q, a, eng, row_num) for q, a, row_num in qas]
+    ltks = rag_tokenizer.tokenize_batch([q for q, _, _ in qas])
+    for d, tks, sm_tks in zip(res, ltks, rag_tokenizer.fine_grained_tokenize_batch(ltks)):
+        d["content_ltks"] = tks
+        d["content_sm_ltks"] = sm_tks
+    return res
+
+
 def mdQuestionLevel(s):
     match = re.match(r'#*', s)
     return (len(match.group(0)), s.lstrip('#').lstrip()) if match else (0, s)
@@ -331,9 +347,8 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
     if re.search(r"\.xlsx?$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
         excel_parser = Excel()
-        for ii, (q, a) in enumerate(excel_parser(filename, binary, callback)):
-            res.append(beAdoc(deepcopy(doc), q, a, eng, ii))
-        return res
+        qas = [(q, a, ii) for ii, (q, a) in enumerate(excel_parser(filename, binary, callback))]
+        return beAdocs(doc, qas, eng)
 
     elif re.search(r"\.(txt)$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
@@ -348,6 +363,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
         delimiter = "\t" if tab >= comma else ","
 
         fails = []
+        qas = []
         question, answer = "", ""
         i = 0
         while i < len(lines):
@@ -359,15 +375,16 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
                     fails.append(str(i+1))
             elif len(arr) == 2:
                 if question and answer:
-                    res.append(beAdoc(deepcopy(doc), question, answer, eng, i))
+                    qas.append((question, answer, i))
                 question, answer = arr
             i += 1
-            if len(res) % 999 == 0:
-                callback(len(res) * 0.6 / len(lines), ("Extract Q&A: {}".format(len(res)) + (
+            if len(qas) % 999 == 0:
+                callback(len(qas) * 0.6 / len(lines), ("Extract Q&A: {}".format(len(qas)) + (
                     f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
 
         if question:
-            res.append(beAdoc(deepcopy(doc), question, answer, eng, len(lines)))
+            qas.append((question, answer, len(lines)))
+        res = beAdocs(doc, qas, eng)
 
         callback(0.6, ("Extract Q&A: {}".format(len(res)) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
@@ -381,8 +398,8 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
         delimiter = "\t" if any("\t" in line for line in lines) else ","
 
         fails = []
+        qas = []
         question, answer = "", ""
-        res = []
         reader = csv.reader(lines, delimiter=delimiter)
 
         for i, row in enumerate(reader):
@@ -393,14 +410,15 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
                     fails.append(str(i + 1))
             elif len(row) == 2:
                 if question and answer:
-                    res.append(beAdoc(deepcopy(doc), question, answer, eng, i))
+                    qas.append((question, answer, i))
                 question, answer = row
-            if len(res) % 999 == 0:
-                callback(len(res) * 0.6 / len(lines), ("Extract Q&A: {}".format(len(res)) + (
+            if len(qas) % 999 == 0:
+                callback(len(qas) * 0.6 / len(lines), ("Extract Q&A: {}".format(len(qas)) + (
                     f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
 
         if question:
-            res.append(beAdoc(deepcopy(doc), question, answer, eng, len(list(reader))))
+            qas.append((question, answer, len(list(reader))))
+        res = beAdocs(doc, qas, eng)
 
         callback(0.6, ("Extract Q&A: {}".format(len(res)) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
@@ -28,7 +28,7 @@ from dateutil.parser import parse as datetime_parse
 
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from deepdoc.parser.utils import get_text
-from rag.nlp import rag_tokenizer, tokenize
+from rag.nlp import rag_tokenizer, tokenize_batch
 from deepdoc.parser import ExcelParser
 
 
@@ -374,8 +374,11 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
         clmns_map = [(py_clmns[i].lower() + fieds_map[clmn_tys[i]], str(clmns[i]).replace("_", " ")) for i in range(len(clmns))]
 
         eng = lang.lower() == "english"  # is_english(txts)
+        title_tks = rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+        ds, row_txts = [], []
+        text_flds, text_vals = [], []
         for ii, row in df.iterrows():
-            d = {"docnm_kwd": filename, "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))}
+            d = {"docnm_kwd": filename, "title_tks": title_tks}
             row_txt = []
             for j in range(len(clmns)):
                 if row[clmns[j]] is None:
@@ -385,12 +388,21 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
                 if not isinstance(row[clmns[j]], pd.Series) and pd.isna(row[clmns[j]]):
                     continue
                 fld = clmns_map[j][0]
-                d[fld] = row[clmns[j]] if clmn_tys[j] != "text" else rag_tokenizer.tokenize(row[clmns[j]])
+                if clmn_tys[j] != "text":
+                    d[fld] = row[clmns[j]]
+                else:
+                    text_flds.append((d, fld))
+                    text_vals.append(row[clmns[j]])
                 row_txt.append("{}:{}".format(clmns[j], row[clmns[j]]))
             if not row_txt:
                 continue
-            tokenize(d, "; ".join(row_txt), eng)
-            res.append(d)
+            ds.append(d)
+            row_txts.append("; ".join(row_txt))
+        # Tokenize all rows of the sheet in one batch, it is the costly part for large tables.
+        for (d, fld), tks in zip(text_flds, rag_tokenizer.tokenize_batch(text_vals)):
+            d[fld] = tks
+        tokenize_batch(ds, row_txts, eng)
+        res.extend(ds)
 
         KnowledgebaseService.update_parser_config(kwargs["kb_id"], {"field_map": {k: v for k, v in clmns_map}})
     callback(0.35, "")
@@ -271,8 +271,19 @@ def tokenize(d, t, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
+def tokenize_batch(ds, ts, eng):
+    """Same as calling `tokenize(d, t, eng)` for every pair of `ds` and `ts`, tokenizing in one batch."""
+    ts_ = [re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t) for t in ts]
+    ltks = rag_tokenizer.tokenize_batch(ts_)
+    sm_ltks = rag_tokenizer.fine_grained_tokenize_batch(ltks)
+    for d, t, lt, smt in zip(ds, ts, ltks, sm_ltks):
+        d["content_with_weight"] = t
+        d["content_ltks"] = lt
+        d["content_sm_ltks"] = smt
+
+
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
-    res = []
+    res, cks = [], []
     # wrap up as es documents
     for ii, ck in enumerate(chunks):
         if len(ck.strip()) == 0:
@@ -288,13 +299,14 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
                 pass
         else:
             add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
         res.append(d)
+        cks.append(ck)
+    tokenize_batch(res, cks, eng)
     return res
 
 
 def tokenize_chunks_with_images(chunks, doc, eng, images):
-    res = []
+    res, cks = [], []
     # wrap up as es documents
     for ii, (ck, image) in enumerate(zip(chunks, images)):
         if len(ck.strip()) == 0:
@@ -303,8 +315,9 @@ def tokenize_chunks_with_images(chunks, doc, eng, images):
         d = copy.deepcopy(doc)
         d["image"] = image
         add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
         res.append(d)
+        cks.append(ck)
+    tokenize_batch(res, cks, eng)
     return res
 
 
@@ -326,15 +339,17 @@ def tokenize_table(tbls, doc, eng, batch_size=10):
             res.append(d)
             continue
         de = "; " if eng else "； "
+        ds, rs = [], []
         for i in range(0, len(rows), batch_size):
             d = copy.deepcopy(doc)
-            r = de.join(rows[i:i + batch_size])
-            tokenize(d, r, eng)
             if img:
                 d["image"] = img
                 d["doc_type_kwd"] = "image"
             add_positions(d, poss)
-            res.append(d)
+            ds.append(d)
+            rs.append(de.join(rows[i:i + batch_size]))
+        tokenize_batch(ds, rs, eng)
+        res.extend(ds)
     return res
 
 
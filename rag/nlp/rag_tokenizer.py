@@ -18,10 +18,12 @@ import logging
 import copy
 import datrie
 import math
+import multiprocessing
 import os
 import re
 import string
 import sys
+import threading
 from hanziconv import HanziConv
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
@@ -61,6 +63,8 @@ class RagTokenizer:
     def __init__(self, debug=False):
         self.DEBUG = debug
         self.DENOMINATOR = 1000000
+        # "dag": dynamic programming over the word DAG; "dfs": enumerate every segmentation with `dfs_`.
+        self.SEGMENT_ENGINE = os.environ.get("RAG_TOKENIZER_ENGINE", "dag").lower()
         self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
 
         self.stemmer = PorterStemmer()
@@ -197,6 +201,97 @@ class RagTokenizer:
         _memo[state_key] = result
         return result
 
+    def _dag_edges(self, chars, s, after_three_singles):
+        # The tokens `dfs_` would try at position `s`, as (end, (freq, tag)), in the order it tries them.
+        if s < len(chars) - 4:
+            char_to_check = chars[s]
+            if all(chars[s + i] == char_to_check for i in range(1, 5)):
+                end = s
+                while end < len(chars) and chars[end] == char_to_check:
+                    end += 1
+                mid = s + min(10, end - s)
+                k = self.key_("".join(chars[s:mid]))
+                return [(mid, self.trie_[k] if k in self.trie_ else (-12, ''))]
+
+        S = s + 1
+        if s + 2 <= len(chars):
+            t1 = "".join(chars[s:s + 1])
+            t2 = "".join(chars[s:s + 2])
+            if self.trie_.has_keys_with_prefix(self.key_(t1)) and not self.trie_.has_keys_with_prefix(self.key_(t2)):
+                S = s + 2
+        if after_three_singles:
+            t1 = "".join(chars[s - 1:s + 1])
+            if self.trie_.has_keys_with_prefix(self.key_(t1)):
+                S = s + 2
+
+        edges = []
+        for e in range(S, len(chars) + 1):
+            k = self.key_("".join(chars[s:e]))
+            if e > s + 1 and not self.trie_.has_keys_with_prefix(k):
+                break
+            if k in self.trie_:
+                edges.append((e, self.trie_[k]))
+        if edges:
+            return edges
+        k = self.key_("".join(chars[s:s + 1]))
+        return [(s + 1, self.trie_[k] if k in self.trie_ else (-12, ''))]
+
+    def dag_(self, chars, topn=2):
+        """Return the `topn` best segmentations of `chars` as `_sort_tokens(tkslist)[:topn]` would
+        after `dfs_(chars, 0, [], tkslist)`, without enumerating every segmentation.
+
+        `score_` of a segmentation only depends on its number of tokens n (at most MAX_DEPTH + 2),
+        its number of multi-char tokens L and its summed frequency F. Dynamic programming over the
+        word DAG keeps, per (position, n, trailing single chars, L), the best `topn` partial
+        segmentations by F. Ties are broken by token end positions, which is the order `dfs_`
+        enumerates segmentations in, so the result is identical.
+        """
+        MAX_DEPTH = 10
+        N = len(chars)
+        states = [{} for _ in range(N + 1)]
+        states[0][(0, 0, 0)] = [(0, ())]
+        edges_cache = {}
+        finals = []
+
+        def push(cands, F, path):
+            cands.append((F, path))
+            cands.sort(key=lambda x: (-x[0], x[1]))
+            del cands[topn:]
+
+        for s in range(N + 1):
+            for (n, singles, L), cands in states[s].items():
+                if n > MAX_DEPTH:
+                    # dfs_ gives up here, the rest becomes one unknown token. A path reaching the end exactly is dropped.
+                    if s < N:
+                        finals.extend((n + 1, L + (N - s >= 2), F - 12, path + (N,)) for F, path in cands)
+                    continue
+                if s >= N:
+                    finals.extend((n, L, F, path) for F, path in cands)
+                    continue
+                ek = (s, singles >= 3)
+                if ek not in edges_cache:
+                    edges_cache[ek] = self._dag_edges(chars, s, singles >= 3)
+                for e, (freq, _) in edges_cache[ek]:
+                    key = (n + 1, min(singles + 1, 3) if e - s == 1 else 0, L + (e - s >= 2))
+                    nxt = states[e].setdefault(key, [])
+                    for F, path in cands:
+                        push(nxt, F + freq, path + (e,))
+            states[s] = None
+
+        res = []
+        for n, L, F, path in finals:
+            tks = ["".join(chars[b:e]) for b, e in zip((0,) + path[:-1], path)]
+            res.append((tks, 30 / n + L / n + F, path))
+        res.sort(key=lambda x: (-x[1], x[2]))
+        return [(tks, sc) for tks, sc, _ in res[:topn]]
+
+    def _best_segmentations(self, chars, topn):
+        if self.SEGMENT_ENGINE == "dfs":
+            tkslist = []
+            self.dfs_(chars, 0, [], tkslist)
+            return self._sort_tokens(tkslist)[:topn]
+        return self.dag_(chars, topn)
+
     def freq(self, tk):
         k = self.key_(tk)
         if k not in self.trie_:
@@ -367,9 +462,7 @@ class RagTokenizer:
                     j += 1
                     continue
                 # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self._sort_tokens(tkslist)[0][0]))
+                res.append(" ".join(self._best_segmentations("".join(tks[_j:j]), 1)[0][0]))
 
                 same = 1
                 while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
@@ -383,9 +476,7 @@ class RagTokenizer:
             if _i < len(tks1):
                 assert _j < len(tks)
                 assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self._sort_tokens(tkslist)[0][0]))
+                res.append(" ".join(self._best_segmentations("".join(tks[_j:]), 1)[0][0]))
 
         res = " ".join(res)
         logging.debug("[TKS] {}".format(self.merge_(res)))
@@ -405,15 +496,14 @@ class RagTokenizer:
             if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
                 res.append(tk)
                 continue
-            tkslist = []
             if len(tk) > 10:
-                tkslist.append(tk)
-            else:
-                self.dfs_(tk, 0, [], tkslist)
+                res.append(tk)
+                continue
+            tkslist = self._best_segmentations(tk, 2)
             if len(tkslist) < 2:
                 res.append(tk)
                 continue
-            stk = self._sort_tokens(tkslist)[1][0]
+            stk = tkslist[1][0]
             if len(stk) == len(tk):
                 stk = tk
             else:
@@ -432,6 +522,55 @@ class RagTokenizer:
         return " ".join(self.english_normalize_(res))
 
 
+    def tokenize_batch(self, lines):
+        """`tokenize` every line, in the tokenizer process pool for large batches. Order is preserved."""
+        return self._map(lines, self.tokenize, _pool_tokenize)
+
+    def fine_grained_tokenize_batch(self, tks_list):
+        """`fine_grained_tokenize` every token string, in the tokenizer process pool for large batches."""
+        return self._map(tks_list, self.fine_grained_tokenize, _pool_fine_grained_tokenize)
+
+    def _map(self, items, func, pool_func):
+        # Pool workers are forked from this process and use the module tokenizer with the trie it had at fork time.
+        pool = init_tokenize_pool() if self is tokenizer and len(items) >= TOKENIZE_BATCH_MIN_SIZE else None
+        if pool is None:
+            return [func(x) for x in items]
+        parts = [items[i:i + TOKENIZE_BATCH_MIN_SIZE] for i in range(0, len(items), TOKENIZE_BATCH_MIN_SIZE)]
+        return [r for part in pool.map(pool_func, parts) for r in part]
+
+
+TOKENIZER_WORKERS = int(os.environ.get("TOKENIZER_WORKERS", "0"))
+TOKENIZE_BATCH_MIN_SIZE = 64
+_tokenize_pool = None
+_tokenize_pool_lock = threading.Lock()
+
+
+def init_tokenize_pool(workers=None):
+    """Start the tokenizer worker processes once, preferably before the process starts other threads.
+
+    Workers are forked, so they share the loaded trie with this process copy-on-write instead of
+    loading it again. Returns None if the pool is disabled or fork is unavailable.
+    """
+    global _tokenize_pool
+    if workers is None:
+        workers = TOKENIZER_WORKERS
+    if workers <= 0 or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    with _tokenize_pool_lock:
+        if _tokenize_pool is None:
+            logging.info(f"[HUQIE]:Start {workers} tokenizer worker processes")
+            _tokenize_pool = multiprocessing.get_context("fork").Pool(workers)
+    return _tokenize_pool
+
+
+def _pool_tokenize(lines):
+    return [tokenizer.tokenize(line) for line in lines]
+
+
+def _pool_fine_grained_tokenize(tks_list):
+    return [tokenizer.fine_grained_tokenize(tks) for tks in tks_list]
+
+
 def is_chinese(s):
     if s >= u'\u4e00' and s <= u'\u9fa5':
         return True
@@ -466,6 +605,8 @@ def naive_qie(txt):
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
+tokenize_batch = tokenizer.tokenize_batch
+fine_grained_tokenize_batch = tokenizer.fine_grained_tokenize_batch
 tag = tokenizer.tag
 freq = tokenizer.freq
 load_user_dict = tokenizer.load_user_dict
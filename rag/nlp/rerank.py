@@ -0,0 +1,110 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Vectorized scoring used by `Dealer.rerank`.
+
+`FulltextQueryer.hybrid_similarity` computes a term-weight dict for every chunk, although
+`FulltextQueryer.similarity` only looks at which query terms a chunk contains. Here the query
+term weights are computed once, chunk/query term overlap is collected as a sparse
+(chunk, term-id) matrix, and chunk vectors are decoded once into a contiguous float32 matrix.
+
+Scores match `FulltextQueryer.hybrid_similarity`:
+    - token similarity: identical up to float64 summation order (TOKEN_SIM_TOLERANCE);
+    - vector similarity: computed in float32 instead of float64 (VECTOR_SIM_TOLERANCE).
+See rag/nlp/rerank_benchmark.py.
+"""
+import numpy as np
+
+from common.float_utils import get_float
+from rag.utils.doc_store_conn import ChunkFields
+
+TOKEN_SIM_TOLERANCE = 1e-9
+VECTOR_SIM_TOLERANCE = 1e-5
+
+
+def decode_vectors(fields: dict | ChunkFields, ids: list[str], vector_column: str, vector_size: int) -> np.ndarray:
+    """Stack the `vector_column` of every chunk into an (n, vector_size) float32 matrix.
+
+    Missing vectors are zeros; vectors stored as tab separated strings are parsed.
+    """
+    if isinstance(fields, ChunkFields):
+        return fields.vectors(vector_column, vector_size, ids)
+    mat = np.zeros((len(ids), vector_size), dtype=np.float32)
+    for i, chunk_id in enumerate(ids):
+        vector = fields[chunk_id].get(vector_column)
+        if vector is None:
+            continue
+        if isinstance(vector, str):
+            vector = [get_float(v) for v in vector.split("\t")]
+        mat[i] = vector
+    return mat
+
+
+def vector_similarity(query_vector, mat: np.ndarray) -> np.ndarray:
+    """Cosine similarity of `query_vector` with every row of `mat`, zero for zero vectors."""
+    q = np.asarray(query_vector, dtype=np.float32)
+    q_norm = np.linalg.norm(q)
+    if q_norm == 0:
+        q_norm = 1.
+    norms = np.linalg.norm(mat, axis=1)
+    norms[norms == 0] = 1.
+    return (mat @ (q / q_norm) / norms).astype(np.float64)
+
+
+class QueryTerms:
+    """Weights of the query keywords, computed once per query."""
+
+    def __init__(self, term_weight_dealer, keywords: list[str]):
+        self.index = {}
+        weights = []
+        for t, w in term_weight_dealer.weights(keywords, preprocess=False):
+            if t not in self.index:
+                self.index[t] = len(weights)
+                weights.append(0.)
+            weights[self.index[t]] += w
+        self.weights = np.array(weights, dtype=np.float64)
+        self.total = 1e-9 + float(np.sum(self.weights))
+
+    def similarity(self, chunk_tokens: list) -> np.ndarray:
+        """Same as `FulltextQueryer.token_similarity(keywords, chunk_tokens)`.
+
+        `chunk_tokens[i]` is an iterable of token iterables, so callers do not need to
+        concatenate the fields of a chunk.
+        """
+        rows, cols = [], []
+        index = self.index
+        for i, fields in enumerate(chunk_tokens):
+            hits = set()
+            for tks in fields:
+                for t in tks:
+                    j = index.get(t)
+                    if j is not None:
+                        hits.add(j)
+            rows.extend([i] * len(hits))
+            cols.extend(hits)
+        if not cols:
+            return np.full(len(chunk_tokens), 1e-9 / self.total)
+        overlap = np.bincount(np.array(rows, dtype=np.int64),
+                              weights=self.weights[np.array(cols, dtype=np.int64)],
+                              minlength=len(chunk_tokens))
+        return (overlap + 1e-9) / self.total
+
+
+def hybrid_similarity(query_vector, mat: np.ndarray, tksim: np.ndarray, tkweight=0.3, vtweight=0.7):
+    vtsim = vector_similarity(query_vector, mat)
+    if np.sum(vtsim) == 0:
+        return tksim, tksim, vtsim
+    return vtsim * vtweight + tksim * tkweight, tksim, vtsim
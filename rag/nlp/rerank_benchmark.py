@@ -0,0 +1,115 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Microbenchmark of the vectorized rerank (rag/nlp/rerank.py) against the
+list-of-dicts implementation it replaces, on synthetic search results.
+
+    python -m rag.nlp.rerank_benchmark --chunks 1024 --dim 1024 --rounds 20
+"""
+import argparse
+import random
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from rag.nlp import query, rerank
+from rag.nlp.search import Dealer
+
+
+def legacy_rerank(qryr, sres, keywords, tkweight=0.3, vtweight=0.7, cfield="content_ltks"):
+    vector_size = len(sres.query_vector)
+    vector_column = f"q_{vector_size}_vec"
+    zero_vector = [0.0] * vector_size
+    ins_embd = []
+    for chunk_id in sres.ids:
+        vector = sres.field[chunk_id].get(vector_column, zero_vector)
+        if isinstance(vector, str):
+            vector = [float(v) for v in vector.split("\t")]
+        ins_embd.append(vector)
+    ins_tw = []
+    for i in sres.ids:
+        content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
+        title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
+        question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
+        important_kwd = sres.field[i].get("important_kwd", [])
+        ins_tw.append(content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6)
+    return qryr.hybrid_similarity(sres.query_vector, ins_embd, keywords, ins_tw, tkweight, vtweight)
+
+
+def vectorized_rerank(qryr, sres, keywords, tkweight=0.3, vtweight=0.7, cfield="content_ltks"):
+    vector_size = len(sres.query_vector)
+    ins_embd = rerank.decode_vectors(sres.field, sres.ids, f"q_{vector_size}_vec", vector_size)
+    ins_tw = [(sres.field[i][cfield].split(),
+               [t for t in sres.field[i].get("title_tks", "").split() if t],
+               sres.field[i].get("important_kwd", []),
+               [t for t in sres.field[i].get("question_tks", "").split() if t]) for i in sres.ids]
+    tksim = rerank.QueryTerms(qryr.tw, keywords).similarity(ins_tw)
+    return rerank.hybrid_similarity(sres.query_vector, ins_embd, tksim, tkweight, vtweight)
+
+
+def synthetic_search_result(n_chunks, dim, vocab_size, chunk_len, as_str=False, seed=0):
+    rnd = random.Random(seed)
+    rng = np.random.default_rng(seed)
+    vocab = ["term%d" % i for i in range(vocab_size)]
+    fields, ids = {}, []
+    for i in range(n_chunks):
+        chunk_id = "chunk%d" % i
+        vec = rng.standard_normal(dim).astype(np.float32).tolist()
+        fields[chunk_id] = {
+            "content_ltks": " ".join(rnd.choices(vocab, k=chunk_len)),
+            "title_tks": " ".join(rnd.choices(vocab, k=4)),
+            "question_tks": " ".join(rnd.choices(vocab, k=8)) if i % 3 == 0 else "",
+            "important_kwd": rnd.choices(vocab, k=3) if i % 2 == 0 else [],
+            f"q_{dim}_vec": "\t".join(str(v) for v in vec) if as_str else vec,
+        }
+        ids.append(chunk_id)
+    query_vector = rng.standard_normal(dim).astype(np.float32).tolist()
+    keywords = rnd.sample(vocab, k=12)
+    return Dealer.SearchResult(total=n_chunks, ids=ids, query_vector=query_vector, field=fields), keywords
+
+
+def bench(fn, rounds, *args):
+    fn(*args)
+    st = time.perf_counter()
+    for _ in range(rounds):
+        res = fn(*args)
+    return res, (time.perf_counter() - st) / rounds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the hybrid rerank used by Dealer.rerank")
+    parser.add_argument("--chunks", type=int, default=1024)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--vocab", type=int, default=5000)
+    parser.add_argument("--chunk_len", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--str_vectors", action="store_true", help="vectors as tab separated strings")
+    args = parser.parse_args()
+
+    qryr = query.FulltextQueryer()
+    sres, keywords = synthetic_search_result(args.chunks, args.dim, args.vocab, args.chunk_len, args.str_vectors)
+    (sim0, tksim0, vtsim0), t0 = bench(legacy_rerank, args.rounds, qryr, sres, keywords)
+    (sim1, tksim1, vtsim1), t1 = bench(vectorized_rerank, args.rounds, qryr, sres, keywords)
+
+    tk_err = float(np.max(np.abs(np.array(tksim0) - tksim1)))
+    vt_err = float(np.max(np.abs(np.array(vtsim0) - vtsim1)))
+    print(f"chunks={args.chunks} dim={args.dim} chunk_len={args.chunk_len}")
+    print(f"legacy:     {t0 * 1000:.2f} ms/query")
+    print(f"vectorized: {t1 * 1000:.2f} ms/query ({t0 / t1:.1f}x)")
+    print(f"max |token sim diff|  = {tk_err:.3g} (tolerance {rerank.TOKEN_SIM_TOLERANCE})")
+    print(f"max |vector sim diff| = {vt_err:.3g} (tolerance {rerank.VECTOR_SIM_TOLERANCE})")
+    assert tk_err <= rerank.TOKEN_SIM_TOLERANCE and vt_err <= rerank.VECTOR_SIM_TOLERANCE
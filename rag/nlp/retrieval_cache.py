@@ -0,0 +1,144 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Query-side caches of `Dealer.retrieval`, enabled by RETRIEVAL_CACHE=1.
+
+    - query vectors, by embedding model and question text (LRU + TTL);
+    - retrieval results, by question and every retrieval parameter (LRU + TTL).
+
+Every write of chunks to the doc store records a new generation, the time of the write,
+for the knowledge bases it touches (see `bumps_kb_generation`). A cached result is only
+returned while the generations of its knowledge bases are the ones it was computed with,
+so results never outlive a change of their knowledge bases, whichever process made it.
+Results computed within RETRIEVAL_CACHE_REFRESH_GRACE seconds of a write are not cached,
+as the doc store may not have made the written chunks searchable yet.
+"""
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+
+from cachetools import TTLCache
+
+RETRIEVAL_CACHE = int(os.environ.get("RETRIEVAL_CACHE", "0"))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", "300"))
+RETRIEVAL_CACHE_REFRESH_GRACE = float(os.environ.get("RETRIEVAL_CACHE_REFRESH_GRACE", "2"))
+QUERY_VECTOR_CACHE_SIZE = int(os.environ.get("QUERY_VECTOR_CACHE_SIZE", "4096"))
+QUERY_VECTOR_CACHE_TTL = int(os.environ.get("QUERY_VECTOR_CACHE_TTL", "3600"))
+
+KB_GENERATION_EXPIRE = 7 * 24 * 3600
+
+
+def _kb_generation_key(kb_id):
+    return f"kb_generation:{kb_id}"
+
+
+def _redis():
+    # Imported lazily: the doc store connections, which import this module, are created by common.settings.
+    from rag.utils.redis_conn import REDIS_CONN
+    return REDIS_CONN
+
+
+def bump_kb_generation(index_name: str, kb_id: str | list[str] | None):
+    """Record a write to `kb_id`, or to the whole index if the knowledge base is unknown."""
+    kb_ids = kb_id if isinstance(kb_id, list) else [kb_id]
+    generation = str(time.time())
+    _redis().set_many({_kb_generation_key(k if k else index_name): generation for k in kb_ids}, KB_GENERATION_EXPIRE)
+
+
+def bumps_kb_generation(func):
+    """Decorates the doc store methods that write chunks, i.e. taking `indexName` and `knowledgebaseId`."""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                arguments = signature.bind(*args, **kwargs).arguments
+                bump_kb_generation(arguments.get("indexName"), arguments.get("knowledgebaseId"))
+            except Exception:
+                logging.exception(f"Failed to bump the knowledge base generation in {func.__qualname__}")
+    return wrapper
+
+
+def kb_generations(index_names: list[str], kb_ids: list[str] | None) -> tuple:
+    keys = [_kb_generation_key(k) for k in list(kb_ids or []) + list(index_names)]
+    return tuple(_redis().mget(keys))
+
+
+def _model_id(mdl):
+    if mdl is None:
+        return None
+    return getattr(mdl, "tenant_id", None), getattr(mdl, "llm_name", None) or type(mdl).__name__
+
+
+class RetrievalCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vectors = TTLCache(QUERY_VECTOR_CACHE_SIZE, QUERY_VECTOR_CACHE_TTL)
+        self._results = TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+        self.hits = 0
+        self.misses = 0
+
+    def get_vector(self, emb_mdl, txt):
+        with self._lock:
+            return self._vectors.get((_model_id(emb_mdl), txt))
+
+    def set_vector(self, emb_mdl, txt, qv):
+        with self._lock:
+            self._vectors[(_model_id(emb_mdl), txt)] = qv
+
+    @staticmethod
+    def result_key(question, embd_mdl, rerank_mdl, index_names, kb_ids, **params):
+        return (" ".join(question.split()), _model_id(embd_mdl), _model_id(rerank_mdl), tuple(index_names),
+                tuple(kb_ids or []), tuple(sorted((k, repr(v)) for k, v in params.items())))
+
+    def get_result(self, key, generations):
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and entry[0] != generations:
+                del self._results[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return _copy_ranks(entry[1])
+
+    def set_result(self, key, generations, ranks):
+        now = time.time()
+        for g in generations:
+            if g and now - float(g) < RETRIEVAL_CACHE_REFRESH_GRACE:
+                return
+        with self._lock:
+            self._results[key] = (generations, _copy_ranks(ranks))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "results": len(self._results), "vectors": len(self._vectors)}
+
+
+def _copy_ranks(ranks):
+    # Callers append to the chunk list and set fields of chunks, but leave vectors alone.
+    return {**ranks, "chunks": [dict(c) for c in ranks["chunks"]], "doc_aggs": [dict(a) for a in ranks["doc_aggs"]]}
+
+
+retrieval_cache = RetrievalCache() if RETRIEVAL_CACHE else None
@@ -18,18 +18,22 @@ import logging
 import re
 import math
 import os
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
 from rag.prompts.generator import relevant_chunks_with_toc
-from rag.nlp import rag_tokenizer, query
+from rag.nlp import rag_tokenizer, query, rerank
+from rag.nlp.retrieval_cache import retrieval_cache, kb_generations
 import numpy as np
-from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
+from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr, ChunkFields
 from common.string_utils import remove_redundant_spaces
 from common.float_utils import get_float
 from common.constants import PAGERANK_FLD, TAG_FLD
 
 
+QUERY_ENCODE_CONCURRENCY = 8
+
+
 def index_name(uid): return f"ragflow_{uid}"
 
 
@@ -43,14 +47,18 @@ class Dealer:
         total: int
         ids: list[str]
         query_vector: list[float] | None = None
-        field: dict | None = None
+        field: dict | ChunkFields | None = None
         highlight: dict | None = None
         aggregation: list | dict | None = None
         keywords: list[str] | None = None
         group_docs: list[list] | None = None
 
     def get_vector(self, txt, emb_mdl, topk=10, similarity=0.1):
-        qv, _ = emb_mdl.encode_queries(txt)
+        qv = retrieval_cache.get_vector(emb_mdl, txt) if retrieval_cache else None
+        if qv is None:
+            qv, _ = emb_mdl.encode_queries(txt)
+            if retrieval_cache:
+                retrieval_cache.set_vector(emb_mdl, txt, qv)
         shape = np.array(qv).shape
         if len(shape) > 1:
             raise Exception(
@@ -76,74 +84,113 @@ class Dealer:
                highlight: bool | list | None = None,
                rank_feature: dict | None = None
                ):
+        return self.search_many([req], idx_names, kb_ids, emb_mdl, highlight, [rank_feature])[0]
+
+    def search_many(self, reqs: list[dict], idx_names: str | list[str],
+                    kb_ids: list[str],
+                    emb_mdl=None,
+                    highlight: bool | list | None = None,
+                    rank_feature: dict | list | None = None
+                    ) -> list:
+        """Same as `search` for each of `reqs`, with the searches of each round sent to the doc store together.
+
+        `rank_feature` is shared by all requests, or is a list of the rank features of each request.
+        """
         if highlight is None:
             highlight = False
-
-        filters = self.get_filters(req)
-        orderBy = OrderByExpr()
-
-        pg = int(req.get("page", 1)) - 1
-        topk = int(req.get("topk", 1024))
-        ps = int(req.get("size", topk))
-        offset, limit = pg * ps, ps
-
-        src = req.get("fields",
-                      ["docnm_kwd", "content_ltks", "kb_id", "img_id", "title_tks", "important_kwd", "position_int",
-                       "doc_id", "page_num_int", "top_int", "create_timestamp_flt", "knowledge_graph_kwd",
-                       "question_kwd", "question_tks", "doc_type_kwd",
-                       "available_int", "content_with_weight", PAGERANK_FLD, TAG_FLD])
-        kwds = set([])
-
-        qst = req.get("question", "")
-        q_vec = []
-        if not qst:
-            if req.get("sort"):
-                orderBy.asc("page_num_int")
-                orderBy.asc("top_int")
-                orderBy.desc("create_timestamp_flt")
-            res = self.dataStore.search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
-            total = self.dataStore.get_total(res)
+        rank_features = rank_feature if isinstance(rank_feature, list) else [rank_feature] * len(reqs)
+
+        highlightFields = ["content_ltks", "title_tks"]
+        if not highlight:
+            highlightFields = []
+        elif isinstance(highlight, list):
+            highlightFields = highlight
+
+        searches = []
+        queries = []
+        for req, rank_fea in zip(reqs, rank_features):
+            filters = self.get_filters(req)
+            orderBy = OrderByExpr()
+
+            pg = int(req.get("page", 1)) - 1
+            topk = int(req.get("topk", 1024))
+            ps = int(req.get("size", topk))
+            offset, limit = pg * ps, ps
+
+            src = list(req.get("fields",
+                               ["docnm_kwd", "content_ltks", "kb_id", "img_id", "title_tks", "important_kwd", "position_int",
+                                "doc_id", "page_num_int", "top_int", "create_timestamp_flt", "knowledge_graph_kwd",
+                                "question_kwd", "question_tks", "doc_type_kwd",
+                                "available_int", "content_with_weight", PAGERANK_FLD, TAG_FLD]))
+            search = {"selectFields": src, "highlightFields": [], "condition": filters, "matchExprs": [],
+                      "orderBy": orderBy, "offset": offset, "limit": limit, "indexNames": idx_names,
+                      "knowledgebaseIds": kb_ids}
+            query = {"req": req, "search": search, "keywords": [], "q_vec": [], "matchDense": None}
+
+            qst = req.get("question", "")
+            if not qst:
+                if req.get("sort"):
+                    orderBy.asc("page_num_int")
+                    orderBy.asc("top_int")
+                    orderBy.desc("create_timestamp_flt")
+            else:
+                matchText, keywords = self.qryr.question(qst, min_match=0.3)
+                query["keywords"] = keywords
+                search.update({"highlightFields": highlightFields, "matchExprs": [matchText], "rank_feature": rank_fea})
+            searches.append(search)
+            queries.append(query)
+
+        # Query vectors of all questions are computed concurrently.
+        if emb_mdl is not None:
+            dense = [q for q in queries if q["req"].get("question")]
+
+            def encode(query):
+                req = query["req"]
+                return self.get_vector(req["question"], emb_mdl, int(req.get("topk", 1024)), req.get("similarity", 0.1))
+
+            if len(dense) > 1:
+                with ThreadPoolExecutor(max_workers=min(len(dense), QUERY_ENCODE_CONCURRENCY)) as pool:
+                    vectors = zip(dense, pool.map(encode, dense))
+            else:
+                vectors = zip(dense, map(encode, dense))
+            for query, matchDense in vectors:
+                query["matchDense"] = matchDense
+                query["q_vec"] = matchDense.embedding_data
+                if query["req"].get("vector", True):
+                    query["search"]["selectFields"].append(f"q_{len(query['q_vec'])}_vec")
+                fusionExpr = FusionExpr("weighted_sum", int(query["req"].get("topk", 1024)), {"weights": "0.05,0.95"})
+                query["search"]["matchExprs"] = query["search"]["matchExprs"] + [matchDense, fusionExpr]
+
+        ress = self.dataStore.search_many(searches)
+        totals = [self.dataStore.get_total(res) for res in ress]
+        for total in totals:
             logging.debug("Dealer.search TOTAL: {}".format(total))
-        else:
-            highlightFields = ["content_ltks", "title_tks"]
-            if not highlight:
-                highlightFields = []
-            elif isinstance(highlight, list):
-                highlightFields = highlight
-            matchText, keywords = self.qryr.question(qst, min_match=0.3)
-            if emb_mdl is None:
-                matchExprs = [matchText]
-                res = self.dataStore.search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
-                                            idx_names, kb_ids, rank_feature=rank_feature)
-                total = self.dataStore.get_total(res)
-                logging.debug("Dealer.search TOTAL: {}".format(total))
+
+        # If result is empty, try again with lower min_match
+        retries = []
+        for k, query in enumerate(queries):
+            if totals[k] != 0 or query["matchDense"] is None:
+                continue
+            search = query["search"]
+            if search["condition"].get("doc_id"):
+                retry = {**search, "highlightFields": [], "matchExprs": []}
+                retry.pop("rank_feature", None)
             else:
-                matchDense = self.get_vector(qst, emb_mdl, topk, req.get("similarity", 0.1))
-                q_vec = matchDense.embedding_data
-                src.append(f"q_{len(q_vec)}_vec")
-
-                fusionExpr = FusionExpr("weighted_sum", topk, {"weights": "0.05,0.95"})
-                matchExprs = [matchText, matchDense, fusionExpr]
-
-                res = self.dataStore.search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
-                                            idx_names, kb_ids, rank_feature=rank_feature)
-                total = self.dataStore.get_total(res)
-                logging.debug("Dealer.search TOTAL: {}".format(total))
-
-                # If result is empty, try again with lower min_match
-                if total == 0:
-                    if filters.get("doc_id"):
-                        res = self.dataStore.search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
-                        total = self.dataStore.get_total(res)
-                    else:
-                        matchText, _ = self.qryr.question(qst, min_match=0.1)
-                        matchDense.extra_options["similarity"] = 0.17
-                        res = self.dataStore.search(src, highlightFields, filters, [matchText, matchDense, fusionExpr],
-                                                    orderBy, offset, limit, idx_names, kb_ids, rank_feature=rank_feature)
-                        total = self.dataStore.get_total(res)
-                    logging.debug("Dealer.search 2 TOTAL: {}".format(total))
-
-            for k in keywords:
+                matchText, _ = self.qryr.question(query["req"]["question"], min_match=0.1)
+                matchDense = query["matchDense"]
+                matchDense.extra_options["similarity"] = 0.17
+                retry = {**search, "matchExprs": [matchText, matchDense, search["matchExprs"][2]]}
+            retries.append((k, retry))
+        if retries:
+            for (k, _), res in zip(retries, self.dataStore.search_many([retry for _, retry in retries])):
+                ress[k] = res
+                totals[k] = self.dataStore.get_total(res)
+                logging.debug("Dealer.search 2 TOTAL: {}".format(totals[k]))
+
+        results = []
+        for query, res, total in zip(queries, ress, totals):
+            kwds = set([])
+            for k in query["keywords"]:
                 kwds.add(k)
                 for kk in rag_tokenizer.fine_grained_tokenize(k).split():
                     if len(kk) < 2:
@@ -152,20 +199,22 @@ class Dealer:
                         continue
                     kwds.add(kk)
 
-        logging.debug(f"TOTAL: {total}")
-        ids = self.dataStore.get_chunk_ids(res)
-        keywords = list(kwds)
-        highlight = self.dataStore.get_highlight(res, keywords, "content_with_weight")
-        aggs = self.dataStore.get_aggregation(res, "docnm_kwd")
-        return self.SearchResult(
-            total=total,
-            ids=ids,
-            query_vector=q_vec,
-            aggregation=aggs,
-            highlight=highlight,
-            field=self.dataStore.get_fields(res, src + ["_score"]),
-            keywords=keywords
-        )
+            logging.debug(f"TOTAL: {total}")
+            src = query["search"]["selectFields"]
+            ids = self.dataStore.get_chunk_ids(res)
+            keywords = list(kwds)
+            highlight = self.dataStore.get_highlight(res, keywords, "content_with_weight")
+            aggs = self.dataStore.get_aggregation(res, "docnm_kwd")
+            results.append(self.SearchResult(
+                total=total,
+                ids=ids,
+                query_vector=query["q_vec"],
+                aggregation=aggs,
+                highlight=highlight,
+                field=self.dataStore.get_fields(res, src + ["_score"]),
+                keywords=keywords
+            ))
+        return results
 
     @staticmethod
     def trans2floats(txt):
@@ -292,37 +341,27 @@ class Dealer:
                rank_feature: dict | None = None
                ):
         _, keywords = self.qryr.question(query)
-        vector_size = len(sres.query_vector)
-        vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [get_float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
+        if not sres.ids:
             return [], [], []
+        vector_size = len(sres.query_vector)
+        ins_embd = rerank.decode_vectors(sres.field, sres.ids, f"q_{vector_size}_vec", vector_size)
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
                 sres.field[i]["important_kwd"] = [sres.field[i]["important_kwd"]]
+        # Only the presence of a query term in a chunk counts, so repeating fields to weight them is not needed.
         ins_tw = []
         for i in sres.ids:
-            content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
-            title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
-            question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
-            important_kwd = sres.field[i].get("important_kwd", [])
-            tks = content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6
-            ins_tw.append(tks)
+            ins_tw.append((sres.field[i][cfield].split(),
+                           [t for t in sres.field[i].get("title_tks", "").split() if t],
+                           sres.field[i].get("important_kwd", []),
+                           [t for t in sres.field[i].get("question_tks", "").split() if t]))
 
         ## For rank feature(tag_fea) scores.
         rank_fea = self._rank_feature_scores(rank_feature, sres)
 
-        sim, tksim, vtsim = self.qryr.hybrid_similarity(sres.query_vector,
-                                                        ins_embd,
-                                                        keywords,
-                                                        ins_tw, tkweight, vtweight)
+        tksim = rerank.QueryTerms(self.qryr.tw, keywords).similarity(ins_tw)
+        sim, tksim, vtsim = rerank.hybrid_similarity(sres.query_vector, ins_embd, tksim, tkweight, vtweight)
 
         return sim + rank_fea, tksim, vtsim
 
@@ -342,12 +381,12 @@ class Dealer:
             tks = content_ltks + title_tks + important_kwd
             ins_tw.append(tks)
 
-        tksim = self.qryr.token_similarity(keywords, ins_tw)
+        tksim = rerank.QueryTerms(self.qryr.tw, keywords).similarity([(tks,) for tks in ins_tw])
         vtsim, _ = rerank_mdl.similarity(query, [remove_redundant_spaces(" ".join(tks)) for tks in ins_tw])
         ## For rank feature(tag_fea) scores.
         rank_fea = self._rank_feature_scores(rank_feature, sres)
 
-        return tkweight * np.array(tksim) + vtweight * vtsim + rank_fea, tksim, vtsim
+        return tkweight * tksim + vtweight * vtsim + rank_fea, tksim, vtsim
 
     def hybrid_similarity(self, ans_embd, ins_embd, ans, inst):
         return self.qryr.hybrid_similarity(ans_embd,
@@ -358,32 +397,81 @@ class Dealer:
     def retrieval(self, question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold=0.2,
                   vector_similarity_weight=0.3, top=1024, doc_ids=None, aggs=True,
                   rerank_mdl=None, highlight=False,
-                  rank_feature: dict | None = {PAGERANK_FLD: 10}):
-        ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
-        if not question:
-            return ranks
+                  rank_feature: dict | None = {PAGERANK_FLD: 10},
+                  return_vector: bool = True):
+        return self.retrieval_many([question], embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                                   vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight,
+                                   [rank_feature], return_vector)[0]
+
+    def retrieval_many(self, questions: list[str], embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold=0.2,
+                       vector_similarity_weight=0.3, top=1024, doc_ids=None, aggs=True,
+                       rerank_mdl=None, highlight=False,
+                       rank_feature: dict | list | None = {PAGERANK_FLD: 10},
+                       return_vector: bool = True) -> list[dict]:
+        """Same as `retrieval` for each of `questions`, but with their searches sent to the doc store together.
+
+        `rank_feature` is shared by all questions, or is a list of the rank features of each question.
+        """
+        rank_features = rank_feature if isinstance(rank_feature, list) else [rank_feature] * len(questions)
+        results = [{"total": 0, "chunks": [], "doc_aggs": {}} for _ in questions]
+
+        # Chunk vectors are only fetched for the vector similarity of `rerank`, or if the caller needs them.
+        lower_case_doc_engine = os.getenv('DOC_ENGINE', 'elasticsearch')
+        need_vector = return_vector or (not rerank_mdl and lower_case_doc_engine in ["elasticsearch", "opensearch"])
 
         # Ensure RERANK_LIMIT is multiple of page_size
         RERANK_LIMIT = math.ceil(64/page_size) * page_size if page_size>1 else 1
-        req = {"kb_ids": kb_ids, "doc_ids": doc_ids, "page": math.ceil(page_size*page/RERANK_LIMIT), "size": RERANK_LIMIT,
-               "question": question, "vector": True, "topk": top,
-               "similarity": similarity_threshold,
-               "available_int": 1}
-
 
         if isinstance(tenant_ids, str):
             tenant_ids = tenant_ids.split(",")
+        idx_names = [index_name(tid) for tid in tenant_ids]
 
-        sres = self.search(req, [index_name(tid) for tid in tenant_ids],
-                           kb_ids, embd_mdl, highlight, rank_feature=rank_feature)
+        generations = None
+        if retrieval_cache and any(questions):
+            # Generations are read once, so a result computed while chunks are written is not reused afterwards.
+            generations = kb_generations(idx_names, kb_ids)
 
+        pending = []
+        for i, question in enumerate(questions):
+            if not question:
+                continue
+            req = {"kb_ids": kb_ids, "doc_ids": doc_ids, "page": math.ceil(page_size*page/RERANK_LIMIT), "size": RERANK_LIMIT,
+                   "question": question, "vector": need_vector, "topk": top,
+                   "similarity": similarity_threshold,
+                   "available_int": 1}
+            cache_key = None
+            if retrieval_cache:
+                cache_key = retrieval_cache.result_key(question, embd_mdl, rerank_mdl, idx_names, kb_ids, page=page,
+                                                       page_size=page_size, similarity_threshold=similarity_threshold,
+                                                       vector_similarity_weight=vector_similarity_weight, top=top,
+                                                       doc_ids=doc_ids, aggs=aggs, highlight=highlight,
+                                                       rank_feature=rank_features[i], return_vector=return_vector)
+                cached = retrieval_cache.get_result(cache_key, generations)
+                if cached is not None:
+                    results[i] = cached
+                    continue
+            pending.append((i, req, cache_key))
+
+        sress = self.search_many([req for _, req, _ in pending], idx_names, kb_ids, embd_mdl, highlight,
+                                 rank_feature=[rank_features[i] for i, _, _ in pending])
+        for (i, _, cache_key), sres in zip(pending, sress):
+            ranks = self._rank_chunks(sres, questions[i], page, page_size, RERANK_LIMIT, similarity_threshold,
+                                      vector_similarity_weight, aggs, rerank_mdl, highlight, rank_features[i],
+                                      lower_case_doc_engine)
+            if retrieval_cache:
+                retrieval_cache.set_result(cache_key, generations, ranks)
+            results[i] = ranks
+        return results
+
+    def _rank_chunks(self, sres, question, page, page_size, RERANK_LIMIT, similarity_threshold, vector_similarity_weight,
+                     aggs, rerank_mdl, highlight, rank_feature, lower_case_doc_engine):
+        ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
         if rerank_mdl and sres.total > 0:
             sim, tsim, vsim = self.rerank_by_model(rerank_mdl,
                                                    sres, question, 1 - vector_similarity_weight,
                                                    vector_similarity_weight,
                                                    rank_feature=rank_feature)
         else:
-            lower_case_doc_engine = os.getenv('DOC_ENGINE', 'elasticsearch')
             if lower_case_doc_engine in ["elasticsearch","opensearch"]:
                 # ElasticSearch doesn't normalize each way score before fusion.
                 sim, tsim, vsim = self.rerank(
@@ -567,11 +655,14 @@ class Dealer:
         
         vector_size = 1024
         id2idx = {ck["chunk_id"]: i for i, ck in enumerate(chunks)}
+        # The chunks not retrieved yet are fetched together rather than one after another.
+        missing = [cid for cid, _ in ids if cid not in id2idx]
+        fetched = dict(zip(missing, self.dataStore.get_many(missing, idx_nms, kb_ids)))
         for cid, sim in ids:
             if cid in id2idx:
                 chunks[id2idx[cid]]["similarity"] += sim
                 continue
-            chunk = self.dataStore.get(cid, idx_nms, kb_ids)
+            chunk = fetched[cid]
             d = {
                 "chunk_id": cid,
                 "content_ltks": chunk["content_ltks"],
@@ -0,0 +1,75 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Adaptive batch sizing of doc-store bulk inserts.
+
+A batch starts at DOC_BULK_SIZE chunks. It is doubled while bulk requests come back well
+under the target latency, and halved when one is slower than the target. A batch is also
+cut short once its estimated payload reaches `max_bytes`, so chunks with large vectors or
+contents do not produce oversized requests.
+"""
+import threading
+
+
+def estimate_chunk_bytes(chunk: dict) -> int:
+    """Rough size of a chunk in a bulk request body; floats of vectors take about 12 bytes as JSON text."""
+    n = 0
+    for k, v in chunk.items():
+        n += len(k) + 4
+        if isinstance(v, str):
+            n += len(v)
+        elif isinstance(v, (list, tuple)):
+            n += sum(len(x) + 3 if isinstance(x, str) else 12 for x in v)
+        else:
+            n += 12
+    return n
+
+
+class AdaptiveBulkSize:
+    def __init__(self, initial: int, max_size: int, max_bytes: int, target_latency: float):
+        self.max_size = max(1, max_size)
+        self.size = max(1, min(initial, self.max_size))
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self._lock = threading.Lock()
+
+    def batch_end(self, chunks: list[dict], start: int) -> int:
+        """End index of the next batch of `chunks` starting at `start`."""
+        end = min(len(chunks), start + self.size)
+        n_bytes = 0
+        for i in range(start, end):
+            n_bytes += estimate_chunk_bytes(chunks[i])
+            if n_bytes >= self.max_bytes:
+                return i + 1
+        return end
+
+    def record(self, n_chunks: int, elapsed: float):
+        """Adapt the batch size to the latency of a bulk request of `n_chunks` chunks."""
+        with self._lock:
+            if elapsed > self.target_latency:
+                self.size = max(1, self.size // 2)
+            elif elapsed < self.target_latency / 2 and n_chunks >= self.size:
+                self.size = min(self.max_size, self.size * 2)
+
+
+_BULK_SIZES: dict[str, AdaptiveBulkSize] = {}
+
+
+def get_bulk_size(index_name: str, initial: int, max_size: int, max_bytes: int, target_latency: float) -> AdaptiveBulkSize:
+    """Batch sizing shared by all inserts of this process into `index_name`."""
+    if index_name not in _BULK_SIZES:
+        _BULK_SIZES[index_name] = AdaptiveBulkSize(initial, max_size, max_bytes, target_latency)
+    return _BULK_SIZES[index_name]
@@ -0,0 +1,216 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Cross-task embedding batching for the task executor.
+
+Concurrent tasks of the same tenant and embedding model share one EmbeddingBatcher.
+Their `encode` requests are queued and coalesced into batches of up to `batch_size`
+texts. A batch is sent once it is full or once its oldest request has waited
+`max_wait` seconds, so many small documents no longer produce half-empty batches.
+
+Batchers are also keyed by the factory, API key and base URL of the model, so a tenant changing
+them takes effect for the tasks started after, and batchers idle for IDLE_TTL seconds are dropped.
+"""
+import json
+import logging
+import time
+
+import numpy as np
+import trio
+import xxhash
+
+from common.connection_utils import timeout
+
+IDLE_TTL = 600
+
+
+class _EncodeRequest:
+    __slots__ = ("texts", "taken", "enqueued_at", "vectors", "token_count", "error", "done")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.taken = 0
+        self.enqueued_at = trio.current_time()
+        self.vectors = []
+        self.token_count = 0
+        self.error = None
+        self.done = trio.Event()
+
+
+class EmbeddingBatcher:
+    def __init__(self, mdl, batch_size: int, max_wait: float, limiter: trio.CapacityLimiter | None = None):
+        self.mdl = mdl
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.limiter = limiter
+        self._pending: list[_EncodeRequest] = []
+        self._pending_texts = 0
+        self._full = trio.Event()
+        self._flushing = False
+        self._changed = trio.Event()
+        self.last_used = time.monotonic()
+
+        self.batches = 0
+        self.texts = 0
+        self.fill_ratio_sum = 0.0
+        self.requests_batched = 0
+        self.queue_latency_sum = 0.0
+        self.queue_latency_max = 0.0
+
+    async def encode(self, texts: list[str]):
+        """Encode `texts` as part of a shared batch. Returns (vectors, token_count) like `mdl.encode`."""
+        if not texts:
+            return np.array([]), 0
+        self.last_used = time.monotonic()
+        req = _EncodeRequest(texts)
+        self._pending.append(req)
+        self._pending_texts += len(texts)
+        if self._pending_texts >= self.batch_size:
+            self._full.set()
+
+        while not req.done.is_set():
+            if self._flushing:
+                await self._changed.wait()
+                continue
+            # The first waiting caller drives the flushes until the queue is drained. If it
+            # goes away, e.g. its task is cancelled, another waiter takes over.
+            self._flushing = True
+            try:
+                await self._flush_pending()
+            finally:
+                self._flushing = False
+                self._notify()
+
+        if req.error:
+            raise req.error
+        return np.concatenate(req.vectors, axis=0), req.token_count
+
+    async def _flush_pending(self):
+        while self._pending:
+            if self._pending_texts < self.batch_size:
+                with trio.move_on_at(self._pending[0].enqueued_at + self.max_wait):
+                    await self._full.wait()
+            await self._flush_one_batch()
+
+    def _take_batch(self):
+        # Take whole requests until the batch is full; a large request is split across batches.
+        slices = []
+        n = 0
+        now = trio.current_time()
+        while self._pending and n < self.batch_size:
+            req = self._pending[0]
+            if req.taken == 0:
+                latency = now - req.enqueued_at
+                self.requests_batched += 1
+                self.queue_latency_sum += latency
+                self.queue_latency_max = max(self.queue_latency_max, latency)
+            take = min(len(req.texts) - req.taken, self.batch_size - n)
+            slices.append((req, req.taken, req.taken + take))
+            req.taken += take
+            n += take
+            if req.taken >= len(req.texts):
+                self._pending.pop(0)
+        self._pending_texts -= n
+        if self._pending_texts < self.batch_size:
+            self._full = trio.Event()
+        return slices, n
+
+    async def _flush_one_batch(self):
+        slices, n = self._take_batch()
+        self.batches += 1
+        self.texts += n
+        self.fill_ratio_sum += n / self.batch_size
+        batch = [t for req, s, e in slices for t in req.texts[s:e]]
+
+        @timeout(60)
+        def batch_encode(txts):
+            return self.mdl.encode(txts)
+
+        try:
+            if self.limiter:
+                async with self.limiter:
+                    vts, token_count = await trio.to_thread.run_sync(lambda: batch_encode(batch))
+            else:
+                vts, token_count = await trio.to_thread.run_sync(lambda: batch_encode(batch))
+        except Exception as e:
+            logging.exception("EmbeddingBatcher failed to encode a batch of {} texts".format(n))
+            self._fail(slices, e)
+            return
+        except BaseException:
+            self._fail(slices, RuntimeError("The embedding batch was cancelled."))
+            raise
+
+        # Token usage is only known per batch, so it is shared out by text length.
+        total_chars = sum(len(t) for t in batch) or 1
+        i = 0
+        for req, s, e in slices:
+            req.vectors.append(vts[i: i + e - s])
+            req.token_count += int(round(token_count * sum(len(t) for t in req.texts[s:e]) / total_chars))
+            i += e - s
+            if e >= len(req.texts):
+                req.done.set()
+        self._notify()
+
+    def _fail(self, slices, error):
+        for req, _, _ in slices:
+            if req in self._pending:
+                self._pending.remove(req)
+                self._pending_texts -= len(req.texts) - req.taken
+            req.error = error
+            req.done.set()
+        self._notify()
+
+    def idle(self, now: float) -> bool:
+        return not self._pending and not self._flushing and now - self.last_used >= IDLE_TTL
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = trio.Event()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "pending": self._pending_texts,
+            "fill_ratio": round(self.fill_ratio_sum / self.batches, 4) if self.batches else 0.0,
+            "queue_latency_avg": round(self.queue_latency_sum / self.requests_batched, 4) if self.requests_batched else 0.0,
+            "queue_latency_max": round(self.queue_latency_max, 4),
+        }
+
+
+
+_BATCHERS: dict[tuple[str, str, str], EmbeddingBatcher] = {}
+
+
+def _config_key(mdl) -> str:
+    config = getattr(mdl, "model_config", None) or {}
+    fields = [config.get("llm_factory"), config.get("api_key"), config.get("api_base")]
+    return xxhash.xxh64(json.dumps(fields, default=str).encode("utf-8")).hexdigest()
+
+
+def get_embedding_batcher(mdl, batch_size: int, max_wait: float, limiter: trio.CapacityLimiter | None = None) -> EmbeddingBatcher:
+    """Return the batcher shared by all tasks of this process that embed with `mdl`'s tenant, model and model config."""
+    key = (mdl.tenant_id, mdl.llm_name, _config_key(mdl))
+    now = time.monotonic()
+    for k in [k for k, batcher in _BATCHERS.items() if k != key and batcher.idle(now)]:
+        del _BATCHERS[k]
+    if key not in _BATCHERS:
+        _BATCHERS[key] = EmbeddingBatcher(mdl, batch_size, max_wait, limiter)
+    return _BATCHERS[key]
+
+
+def embedding_batcher_stats() -> dict:
+    return {f"{tenant_id}/{llm_name}/{config[:8]}": batcher.stats() for (tenant_id, llm_name, config), batcher in _BATCHERS.items()}
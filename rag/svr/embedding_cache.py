@@ -0,0 +1,177 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Content-addressed cache of chunk embeddings for the task executor.
+
+Vectors are keyed by (tenant, embedding model, xxhash of the text sent to the model), so
+re-parsing a document only embeds the chunks whose text has changed. Tenants may serve models of
+the same name from different backends, so vectors are not shared across tenants. Two backends:
+    - `redis`: shared by all task executors, entries expire after EMBEDDING_CACHE_TTL_DAYS;
+    - `disk`: a SQLite file local to the task executor, least recently used entries are
+      evicted once it grows over EMBEDDING_CACHE_MAX_MB.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import xxhash
+
+from common.file_utils import get_project_base_directory
+from graphrag.utils import decode_embedding, encode_embedding
+from rag.utils.redis_conn import REDIS_CONN
+
+
+def embedding_model_key(mdl) -> str:
+    """Key of the vectors of the embedding model `mdl`, an LLMBundle."""
+    return f"{mdl.tenant_id}:{mdl.llm_name}"
+
+
+def _text_hash(txt: str) -> str:
+    return xxhash.xxh64(txt.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class RedisEmbeddingCache:
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(model_key, txt):
+        return f"embd_cache:{model_key}:{_text_hash(txt)}"
+
+    def get_many(self, model_key: str, txts: list[str]) -> list:
+        return [decode_embedding(bin) for bin in REDIS_CONN.mget([self._key(model_key, t) for t in txts], binary=True)]
+
+    def set_many(self, model_key: str, txts: list[str], vectors):
+        REDIS_CONN.set_many({self._key(model_key, t): encode_embedding(v) for t, v in zip(txts, vectors)}, self.ttl)
+
+
+class DiskEmbeddingCache:
+    def __init__(self, path: str, max_bytes: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embedding ("
+                           "k TEXT PRIMARY KEY, vec BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embedding_accessed ON embedding (accessed)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embedding").fetchone()[0]
+
+    @staticmethod
+    def _key(model_key, txt):
+        return f"{model_key}:{_text_hash(txt)}"
+
+    def get_many(self, model_key: str, txts: list[str]) -> list:
+        keys = [self._key(model_key, t) for t in txts]
+        found = {}
+        with self._lock:
+            # SQLite limits the number of host parameters of a statement.
+            for i in range(0, len(keys), 500):
+                part = keys[i: i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(f"SELECT k, vec FROM embedding WHERE k IN ({marks})", part).fetchall()
+                found.update(rows)
+                if rows:
+                    self._conn.execute(f"UPDATE embedding SET accessed = ? WHERE k IN ({marks})", [time.time()] + part)
+        return [decode_embedding(found.get(k)) for k in keys]
+
+    def set_many(self, model_key: str, txts: list[str], vectors):
+        now = time.time()
+        rows = []
+        for t, v in zip(txts, vectors):
+            bin = encode_embedding(v)
+            rows.append((self._key(model_key, t), bin, len(bin), now))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for row in rows:
+                    old = self._conn.execute("SELECT size FROM embedding WHERE k = ?", (row[0],)).fetchone()
+                    self._conn.execute("INSERT OR REPLACE INTO embedding (k, vec, size, accessed) VALUES (?, ?, ?, ?)", row)
+                    self._size += row[2] - (old[0] if old else 0)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embedding").fetchone()[0]
+                raise
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop the least recently used tenth on top of the overflow, so eviction does not run on every insert.
+        target = self.max_bytes * 0.9
+        freed = 0
+        keys = []
+        for k, size in self._conn.execute("SELECT k, size FROM embedding ORDER BY accessed"):
+            if self._size - freed <= target:
+                break
+            keys.append(k)
+            freed += size
+        for i in range(0, len(keys), 500):
+            part = keys[i: i + 500]
+            self._conn.execute(f"DELETE FROM embedding WHERE k IN ({','.join('?' * len(part))})", part)
+        self._size -= freed
+        logging.info("DiskEmbeddingCache evicted {} vectors ({} bytes)".format(len(keys), freed))
+
+
+class EmbeddingCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model_key: str, txts: list[str]) -> list:
+        """Cached vectors of `txts`, None for misses. Lookup errors count as misses."""
+        try:
+            vectors = self.backend.get_many(model_key, txts)
+        except Exception:
+            logging.exception("EmbeddingCache lookup failed")
+            vectors = [None] * len(txts)
+        hits = sum(1 for v in vectors if v is not None)
+        self.hits += hits
+        self.misses += len(txts) - hits
+        return vectors
+
+    def set_many(self, model_key: str, txts: list[str], vectors):
+        try:
+            self.backend.set_many(model_key, txts, vectors)
+        except Exception:
+            logging.exception("EmbeddingCache update failed")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def init_embedding_cache(backend: str | None = None) -> EmbeddingCache | None:
+    """Create the embedding cache configured by EMBEDDING_CACHE, None if it is disabled."""
+    backend = (backend if backend is not None else os.environ.get("EMBEDDING_CACHE", "")).lower()
+    if backend == "redis":
+        ttl = int(float(os.environ.get("EMBEDDING_CACHE_TTL_DAYS", "7")) * 24 * 3600)
+        return EmbeddingCache(RedisEmbeddingCache(ttl))
+    if backend == "disk":
+        path = os.environ.get("EMBEDDING_CACHE_PATH",
+                              os.path.join(get_project_base_directory(), "embedding_cache", "embedding_cache.db"))
+        max_bytes = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024
+        return EmbeddingCache(DiskEmbeddingCache(path, max_bytes))
+    if backend:
+        logging.warning(f"Unknown EMBEDDING_CACHE backend: {backend}, the embedding cache is disabled.")
+    return None
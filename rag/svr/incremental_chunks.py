@@ -0,0 +1,126 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Incremental re-parsing: the chunks a task builds are diffed against the chunks the previous parse of
+the same pages left in the doc store.
+
+Every chunk is indexed with a digest of its fields and of what its vector is computed from
+(CHUNK_DIGEST_FLD). With INCREMENTAL_REPARSE, `queue_tasks` hands the chunk ids of a previous task to
+the new task of the same pages instead of deleting them, and the task
+    - keeps the chunks it builds which the doc store holds with the same id and digest, neither
+      embedded nor indexed again;
+    - deletes the chunks it inherited but no longer builds;
+    - embeds and indexes the others.
+A chunk may move to the pages of another task of the document, which indexes it while this task no
+longer builds it. So every task adds the ids it builds to a set of the document before indexing them,
+and only deletes the chunks not in this set, both under a lock of the document.
+"""
+import json
+import logging
+import re
+
+import trio
+import xxhash
+
+from api.db.services.task_service import DOC_BUILT_CHUNKS_KEY
+from common import settings
+from common.constants import CHUNK_DIGEST_FLD
+from rag.nlp import search
+from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+
+BUILT_CHUNKS_TTL = 24 * 3600
+# Digests looked up per doc store search.
+LOOKUP_BATCH_SIZE = 256
+# Fields set anew whenever a chunk is built.
+_VOLATILE_FIELDS = {"create_time", "create_timestamp_flt", CHUNK_DIGEST_FLD}
+_VECTOR_FIELD = re.compile(r"q_[0-9]+_vec$")
+
+
+def chunk_digest(d: dict, vector_inputs: str) -> str:
+    fields = {k: v for k, v in d.items() if k not in _VOLATILE_FIELDS and not _VECTOR_FIELD.match(k)}
+    hasher = xxhash.xxh64(vector_inputs.encode("utf-8", "surrogatepass"))
+    hasher.update(json.dumps(fields, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8", "surrogatepass"))
+    return hasher.hexdigest()
+
+
+def set_chunk_digests(chunks: list[dict], embd_id: str, title_weight: float):
+    # The vector of a chunk also depends on the embedding model and on the weight of the document title.
+    vector_inputs = f"{embd_id}\n{title_weight}"
+    for d in chunks:
+        d[CHUNK_DIGEST_FLD] = chunk_digest(d, vector_inputs)
+
+
+async def _stored_digests(task: dict, digests: list[str]) -> dict[str, str]:
+    """Digests of the chunks of the document of `task` the doc store holds with one of `digests`, by chunk id."""
+    idxnm = search.index_name(task["tenant_id"])
+    stored = {}
+    for i in range(0, len(digests), LOOKUP_BATCH_SIZE):
+        batch = digests[i:i + LOOKUP_BATCH_SIZE]
+        condition = {"doc_id": task["doc_id"], CHUNK_DIGEST_FLD: batch}
+        res = await settings.docStoreConn.aio.search([CHUNK_DIGEST_FLD], [], condition, [], OrderByExpr(), 0, len(batch),
+                                                     idxnm, [task["kb_id"]])
+        for chunk_id, fields in settings.docStoreConn.get_fields(res, [CHUNK_DIGEST_FLD]).items():
+            digest = fields.get(CHUNK_DIGEST_FLD)
+            # Infinity returns keyword fields as lists.
+            if isinstance(digest, list):
+                digest = digest[0] if digest else None
+            stored[chunk_id] = digest
+    return stored
+
+
+async def reconcile_chunks(task: dict, chunks: list[dict], prev_chunk_ids: list[str]) -> tuple[list[str], int]:
+    """Ids of the chunks of `chunks` left as indexed, and the number of chunks of `prev_chunk_ids` deleted.
+
+    `chunks` carry their digests, and `prev_chunk_ids` are the chunk ids the task inherited.
+    """
+    prev = set(prev_chunk_ids)
+    built = list(dict.fromkeys(d["id"] for d in chunks))
+    inherited = [d for d in chunks if d["id"] in prev]
+    kept = []
+    if inherited:
+        try:
+            stored = await _stored_digests(task, list({d[CHUNK_DIGEST_FLD] for d in inherited}))
+            kept = list(dict.fromkeys(d["id"] for d in inherited if stored.get(d["id"]) == d[CHUNK_DIGEST_FLD]))
+        except Exception:
+            logging.exception(f"reconcile_chunks({task['id']}) failed to look up previous chunks, indexing all chunks")
+
+    built_set = set(built)
+    gone = [chunk_id for chunk_id in dict.fromkeys(prev_chunk_ids) if chunk_id not in built_set]
+    deleted = await _claim_and_delete(task, built, gone)
+    return kept, deleted
+
+
+async def _claim_and_delete(task: dict, built: list[str], gone: list[str]) -> int:
+    key = DOC_BUILT_CHUNKS_KEY.format(task["doc_id"])
+    lock = RedisDistributedLock(f"{key}:lock", timeout=60, blocking_timeout=10)
+    while not await trio.to_thread.run_sync(lock.acquire):
+        logging.info(f"reconcile_chunks({task['id']}) waiting for the lock of document {task['doc_id']}")
+    try:
+        # Without the set, a chunk built by one task could be deleted by another after it was indexed.
+        if not (await REDIS_CONN.aio.sadd(key, *built) and await REDIS_CONN.aio.expire(key, BUILT_CHUNKS_TTL)):
+            raise Exception("Can't access Redis. Please check the Redis' status.")
+        if not gone:
+            return 0
+        built_elsewhere = await REDIS_CONN.aio.smismember(key, gone)
+        if built_elsewhere is None:
+            raise Exception("Can't access Redis. Please check the Redis' status.")
+        gone = [chunk_id for chunk_id, elsewhere in zip(gone, built_elsewhere) if not elsewhere]
+        if gone:
+            await settings.docStoreConn.aio.delete({"id": gone}, search.index_name(task["tenant_id"]), task["kb_id"])
+        return len(gone)
+    finally:
+        lock.release()
@@ -0,0 +1,177 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Coalesced progress reports and cached cancel checks of the tasks of the task executor.
+
+Each running task has a ProgressReporter. Its progress messages are buffered and written together,
+with the highest progress reported, at most once every `flush_interval` seconds unless
+`flush_messages` messages are buffered; a report after a quiet period is written at once, and
+messages left in the buffer are written by a background thread. Final progress (1.0), errors
+(negative progress) and cancellation are always written immediately, in order with the messages
+before them. Whether the task was canceled is checked at most once every `cancel_check_interval`
+seconds, except on final and error reports.
+
+Reporters are thread-safe, so chunkers running in threads and trio code report to the same one.
+"""
+import logging
+import threading
+import time
+
+from peewee import DoesNotExist
+
+
+class ProgressReporter:
+    def __init__(self, task_id: str, write, is_canceled, flush_interval: float, flush_messages: int,
+                 cancel_check_interval: float):
+        """`write(task_id, info)` writes a progress update as `TaskService.update_progress` does, and
+        `is_canceled(task_id)` tells whether the task was canceled."""
+        self.task_id = task_id
+        self._write = write
+        self._is_canceled = is_canceled
+        self.flush_interval = flush_interval
+        self.flush_messages = max(1, flush_messages)
+        self.cancel_check_interval = cancel_check_interval
+        self._lock = threading.Lock()
+        # Held while writing, so that buffers are written in the order they were taken.
+        self._write_lock = threading.Lock()
+        self._messages: list[str] = []
+        self._progress = None
+        self._pending = False
+        self._written_at = float("-inf")
+        self._checked_at = float("-inf")
+        self._canceled = False
+
+        self.reports = 0
+        self.writes = 0
+        self.cancel_checks = 0
+
+    def canceled(self, refresh: bool = False) -> bool:
+        """Whether the task was canceled, as last checked unless the check is older than
+        `cancel_check_interval` or `refresh` is set."""
+        with self._lock:
+            if self._canceled or (not refresh and time.monotonic() - self._checked_at < self.cancel_check_interval):
+                return self._canceled
+            self._checked_at = time.monotonic()
+            self.cancel_checks += 1
+        canceled = bool(self._is_canceled(self.task_id))
+        with self._lock:
+            self._canceled = self._canceled or canceled
+            return self._canceled
+
+    def report(self, prog=None, msg: str = "", flush: bool = False):
+        """Buffer a progress update, written now if `flush` is set, the progress is final or an error,
+        or the buffer is due."""
+        now = time.monotonic()
+        with self._lock:
+            self.reports += 1
+            if msg:
+                self._messages.append(msg)
+            if prog is not None:
+                if prog < 0 or self._progress is None or prog > self._progress:
+                    self._progress = prog
+                flush = flush or prog < 0 or prog >= 1
+            self._pending = True
+            due = flush or len(self._messages) >= self.flush_messages or now - self._written_at >= self.flush_interval
+        if due:
+            self.flush()
+
+    def due(self) -> bool:
+        with self._lock:
+            return self._pending and time.monotonic() - self._written_at >= self.flush_interval
+
+    def flush(self):
+        """Write the buffered progress update, if any."""
+        with self._write_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                info = {"progress_msg": "\n".join(self._messages)}
+                if self._progress is not None:
+                    info["progress"] = self._progress
+                self._messages, self._progress, self._pending = [], None, False
+                self._written_at = time.monotonic()
+            self._write(self.task_id, info)
+            self.writes += 1
+
+    def stats(self) -> dict:
+        return {"reports": self.reports, "writes": self.writes, "cancel_checks": self.cancel_checks}
+
+
+class ProgressReporters:
+    """The ProgressReporter of each running task, and the thread writing the progress they left buffered."""
+
+    def __init__(self, write, is_canceled, flush_interval: float, flush_messages: int, cancel_check_interval: float):
+        self._write = write
+        self._is_canceled = is_canceled
+        self.flush_interval = flush_interval
+        self.flush_messages = flush_messages
+        self.cancel_check_interval = cancel_check_interval
+        self._lock = threading.Lock()
+        self._reporters: dict[str, ProgressReporter] = {}
+        self._flusher = None
+
+        self.reports = 0
+        self.writes = 0
+        self.cancel_checks = 0
+
+    def get(self, task_id: str) -> ProgressReporter:
+        with self._lock:
+            reporter = self._reporters.get(task_id)
+            if reporter is None:
+                reporter = ProgressReporter(task_id, self._write, self._is_canceled, self.flush_interval,
+                                            self.flush_messages, self.cancel_check_interval)
+                self._reporters[task_id] = reporter
+            if self._flusher is None and self.flush_interval > 0:
+                self._flusher = threading.Thread(target=self._flush_loop, name="progress_flusher", daemon=True)
+                self._flusher.start()
+            return reporter
+
+    def close(self, task_id: str):
+        """Write what the reporter of the task has buffered, and drop it."""
+        with self._lock:
+            reporter = self._reporters.pop(task_id, None)
+        if reporter is None:
+            return
+        try:
+            reporter.flush()
+        finally:
+            with self._lock:
+                self.reports += reporter.reports
+                self.writes += reporter.writes
+                self.cancel_checks += reporter.cancel_checks
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval / 2)
+            with self._lock:
+                reporters = list(self._reporters.values())
+            for reporter in reporters:
+                if not reporter.due():
+                    continue
+                try:
+                    reporter.flush()
+                except DoesNotExist:
+                    logging.warning(f"ProgressReporters flush({reporter.task_id}) got exception DoesNotExist")
+                except Exception:
+                    logging.exception(f"ProgressReporters flush({reporter.task_id}) got exception")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"reports": self.reports, "writes": self.writes, "cancel_checks": self.cancel_checks}
+            for reporter in self._reporters.values():
+                for k, v in reporter.stats().items():
+                    stats[k] += v
+        return stats
@@ -32,7 +32,7 @@ from rag.utils.base64_image import image2id
 from common.log_utils import init_root_logger
 from common.config_utils import show_configs
 from graphrag.general.index import run_graphrag_for_kb
-from graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache
+from graphrag.utils import cache_stats, get_llm_cache_many, set_llm_cache_many, get_tags_from_cache, set_tags_to_cache
 from rag.prompts.generator import keyword_extraction, question_proposal, content_tagging, run_toc_from_text
 import logging
 import os
@@ -63,11 +63,18 @@ from rag.nlp import search, rag_tokenizer, add_positions
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
 from common.token_utils import num_tokens_from_string, truncate
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+from rag.utils.client_pool import client_pool_stats
+from rag.svr.embedding_batcher import get_embedding_batcher, embedding_batcher_stats
+from rag.svr.embedding_cache import init_embedding_cache, embedding_model_key
+from rag.svr.bulk_insert import get_bulk_size
+from rag.svr.progress_reporter import ProgressReporters
+from rag.svr.incremental_chunks import reconcile_chunks, set_chunk_digests
+from rag.utils.task_cost import record_task_cost
 from graphrag.utils import chat_limiter
 from common.signal_utils import start_tracemalloc_and_snapshot, stop_tracemalloc
 from common.exceptions import TaskCanceledException
 from common import settings
-from common.constants import PAGERANK_FLD, TAG_FLD, SVR_CONSUMER_GROUP_NAME
+from common.constants import CHUNK_DIGEST_FLD, PAGERANK_FLD, TAG_FLD, SVR_CONSUMER_GROUP_NAME
 
 BATCH_SIZE = 64
 
@@ -112,6 +119,18 @@ CURRENT_TASKS = {}
 MAX_CONCURRENT_TASKS = int(os.environ.get('MAX_CONCURRENT_TASKS', "5"))
 MAX_CONCURRENT_CHUNK_BUILDERS = int(os.environ.get('MAX_CONCURRENT_CHUNK_BUILDERS', "1"))
 MAX_CONCURRENT_MINIO = int(os.environ.get('MAX_CONCURRENT_MINIO', '10'))
+PIPELINED_INGESTION = int(os.environ.get('PIPELINED_INGESTION', "0"))
+PIPELINE_CHANNEL_SIZE = int(os.environ.get('PIPELINE_CHANNEL_SIZE', "4"))
+EMBEDDING_BATCHER = int(os.environ.get('EMBEDDING_BATCHER', "0"))
+EMBEDDING_BATCH_MAX_WAIT = int(os.environ.get('EMBEDDING_BATCH_MAX_WAIT_MS', "50")) / 1000.
+DOC_BULK_CONCURRENCY = int(os.environ.get('DOC_BULK_CONCURRENCY', "2"))
+DOC_BULK_MAX_SIZE = int(os.environ.get('DOC_BULK_MAX_SIZE', "256"))
+DOC_BULK_MAX_BYTES = int(os.environ.get('DOC_BULK_MAX_MB', "8")) * 1024 * 1024
+DOC_BULK_TARGET_LATENCY = int(os.environ.get('DOC_BULK_TARGET_LATENCY_MS', "1000")) / 1000.
+PROGRESS_FLUSH_INTERVAL = int(os.environ.get('PROGRESS_FLUSH_INTERVAL_MS', "1000")) / 1000.
+PROGRESS_FLUSH_MESSAGES = int(os.environ.get('PROGRESS_FLUSH_MESSAGES', "20"))
+PROGRESS_CANCEL_CHECK_INTERVAL = int(os.environ.get('PROGRESS_CANCEL_CHECK_INTERVAL_MS', "2000")) / 1000.
+embedding_cache = None
 task_limiter = trio.Semaphore(MAX_CONCURRENT_TASKS)
 chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 embed_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
@@ -131,11 +150,22 @@ def signal_handler(sig, frame):
 
 
 
+def write_progress(task_id, info):
+    TaskService.update_progress(task_id, info)
+    close_connection()
+
+
+PROGRESS_REPORTERS = ProgressReporters(write_progress, has_canceled, PROGRESS_FLUSH_INTERVAL, PROGRESS_FLUSH_MESSAGES,
+                                       PROGRESS_CANCEL_CHECK_INTERVAL)
+
+
 def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing..."):
     try:
         if prog is not None and prog < 0:
             msg = "[ERROR]" + msg
-        cancel = has_canceled(task_id)
+        reporter = PROGRESS_REPORTERS.get(task_id)
+        # Final and error reports check for cancellation afresh, others rely on the last check.
+        cancel = reporter.canceled(refresh=prog is not None and (prog < 0 or prog >= 1))
 
         if cancel:
             msg += " [Canceled]"
@@ -147,13 +177,7 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
                     msg = f"Page({from_page + 1}~{to_page + 1}): " + msg
         if msg:
             msg = datetime.now().strftime("%H:%M:%S") + " " + msg
-        d = {"progress_msg": msg}
-        if prog is not None:
-            d["progress"] = prog
-
-        TaskService.update_progress(task_id, d)
-
-        close_connection()
+        reporter.report(prog, msg)
         if cancel:
             raise TaskCanceledException(msg)
         logging.info(f"set_progress({task_id}), progress: {prog}, progress_msg: {msg}")
@@ -175,7 +199,7 @@ async def collect():
             redis_msg = next(UNACKED_ITERATOR)
         except StopIteration:
             for svr_queue_name in svr_queue_names:
-                redis_msg = REDIS_CONN.queue_consumer(svr_queue_name, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
+                redis_msg = await REDIS_CONN.aio.queue_consumer(svr_queue_name, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
                 if redis_msg:
                     break
     except Exception:
@@ -212,6 +236,8 @@ async def collect():
 
     task_type = msg.get("task_type", "")
     task["task_type"] = task_type
+    task["incremental_reparse"] = msg.get("incremental_reparse", False)
+    task["cost_estimate"] = msg.get("cost_estimate")
     if task_type[:8] == "dataflow":
         task["tenant_id"] = msg["tenant_id"]
         task["dataflow_id"] = msg["dataflow_id"]
@@ -274,7 +300,8 @@ async def build_chunks(task, progress_callback):
     @timeout(60)
     async def upload_to_minio(document, chunk):
         try:
-            d = copy.deepcopy(document)
+            # `document` only holds scalars.
+            d = dict(document)
             d.update(chunk)
             d["id"] = xxhash.xxh64((chunk["content_with_weight"] + str(d["doc_id"])).encode("utf-8", "surrogatepass")).hexdigest()
             d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
@@ -303,19 +330,25 @@ async def build_chunks(task, progress_callback):
         progress_callback(msg="Start to generate keywords for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
 
-        async def doc_keyword_extraction(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "keywords", {"topn": topn})
+        topn = task["parser_config"]["auto_keywords"]
+        cached_kwds = get_llm_cache_many(chat_mdl.llm_name, [d["content_with_weight"] for d in docs], "keywords", {"topn": topn})
+        to_cache = []
+
+        async def doc_keyword_extraction(chat_mdl, d, topn, cached):
             if not cached:
                 async with chat_limiter:
                     cached = await trio.to_thread.run_sync(lambda: keyword_extraction(chat_mdl, d["content_with_weight"], topn))
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "keywords", {"topn": topn})
+                to_cache.append((d["content_with_weight"], cached))
             if cached:
                 d["important_kwd"] = cached.split(",")
                 d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
             return
-        async with trio.open_nursery() as nursery:
-            for d in docs:
-                nursery.start_soon(doc_keyword_extraction, chat_mdl, d, task["parser_config"]["auto_keywords"])
+        try:
+            async with trio.open_nursery() as nursery:
+                for d, cached in zip(docs, cached_kwds):
+                    nursery.start_soon(doc_keyword_extraction, chat_mdl, d, topn, cached)
+        finally:
+            set_llm_cache_many(chat_mdl.llm_name, to_cache, "keywords", {"topn": topn})
         progress_callback(msg="Keywords generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
 
     if task["parser_config"].get("auto_questions", 0):
@@ -323,18 +356,24 @@ async def build_chunks(task, progress_callback):
         progress_callback(msg="Start to generate questions for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
 
-        async def doc_question_proposal(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "question", {"topn": topn})
+        topn = task["parser_config"]["auto_questions"]
+        cached_questions = get_llm_cache_many(chat_mdl.llm_name, [d["content_with_weight"] for d in docs], "question", {"topn": topn})
+        to_cache = []
+
+        async def doc_question_proposal(chat_mdl, d, topn, cached):
             if not cached:
                 async with chat_limiter:
                     cached = await trio.to_thread.run_sync(lambda: question_proposal(chat_mdl, d["content_with_weight"], topn))
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "question", {"topn": topn})
+                to_cache.append((d["content_with_weight"], cached))
             if cached:
                 d["question_kwd"] = cached.split("\n")
                 d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
-        async with trio.open_nursery() as nursery:
-            for d in docs:
-                nursery.start_soon(doc_question_proposal, chat_mdl, d, task["parser_config"]["auto_questions"])
+        try:
+            async with trio.open_nursery() as nursery:
+                for d, cached in zip(docs, cached_questions):
+                    nursery.start_soon(doc_question_proposal, chat_mdl, d, topn, cached)
+        finally:
+            set_llm_cache_many(chat_mdl.llm_name, to_cache, "question", {"topn": topn})
         progress_callback(msg="Question generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
 
     if task["kb_parser_config"].get("tag_kb_ids", []):
@@ -356,7 +395,7 @@ async def build_chunks(task, progress_callback):
 
         docs_to_tag = []
         for d in docs:
-            task_canceled = has_canceled(task["id"])
+            task_canceled = PROGRESS_REPORTERS.get(task["id"]).canceled()
             if task_canceled:
                 progress_callback(-1, msg="Task has been canceled.")
                 return None
@@ -365,8 +404,10 @@ async def build_chunks(task, progress_callback):
             else:
                 docs_to_tag.append(d)
 
-        async def doc_content_tagging(chat_mdl, d, topn_tags):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
+        cached_tags = get_llm_cache_many(chat_mdl.llm_name, [d["content_with_weight"] for d in docs_to_tag], all_tags, {"topn": topn_tags})
+        to_cache = []
+
+        async def doc_content_tagging(chat_mdl, d, topn_tags, cached):
             if not cached:
                 picked_examples = random.choices(examples, k=2) if len(examples)>2 else examples
                 if not picked_examples:
@@ -375,12 +416,15 @@ async def build_chunks(task, progress_callback):
                     cached = await trio.to_thread.run_sync(lambda: content_tagging(chat_mdl, d["content_with_weight"], all_tags, picked_examples, topn=topn_tags))
                 if cached:
                     cached = json.dumps(cached)
+                    to_cache.append((d["content_with_weight"], cached))
             if cached:
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, all_tags, {"topn": topn_tags})
                 d[TAG_FLD] = json.loads(cached)
-        async with trio.open_nursery() as nursery:
-            for d in docs_to_tag:
-                nursery.start_soon(doc_content_tagging, chat_mdl, d, topn_tags)
+        try:
+            async with trio.open_nursery() as nursery:
+                for d, cached in zip(docs_to_tag, cached_tags):
+                    nursery.start_soon(doc_content_tagging, chat_mdl, d, topn_tags, cached)
+        finally:
+            set_llm_cache_many(chat_mdl.llm_name, to_cache, all_tags, {"topn": topn_tags})
         progress_callback(msg="Tagging {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
 
     return docs
@@ -411,6 +455,7 @@ def build_TOC(task, docs, progress_callback):
 
     if toc:
         d = copy.deepcopy(docs[-1])
+        d.pop(CHUNK_DIGEST_FLD, None)
         d["content_with_weight"] = json.dumps(toc, ensure_ascii=False)
         d["toc_kwd"] = "toc"
         d["available_int"] = 0
@@ -425,12 +470,9 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.createIdx(idxnm, row.get("kb_id", ""), vector_size)
 
 
-async def embedding(docs, mdl, parser_config=None, callback=None):
-    if parser_config is None:
-        parser_config = {}
-    tts, cnts = [], []
+def embedding_contents(docs):
+    cnts = []
     for d in docs:
-        tts.append(d.get("docnm_kwd", "Title"))
         c = "\n".join(d.get("question_kwd", []))
         if not c:
             c = d["content_with_weight"]
@@ -438,22 +480,63 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         if not c:
             c = "None"
         cnts.append(c)
+    return cnts
+
+
+def title_embedding_weight(parser_config):
+    filename_embd_weight = parser_config.get("filename_embd_weight", 0.1) # due to the db support none value
+    if not filename_embd_weight:
+        filename_embd_weight = 0.1
+    return float(filename_embd_weight)
+
+
+async def encode_texts(mdl, txts):
+    """Encode chunk texts. Only texts missing from the embedding cache, if enabled, are sent to the model."""
+    txts = [truncate(c, mdl.max_length-10) for c in txts]
+    if embedding_cache is None:
+        return await encode_with_model(mdl, txts)
+
+    vectors = await trio.to_thread.run_sync(embedding_cache.get_many, embedding_model_key(mdl), txts)
+    missed = [i for i, v in enumerate(vectors) if v is None]
+    tk_count = 0
+    if missed:
+        missed_txts = [txts[i] for i in missed]
+        vts, tk_count = await encode_with_model(mdl, missed_txts)
+        await trio.to_thread.run_sync(embedding_cache.set_many, embedding_model_key(mdl), missed_txts, vts)
+        for i, v in zip(missed, vts):
+            vectors[i] = v
+    return np.stack(vectors), tk_count
+
+
+async def encode_with_model(mdl, txts):
+    """Encode texts with the model, through the process-wide embedding batcher if enabled."""
+    if EMBEDDING_BATCHER:
+        batcher = get_embedding_batcher(mdl, settings.EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_WAIT, embed_limiter)
+        return await batcher.encode(txts)
+
+    @timeout(60)
+    def batch_encode():
+        return mdl.encode(txts)
+
+    async with embed_limiter:
+        return await trio.to_thread.run_sync(batch_encode)
+
+
+async def embedding(docs, mdl, parser_config=None, callback=None):
+    if parser_config is None:
+        parser_config = {}
+    tts = [d.get("docnm_kwd", "Title") for d in docs]
+    cnts = embedding_contents(docs)
 
     tk_count = 0
     if len(tts) == len(cnts):
-        vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0: 1]))
+        vts, c = await encode_texts(mdl, tts[0: 1])
         tts = np.tile(vts[0], (len(cnts), 1))
         tk_count += c
 
-    @timeout(60)
-    def batch_encode(txts):
-        nonlocal mdl
-        return mdl.encode([truncate(c, mdl.max_length-10) for c in txts])
-
     cnts_ = np.array([])
     for i in range(0, len(cnts), settings.EMBEDDING_BATCH_SIZE):
-        async with embed_limiter:
-            vts, c = await trio.to_thread.run_sync(lambda: batch_encode(cnts[i: i + settings.EMBEDDING_BATCH_SIZE]))
+        vts, c = await encode_texts(mdl, cnts[i: i + settings.EMBEDDING_BATCH_SIZE])
         if len(cnts_) == 0:
             cnts_ = vts
         else:
@@ -461,10 +544,7 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         tk_count += c
         callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
     cnts = cnts_
-    filename_embd_weight = parser_config.get("filename_embd_weight", 0.1) # due to the db support none value
-    if not filename_embd_weight:
-        filename_embd_weight = 0.1
-    title_w = float(filename_embd_weight)
+    title_w = title_embedding_weight(parser_config)
     if tts.ndim == 2 and cnts.ndim == 2 and tts.shape == cnts.shape:
         vects = title_w * tts + (1 - title_w) * cnts
     else:
@@ -479,6 +559,84 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
     return tk_count, vector_size
 
 
+async def embed_and_insert_pipelined(task, docs, mdl, progress_callback, keep_vectors=False, indexed_chunk_ids=None):
+    """Embed and index `docs` as a stream of batches instead of stage by stage.
+
+    Chunks flow through bounded memory channels: a batch is sent to the embedding
+    model as soon as EMBEDDING_BATCH_SIZE chunks are available, and embedded batches
+    are bulk-inserted into the doc store while later ones are still being encoded.
+    Unless `keep_vectors` is set, vectors are dropped from the chunk dicts once they
+    are indexed, so only PIPELINE_CHANNEL_SIZE batches of vectors are alive at a time.
+    `indexed_chunk_ids` holds the ids of the chunks of the task already indexed.
+
+    Returns:
+        (token_count, vector_size, chunk_ids), or None if indexing was aborted.
+    """
+    parser_config = task["parser_config"] or {}
+    title_w = title_embedding_weight(parser_config)
+    tk_count = 0
+    vector_size = 0
+    if indexed_chunk_ids is None:
+        indexed_chunk_ids = []
+    indexed_before = len(indexed_chunk_ids)
+    aborted = False
+
+    vts, c = await encode_texts(mdl, [docs[0].get("docnm_kwd", "Title")])
+    title_vec = vts[0]
+    tk_count += c
+
+    async def produce(send_channel):
+        async with send_channel:
+            for i in range(0, len(docs), settings.EMBEDDING_BATCH_SIZE):
+                await send_channel.send(docs[i: i + settings.EMBEDDING_BATCH_SIZE])
+
+    async def embed(receive_channel, send_channel):
+        nonlocal tk_count, vector_size
+        async with receive_channel, send_channel:
+            async for batch in receive_channel:
+                cnts = embedding_contents(batch)
+                vts, c = await encode_texts(mdl, cnts)
+                tk_count += c
+                if vts.ndim == 2 and vts.shape[1] == title_vec.shape[0]:
+                    vts = title_w * title_vec + (1 - title_w) * vts
+                assert len(vts) == len(batch)
+                for d, v in zip(batch, vts):
+                    v = v.tolist()
+                    vector_size = len(v)
+                    d["q_%d_vec" % vector_size] = v
+                await send_channel.send(batch)
+
+    def insert_callback(prog=None, msg=""):
+        # per-batch progress of insert_es is meaningless here, only errors are forwarded
+        if prog is not None and prog < 0:
+            progress_callback(prog, msg=msg)
+
+    async def insert(receive_channel):
+        nonlocal aborted
+        async with receive_channel:
+            async for batch in receive_channel:
+                if not await insert_es(task["id"], task["tenant_id"], task["kb_id"], batch, insert_callback,
+                                       indexed_chunk_ids=indexed_chunk_ids):
+                    aborted = True
+                    nursery.cancel_scope.cancel()
+                    return
+                if not keep_vectors:
+                    for d in batch:
+                        d.pop("q_%d_vec" % vector_size, None)
+                progress_callback(prog=0.7 + 0.25 * (len(indexed_chunk_ids) - indexed_before) / len(docs), msg="")
+
+    async with trio.open_nursery() as nursery:
+        embed_send, embed_receive = trio.open_memory_channel(PIPELINE_CHANNEL_SIZE)
+        insert_send, insert_receive = trio.open_memory_channel(PIPELINE_CHANNEL_SIZE)
+        nursery.start_soon(produce, embed_send)
+        nursery.start_soon(embed, embed_receive, insert_send)
+        nursery.start_soon(insert, insert_receive)
+
+    if aborted:
+        return None
+    return tk_count, vector_size, indexed_chunk_ids
+
+
 async def run_dataflow(task: dict):
     from api.db.services.canvas_service import UserCanvasService
     from rag.flow.pipeline import Pipeline
@@ -719,31 +877,77 @@ async def delete_image(kb_id, chunk_id):
         raise
 
 
-async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback):
-    for b in range(0, len(chunks), settings.DOC_BULK_SIZE):
-        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b:b + settings.DOC_BULK_SIZE], search.index_name(task_tenant_id), task_dataset_id))
-        task_canceled = has_canceled(task_id)
-        if task_canceled:
-            progress_callback(-1, msg="Task has been canceled.")
-            return False
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
-        if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + settings.DOC_BULK_SIZE]]
-        chunk_ids_str = " ".join(chunk_ids)
+async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback, indexed_chunk_ids=None):
+    """Bulk-insert `chunks` with up to DOC_BULK_CONCURRENCY requests in flight and adaptive batch sizes.
+
+    The ids of inserted chunks are appended to the task as each batch completes.
+    """
+    # `indexed_chunk_ids` collects the ids of this task's chunks across calls, e.g. batches of a pipelined ingestion.
+    if indexed_chunk_ids is None:
+        indexed_chunk_ids = []
+    idxnm = search.index_name(task_tenant_id)
+    bulk_size = get_bulk_size(idxnm, settings.DOC_BULK_SIZE, DOC_BULK_MAX_SIZE, DOC_BULK_MAX_BYTES, DOC_BULK_TARGET_LATENCY)
+    in_flight = trio.Semaphore(DOC_BULK_CONCURRENCY)
+    error_message = None
+    task_unknown = False
+    inserted = 0
+
+    async def insert_batch(batch):
+        nonlocal error_message, task_unknown, inserted
         try:
-            TaskService.update_chunk_ids(task_id, chunk_ids_str)
-        except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
-            async with trio.open_nursery() as nursery:
-                for chunk_id in chunk_ids:
-                    nursery.start_soon(delete_image, task_dataset_id, chunk_id)
-            progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
-            return False
+            st = timer()
+            doc_store_result = await settings.docStoreConn.aio.insert(batch, idxnm, task_dataset_id)
+            bulk_size.record(len(batch), timer() - st)
+            if doc_store_result:
+                error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
+                nursery.cancel_scope.cancel()
+                return
+            chunk_ids = [chunk["id"] for chunk in batch]
+            first_batch = not indexed_chunk_ids
+            indexed_chunk_ids.extend(chunk_ids)
+            try:
+                if first_batch:
+                    TaskService.update_chunk_ids(task_id, " ".join(chunk_ids))
+                else:
+                    TaskService.append_chunk_ids(task_id, " ".join(chunk_ids))
+            except DoesNotExist:
+                task_unknown = True
+                nursery.cancel_scope.cancel()
+                return
+            if (inserted + len(batch)) // 128 > inserted // 128:
+                progress_callback(prog=0.8 + 0.1 * (inserted + 1) / len(chunks), msg="")
+            inserted += len(batch)
+        finally:
+            in_flight.release()
+
+    async with trio.open_nursery() as nursery:
+        b = 0
+        while b < len(chunks):
+            await in_flight.acquire()
+            if PROGRESS_REPORTERS.get(task_id).canceled():
+                in_flight.release()
+                nursery.cancel_scope.cancel()
+                progress_callback(-1, msg="Task has been canceled.")
+                return False
+            e = bulk_size.batch_end(chunks, b)
+            nursery.start_soon(insert_batch, chunks[b:e])
+            b = e
+
+    if error_message:
+        progress_callback(-1, msg=error_message)
+        raise Exception(error_message)
+    if task_unknown:
+        logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
+        chunk_ids = list(indexed_chunk_ids)
+        await settings.docStoreConn.aio.delete({"id": chunk_ids}, idxnm, task_dataset_id)
+        async with trio.open_nursery() as nursery:
+            for chunk_id in chunk_ids:
+                nursery.start_soon(delete_image, task_dataset_id, chunk_id)
+        progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
+        return False
+    if PROGRESS_REPORTERS.get(task_id).canceled(refresh=True):
+        progress_callback(-1, msg="Task has been canceled.")
+        return False
     return True
 
 
@@ -780,7 +984,7 @@ async def do_handle_task(task):
         progress_callback(-1, msg=error_message)
         raise Exception(error_message)
 
-    task_canceled = has_canceled(task_id)
+    task_canceled = PROGRESS_REPORTERS.get(task_id).canceled(refresh=True)
     if task_canceled:
         progress_callback(-1, msg="Task has been canceled.")
         return
@@ -797,6 +1001,26 @@ async def do_handle_task(task):
         raise
 
     init_kb(task, vector_size)
+    # Ids of the chunks of this task in the doc store, recorded as the task's chunk_ids.
+    indexed_chunk_ids = []
+
+    async def finish_toc_and_task():
+        if toc_thread:
+            d = toc_thread.result()
+            if d:
+                e = await insert_es(task_id, task_tenant_id, task_dataset_id, [d], progress_callback,
+                                    indexed_chunk_ids=indexed_chunk_ids)
+                if not e:
+                    return
+                DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, 0, 1, 0)
+
+        task_time_cost = timer() - task_start_ts
+        progress_callback(prog=1.0, msg="Task done ({:.2f}s)".format(task_time_cost))
+        record_task_cost(task, task_time_cost)
+        logging.info(
+            "Chunk doc({}), page({}-{}), chunks({}), token({}), elapsed:{:.2f}".format(task_document_name, task_from_page,
+                                                                                       task_to_page, len(chunks),
+                                                                                       token_count, task_time_cost))
 
     if task_type[:len("dataflow")] == "dataflow":
         await run_dataflow(task)
@@ -901,10 +1125,55 @@ async def do_handle_task(task):
         start_ts = timer()
         chunks = await build_chunks(task, progress_callback)
         logging.info("Build document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
+        chunks = chunks or []
+        set_chunk_digests(chunks, task_embedding_id, title_embedding_weight(task_parser_config))
+        if task.get("incremental_reparse"):
+            # Chunks the previous parse of these pages left in the doc store, handed over by queue_tasks.
+            ok, prev_task = TaskService.get_by_id(task_id)
+            if not ok:
+                progress_callback(-1, msg=f"Task {task_id} is unknown.")
+                return
+            prev_chunk_ids = (prev_task.chunk_ids or "").split()
+            kept_chunk_ids, deleted = await reconcile_chunks(task, chunks, prev_chunk_ids)
+            TaskService.update_chunk_ids(task_id, " ".join(kept_chunk_ids))
+            indexed_chunk_ids.extend(kept_chunk_ids)
+            progress_callback(msg="Keep {} unchanged chunks, delete {} previous chunks".format(len(kept_chunk_ids), deleted))
         if not chunks:
             progress_callback(1., msg=f"No chunk built from {task_document_name}")
             return
         progress_callback(msg="Generate {} chunks".format(len(chunks)))
+        with_toc = task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False)
+        built_chunks = chunks
+        if indexed_chunk_ids:
+            kept = set(indexed_chunk_ids)
+            chunks = [d for d in built_chunks if d["id"] not in kept]
+            if not chunks:
+                if with_toc:
+                    toc_thread = executor.submit(build_TOC, task, built_chunks, progress_callback)
+                DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, 0, len(kept), 0)
+                await finish_toc_and_task()
+                return
+        if PIPELINED_INGESTION:
+            start_ts = timer()
+            try:
+                res = await embed_and_insert_pipelined(task, chunks, embedding_model, progress_callback, keep_vectors=with_toc,
+                                                       indexed_chunk_ids=indexed_chunk_ids)
+            except Exception as e:
+                error_message = "Embedding and indexing error:{}".format(str(e))
+                progress_callback(-1, error_message)
+                logging.exception(error_message)
+                raise
+            if res is None:
+                return
+            token_count, vector_size, chunk_ids = res
+            progress_message = "Embedding and indexing chunks ({:.2f}s)".format(timer() - start_ts)
+            logging.info(progress_message)
+            progress_callback(msg=progress_message)
+            if with_toc:
+                toc_thread = executor.submit(build_TOC, task, built_chunks, progress_callback)
+            DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, token_count, len(set(chunk_ids)), 0)
+            await finish_toc_and_task()
+            return
         start_ts = timer()
         try:
             token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
@@ -917,12 +1186,12 @@ async def do_handle_task(task):
         progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
         logging.info(progress_message)
         progress_callback(msg=progress_message)
-        if task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False):
-            toc_thread = executor.submit(build_TOC,task, chunks, progress_callback)
+        if with_toc:
+            toc_thread = executor.submit(build_TOC,task, built_chunks, progress_callback)
 
-    chunk_count = len(set([chunk["id"] for chunk in chunks]))
+    chunk_count = len(set([chunk["id"] for chunk in chunks] + indexed_chunk_ids))
     start_ts = timer()
-    e = await insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback)
+    e = await insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback, indexed_chunk_ids=indexed_chunk_ids)
     if not e:
         return
 
@@ -934,20 +1203,7 @@ async def do_handle_task(task):
 
     time_cost = timer() - start_ts
     progress_callback(msg="Indexing done ({:.2f}s).".format(time_cost))
-    if toc_thread:
-        d = toc_thread.result()
-        if d:
-            e = await insert_es(task_id, task_tenant_id, task_dataset_id, [d], progress_callback)
-            if not e:
-                return
-            DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, 0, 1, 0)
-
-    task_time_cost = timer() - task_start_ts
-    progress_callback(prog=1.0, msg="Task done ({:.2f}s)".format(task_time_cost))
-    logging.info(
-        "Chunk doc({}), page({}-{}), chunks({}), token({}), elapsed:{:.2f}".format(task_document_name, task_from_page,
-                                                                                   task_to_page, len(chunks),
-                                                                                   token_count, task_time_cost))
+    await finish_toc_and_task()
 
 
 async def handle_task():
@@ -981,6 +1237,12 @@ async def handle_task():
             pass
         logging.exception(f"handle_task got exception for task {json.dumps(task)}")
     finally:
+        try:
+            PROGRESS_REPORTERS.close(task["id"])
+        except DoesNotExist:
+            logging.warning(f"handle_task close progress reporter of task {task['id']} got exception DoesNotExist")
+        except Exception:
+            logging.exception(f"handle_task close progress reporter of task {task['id']} got exception")
         task_document_ids = []
         if task_type in ["graphrag", "raptor", "mindmap"]:
             task_document_ids = task["doc_ids"]
@@ -1003,12 +1265,12 @@ async def get_server_ip() -> str:
 
 async def report_status():
     global CONSUMER_NAME, BOOT_AT, PENDING_TASKS, LAG_TASKS, DONE_TASKS, FAILED_TASKS
-    REDIS_CONN.sadd("TASKEXE", CONSUMER_NAME)
+    await REDIS_CONN.aio.sadd("TASKEXE", CONSUMER_NAME)
     redis_lock = RedisDistributedLock("clean_task_executor", lock_value=CONSUMER_NAME, timeout=60)
     while True:
         try:
             now = datetime.now()
-            group_info = REDIS_CONN.queue_info(settings.get_svr_queue_name(0), SVR_CONSUMER_GROUP_NAME)
+            group_info = await REDIS_CONN.aio.queue_info(settings.get_svr_queue_name(0), SVR_CONSUMER_GROUP_NAME)
             if group_info is not None:
                 PENDING_TASKS = int(group_info.get("pending", 0))
                 LAG_TASKS = int(group_info.get("lag", 0))
@@ -1027,27 +1289,32 @@ async def report_status():
                 "done": DONE_TASKS,
                 "failed": FAILED_TASKS,
                 "current": current,
+                "embedding_batchers": embedding_batcher_stats(),
+                "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+                "llm_embed_cache": cache_stats(),
+                "client_pools": client_pool_stats(),
+                "progress_reporters": PROGRESS_REPORTERS.stats(),
             })
-            REDIS_CONN.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
+            await REDIS_CONN.aio.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
             logging.info(f"{CONSUMER_NAME} reported heartbeat: {heartbeat}")
 
-            expired = REDIS_CONN.zcount(CONSUMER_NAME, 0, now.timestamp() - 60 * 30)
+            expired = await REDIS_CONN.aio.zcount(CONSUMER_NAME, 0, now.timestamp() - 60 * 30)
             if expired > 0:
-                REDIS_CONN.zpopmin(CONSUMER_NAME, expired)
+                await REDIS_CONN.aio.zpopmin(CONSUMER_NAME, expired)
 
             # clean task executor
             if redis_lock.acquire():
-                task_executors = REDIS_CONN.smembers("TASKEXE")
+                task_executors = await REDIS_CONN.aio.smembers("TASKEXE")
                 for consumer_name in task_executors:
                     if consumer_name == CONSUMER_NAME:
                         continue
-                    expired = REDIS_CONN.zcount(
+                    expired = await REDIS_CONN.aio.zcount(
                         consumer_name, now.timestamp() - WORKER_HEARTBEAT_TIMEOUT, now.timestamp() + 10
                     )
                     if expired == 0:
                         logging.info(f"{consumer_name} expired, removed")
-                        REDIS_CONN.srem("TASKEXE", consumer_name)
-                        REDIS_CONN.delete(consumer_name)
+                        await REDIS_CONN.aio.srem("TASKEXE", consumer_name)
+                        await REDIS_CONN.aio.delete(consumer_name)
         except Exception:
             logging.exception("report_status got exception")
         finally:
@@ -1063,6 +1330,7 @@ async def task_manager():
 
 
 async def main():
+    global embedding_cache
     logging.info(r"""
     ____                      __  _
    /  _/___  ____ ____  _____/ /_(_)___  ____     ________  ______   _____  _____
@@ -1077,6 +1345,8 @@ async def main():
     settings.check_and_install_torch()
     logging.info(f'settings.EMBEDDING_CFG: {settings.EMBEDDING_CFG}')
     settings.print_rag_settings()
+    rag_tokenizer.init_tokenize_pool()
+    embedding_cache = init_embedding_cache()
     if sys.platform != "win32":
         signal.signal(signal.SIGUSR1, start_tracemalloc_and_snapshot)
         signal.signal(signal.SIGUSR2, stop_tracemalloc)
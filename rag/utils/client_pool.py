@@ -0,0 +1,148 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Async access to the synchronous Redis and doc store clients, with pools of explicit size.
+
+Each client has a ClientPool of as many worker threads as its connection pool has connections.
+`await client.aio.<method>(...)` runs `client.<method>(...)` on a thread of the pool, from trio
+(the task executor) as well as from asyncio (the API server). Calls queue for the pool rather than
+for the default thread limiter of trio or the default executor of asyncio, so Redis and doc store
+calls neither starve, nor are starved by, chunking and model calls running in threads.
+Every pool counts its calls in flight and waiting, and the time calls waited for a thread.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import sniffio
+import trio
+
+
+class _Call:
+    __slots__ = ("started", "abandoned")
+
+    def __init__(self):
+        self.started = False
+        self.abandoned = False
+
+
+class ClientPool:
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._limiter = None
+        self._executor = None
+
+        self.calls = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        """Result of `fn(*args, **kwargs)`, run on a thread of this pool."""
+        enqueued_at = time.monotonic()
+        state = _Call()
+        with self._lock:
+            self.waiting += 1
+
+        def call():
+            with self._lock:
+                if state.abandoned:
+                    return None
+                state.started = True
+                wait = time.monotonic() - enqueued_at
+                self.waiting -= 1
+                self.in_flight += 1
+                self.calls += 1
+                self.wait_sum += wait
+                self.wait_max = max(self.wait_max, wait)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+        try:
+            if sniffio.current_async_library() == "trio":
+                return await trio.to_thread.run_sync(call, limiter=self._trio_limiter())
+            return await asyncio.get_running_loop().run_in_executor(self._thread_executor(), call)
+        finally:
+            # A caller cancelled before its call started leaves the queue.
+            with self._lock:
+                if not state.started:
+                    state.abandoned = True
+                    self.waiting -= 1
+
+    def _trio_limiter(self) -> trio.CapacityLimiter:
+        with self._lock:
+            if self._limiter is None:
+                self._limiter = trio.CapacityLimiter(self.size)
+            return self._limiter
+
+    def _thread_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix=f"{self.name}_pool")
+            return self._executor
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "calls": self.calls,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "wait_avg": round(self.wait_sum / self.calls, 4) if self.calls else 0.0,
+                "wait_max": round(self.wait_max, 4),
+            }
+
+
+class AsyncClient:
+    """Async variants of the methods of `client`, run through `pool`, e.g. `await REDIS_CONN.aio.get(k)`."""
+
+    def __init__(self, client, pool: ClientPool):
+        self._client = client
+        self.pool = pool
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+        if not callable(method):
+            raise AttributeError(f"{type(self._client).__name__}.{name} is not a method")
+
+        async def call(*args, **kwargs):
+            return await self.pool.run(method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+_POOLS: dict[str, ClientPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_client_pool(name: str, size: int) -> ClientPool:
+    """The pool shared by all clients of this process named `name`."""
+    with _POOLS_LOCK:
+        if name not in _POOLS:
+            _POOLS[name] = ClientPool(name, size)
+        return _POOLS[name]
+
+
+def client_pool_stats() -> dict:
+    return {name: pool.stats() for name, pool in _POOLS.items()}
@@ -14,12 +14,22 @@
 #  limitations under the License.
 #
 
+import os
 from abc import ABC, abstractmethod
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import cached_property
 import numpy as np
 
+from common.float_utils import get_float
+from rag.utils.client_pool import AsyncClient, get_client_pool
+
 DEFAULT_MATCH_VECTOR_TOPN = 10
 DEFAULT_MATCH_SPARSE_TOPN = 10
+SEARCH_MANY_CONCURRENCY = 8
+# Connections of the doc store client, and threads running its async calls.
+DOC_STORE_POOL_SIZE = int(os.environ.get("DOC_STORE_POOL_SIZE", "32"))
 VEC = list | np.ndarray
 
 
@@ -141,11 +151,75 @@ class OrderByExpr(ABC):
     def fields(self):
         return self.fields
 
+class ChunkFields(Mapping):
+    """
+    Fields of the chunks of a search result, stored by column.
+
+    Reads as the dict of chunk id to field dict returned by `get_fields`; the dict of a chunk
+    is built on first access and omits missing fields. `vectors` stacks a vector column into
+    a float32 matrix without going through the dicts.
+    """
+
+    def __init__(self, ids: list[str], columns: dict[str, list]):
+        self.ids = ids
+        self.columns = columns
+        self._index = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        self._rows = {}
+        self._vectors = {}
+
+    def __getitem__(self, chunk_id):
+        row = self._rows.get(chunk_id)
+        if row is None:
+            i = self._index[chunk_id]
+            row = {n: col[i] for n, col in self.columns.items() if col[i] is not None}
+            self._rows[chunk_id] = row
+        return row
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def vectors(self, column: str, vector_size: int, ids: list[str] | None = None) -> np.ndarray:
+        """The (len(ids), vector_size) float32 matrix of `column`, zeros for chunks without a vector."""
+        if (column, vector_size) not in self._vectors:
+            values = self.columns.get(column) or [None] * len(self.ids)
+            try:
+                mat = np.asarray(values, dtype=np.float32).reshape(len(values), vector_size)
+            except (TypeError, ValueError):
+                # Missing vectors, or vectors stored as tab separated strings.
+                mat = np.zeros((len(values), vector_size), dtype=np.float32)
+                for i, v in enumerate(values):
+                    if v is None:
+                        continue
+                    if isinstance(v, str):
+                        v = [get_float(t) for t in v.split("\t")]
+                    mat[i] = v
+            self._vectors[(column, vector_size)] = mat
+        mat = self._vectors[(column, vector_size)]
+        if ids is None or ids == self.ids:
+            return mat
+        out = np.zeros((len(ids), vector_size), dtype=np.float32)
+        for i, chunk_id in enumerate(ids):
+            j = self._index.get(chunk_id)
+            if j is not None:
+                out[i] = mat[j]
+        return out
+
+
 class DocStoreConnection(ABC):
     """
     Database operations
     """
 
+    @cached_property
+    def aio(self) -> AsyncClient:
+        """
+        Async variants of the methods, e.g. `await settings.docStoreConn.aio.insert(rows, indexName, knowledgebaseId)`
+        """
+        return AsyncClient(self, get_client_pool("doc_store", DOC_STORE_POOL_SIZE))
+
     @abstractmethod
     def dbType(self) -> str:
         """
@@ -208,6 +282,16 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def search_many(self, searches: list[dict]) -> list:
+        """
+        Results of several `search` calls, given as dicts of their arguments.
+        Backends able to send them as one request override this; here they run concurrently.
+        """
+        if len(searches) <= 1:
+            return [self.search(**s) for s in searches]
+        with ThreadPoolExecutor(max_workers=min(len(searches), SEARCH_MANY_CONCURRENCY)) as pool:
+            return list(pool.map(lambda s: self.search(**s), searches))
+
     @abstractmethod
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         """
@@ -215,6 +299,15 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def get_many(self, chunkIds: list[str], indexName: str, knowledgebaseIds: list[str]) -> list[dict | None]:
+        """
+        Chunks of the given ids, None for those not found, fetched concurrently
+        """
+        if len(chunkIds) <= 1:
+            return [self.get(chunk_id, indexName, knowledgebaseIds) for chunk_id in chunkIds]
+        with ThreadPoolExecutor(max_workers=min(len(chunkIds), SEARCH_MANY_CONCURRENCY)) as pool:
+            return list(pool.map(lambda chunk_id: self.get(chunk_id, indexName, knowledgebaseIds), chunkIds))
+
     @abstractmethod
     def insert(self, rows: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         """
@@ -249,7 +342,7 @@ class DocStoreConnection(ABC):
         raise NotImplementedError("Not implemented")
 
     @abstractmethod
-    def get_fields(self, res, fields: list[str]) -> dict[str, dict]:
+    def get_fields(self, res, fields: list[str]) -> dict[str, dict] | ChunkFields:
         raise NotImplementedError("Not implemented")
 
     @abstractmethod
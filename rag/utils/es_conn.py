@@ -27,9 +27,11 @@ from elastic_transport import ConnectionTimeout
 from common.decorator import singleton
 from common.file_utils import get_project_base_directory
 from common.misc_utils import convert_bytes
-from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
-    FusionExpr
+from rag.utils.doc_store_conn import DOC_STORE_POOL_SIZE, DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
+    FusionExpr, ChunkFields
 from rag.nlp import is_english, rag_tokenizer
+from rag.nlp.retrieval_cache import bumps_kb_generation
+from rag.utils import ndjson_bulk
 from common.float_utils import get_float
 from common import settings
 from common.constants import PAGERANK_FLD, TAG_FLD
@@ -76,6 +78,7 @@ class ESConnection(DocStoreConnection):
             basic_auth=(settings.ES["username"], settings.ES[
                 "password"]) if "username" in settings.ES and "password" in settings.ES else None,
             verify_certs= settings.ES.get("verify_certs", False),
+            connections_per_node=DOC_STORE_POOL_SIZE,
             timeout=600 )
         if self.es:
             self.info = self.es.info()
@@ -109,6 +112,7 @@ class ESConnection(DocStoreConnection):
         except Exception:
             logger.exception("ESConnection.createIndex error %s" % (indexName))
 
+    @bumps_kb_generation
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -139,7 +143,7 @@ class ESConnection(DocStoreConnection):
     CRUD operations
     """
 
-    def search(
+    def _search_body(
             self, selectFields: list[str],
             highlightFields: list[str],
             condition: dict,
@@ -151,9 +155,9 @@ class ESConnection(DocStoreConnection):
             knowledgebaseIds: list[str],
             aggFields: list[str] = [],
             rank_feature: dict | None = None
-    ):
+    ) -> tuple[list[str], dict]:
         """
-        Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl.html
+        Index names and body of the request of `search`.
         """
         if isinstance(indexNames, str):
             indexNames = indexNames.split(",")
@@ -245,7 +249,26 @@ class ESConnection(DocStoreConnection):
             s = s[offset:offset + limit]
         q = s.to_dict()
         logger.debug(f"ESConnection.search {str(indexNames)} query: " + json.dumps(q))
+        return indexNames, q
 
+    def search(
+            self, selectFields: list[str],
+            highlightFields: list[str],
+            condition: dict,
+            matchExprs: list[MatchExpr],
+            orderBy: OrderByExpr,
+            offset: int,
+            limit: int,
+            indexNames: str | list[str],
+            knowledgebaseIds: list[str],
+            aggFields: list[str] = [],
+            rank_feature: dict | None = None
+    ):
+        """
+        Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl.html
+        """
+        indexNames, q = self._search_body(selectFields, highlightFields, condition, matchExprs, orderBy, offset, limit,
+                                          indexNames, knowledgebaseIds, aggFields, rank_feature)
         for i in range(ATTEMPT_TIME):
             try:
                 #print(json.dumps(q, ensure_ascii=False))
@@ -254,7 +277,7 @@ class ESConnection(DocStoreConnection):
                                      timeout="600s",
                                      # search_type="dfs_query_then_fetch",
                                      track_total_hits=True,
-                                     _source=True)
+                                     _source=list(dict.fromkeys(selectFields)) if selectFields else True)
                 if str(res.get("timed_out", "")).lower() == "true":
                     raise Exception("Es Timeout.")
                 logger.debug(f"ESConnection.search {str(indexNames)} res: " + str(res))
@@ -270,6 +293,44 @@ class ESConnection(DocStoreConnection):
         logger.error(f"ESConnection.search timeout for {ATTEMPT_TIME} times!")
         raise Exception("ESConnection.search timeout.")
 
+    def search_many(self, searches: list[dict]) -> list:
+        """
+        Results of several `search` calls, given as dicts of their arguments, sent as one multi search request.
+        Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/search-multi-search.html
+        """
+        if len(searches) <= 1:
+            return [self.search(**s) for s in searches]
+        operations = []
+        for s in searches:
+            indexNames, q = self._search_body(**s)
+            selectFields = s["selectFields"]
+            operations.append({"index": indexNames})
+            operations.append({**q, "timeout": "600s", "track_total_hits": True,
+                               "_source": list(dict.fromkeys(selectFields)) if selectFields else True})
+        logger.debug(f"ESConnection.search_many {len(searches)} searches")
+
+        for i in range(ATTEMPT_TIME):
+            try:
+                responses = self.es.msearch(searches=operations)["responses"]
+                break
+            except ConnectionTimeout:
+                logger.exception("ES request timeout")
+                self._connect()
+                continue
+            except Exception as e:
+                logger.exception(f"ESConnection.search_many {len(searches)} searches: " + str(e))
+                raise e
+        else:
+            logger.error(f"ESConnection.search_many timeout for {ATTEMPT_TIME} times!")
+            raise Exception("ESConnection.search_many timeout.")
+
+        # A search which failed or timed out is sent again on its own: it fails alone, as with `search`.
+        for k, r in enumerate(responses):
+            if "error" in r or str(r.get("timed_out", "")).lower() == "true":
+                logger.warning(f"ESConnection.search_many search {k} failed, searching again: {r.get('error', 'timed out')}")
+                responses[k] = self.search(**searches[k])
+        return responses
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
             try:
@@ -288,18 +349,10 @@ class ESConnection(DocStoreConnection):
         logger.error(f"ESConnection.get timeout for {ATTEMPT_TIME} times!")
         raise Exception("ESConnection.get timeout.")
 
+    @bumps_kb_generation
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-bulk.html
-        operations = []
-        for d in documents:
-            assert "_id" not in d
-            assert "id" in d
-            d_copy = copy.deepcopy(d)
-            d_copy["kb_id"] = knowledgebaseId
-            meta_id = d_copy.pop("id", "")
-            operations.append(
-                {"index": {"_index": indexName, "_id": meta_id}})
-            operations.append(d_copy)
+        operations = ndjson_bulk.index_body(documents, indexName, {"kb_id": knowledgebaseId})
 
         res = []
         for _ in range(ATTEMPT_TIME):
@@ -326,6 +379,7 @@ class ESConnection(DocStoreConnection):
 
         return res
 
+    @bumps_kb_generation
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -418,6 +472,7 @@ class ESConnection(DocStoreConnection):
                 break
         return False
 
+    @bumps_kb_generation
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
@@ -479,35 +534,23 @@ class ESConnection(DocStoreConnection):
     def get_chunk_ids(self, res):
         return [d["_id"] for d in res["hits"]["hits"]]
 
-    def __getSource(self, res):
-        rr = []
-        for d in res["hits"]["hits"]:
-            d["_source"]["id"] = d["_id"]
-            d["_source"]["_score"] = d["_score"]
-            rr.append(d["_source"])
-        return rr
-
-    def get_fields(self, res, fields: list[str]) -> dict[str, dict]:
-        res_fields = {}
+    def get_fields(self, res, fields: list[str]) -> ChunkFields | dict:
         if not fields:
             return {}
-        for d in self.__getSource(res):
-            m = {n: d.get(n) for n in fields if d.get(n) is not None}
-            for n, v in m.items():
-                if isinstance(v, list):
-                    m[n] = v
-                    continue
-                if n == "available_int" and isinstance(v, (int, float)):
-                    m[n] = v
-                    continue
-                if not isinstance(v, str):
-                    m[n] = str(m[n])
-                # if n.find("tks") > 0:
-                #     m[n] = remove_redundant_spaces(m[n])
-
-            if m:
-                res_fields[d["id"]] = m
-        return res_fields
+        fields = list(dict.fromkeys(fields))
+        ids = []
+        columns = {n: [] for n in fields}
+        for d in res["hits"]["hits"]:
+            src = d.get("_source", {})
+            values = [d["_id"] if n == "id" else d["_score"] if n == "_score" else src.get(n) for n in fields]
+            if all(v is None for v in values):
+                continue
+            ids.append(d["_id"])
+            for n, v in zip(fields, values):
+                if v is not None and not isinstance(v, (list, str)) and not (n == "available_int" and isinstance(v, (int, float))):
+                    v = str(v)
+                columns[n].append(v)
+        return ChunkFields(ids, columns)
 
     def get_highlight(self, res, keywords: list[str], fieldnm: str):
         ans = {}
@@ -520,7 +563,10 @@ class ESConnection(DocStoreConnection):
                 ans[d["_id"]] = txt
                 continue
 
-            txt = d["_source"][fieldnm]
+            txt = d.get("_source", {}).get(fieldnm)
+            if not isinstance(txt, str):
+                ans[d["_id"]] = "...".join([a for a in list(hlts.items())[0][1]])
+                continue
             txt = re.sub(r"[\r\n]", " ", txt, flags=re.IGNORECASE | re.MULTILINE)
             txts = []
             for t in re.split(r"[.?!;\n]", txt):
@@ -19,7 +19,6 @@ import os
 import re
 import json
 import time
-import copy
 import infinity
 from infinity.common import ConflictType, InfinityException, SortType
 from infinity.index import IndexInfo, IndexType
@@ -29,9 +28,11 @@ from common.decorator import singleton
 import pandas as pd
 from common.file_utils import get_project_base_directory
 from rag.nlp import is_english
+from rag.nlp.retrieval_cache import bumps_kb_generation
 from common.constants import PAGERANK_FLD, TAG_FLD
 from common import settings
 from rag.utils.doc_store_conn import (
+    DOC_STORE_POOL_SIZE,
     DocStoreConnection,
     MatchExpr,
     MatchTextExpr,
@@ -138,7 +139,7 @@ class InfinityConnection(DocStoreConnection):
         logger.info(f"Use Infinity {infinity_uri} as the doc engine.")
         for _ in range(24):
             try:
-                connPool = ConnectionPool(infinity_uri, max_size=32)
+                connPool = ConnectionPool(infinity_uri, max_size=DOC_STORE_POOL_SIZE)
                 inf_conn = connPool.get_conn()
                 res = inf_conn.show_current_node()
                 if res.error_code == ErrorCode.OK and res.server_status in ["started", "alive"]:
@@ -253,6 +254,7 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         logger.info(f"INFINITY created table {table_name}, vector size {vectorSize}")
 
+    @bumps_kb_generation
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         table_name = f"{indexName}_{knowledgebaseId}"
         inf_conn = self.connPool.get_conn()
@@ -473,6 +475,7 @@ class InfinityConnection(DocStoreConnection):
         res_fields = self.get_fields(res, res.columns.tolist())
         return res_fields.get(chunkId, None)
 
+    @bumps_kb_generation
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
@@ -504,7 +507,8 @@ class InfinityConnection(DocStoreConnection):
                 continue
             embedding_clmns.append((n, int(r.group(1))))
 
-        docs = copy.deepcopy(documents)
+        # Fields are replaced, never modified in place, so copying the dicts is enough to leave the callers' chunks untouched.
+        docs = [dict(d) for d in documents]
         for d in docs:
             assert "_id" not in d
             assert "id" in d
@@ -545,6 +549,7 @@ class InfinityConnection(DocStoreConnection):
         logger.debug(f"INFINITY inserted into {table_name} {str_ids}.")
         return []
 
+    @bumps_kb_generation
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         # if 'position_int' in newValue:
         #     logger.info(f"update position_int: {newValue['position_int']}")
@@ -620,6 +625,7 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         return True
 
+    @bumps_kb_generation
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
@@ -0,0 +1,90 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+NDJSON bodies of Elasticsearch/OpenSearch bulk index requests.
+
+Documents are encoded field by field into a single buffer, so the chunk dicts handed to
+`insert` are neither copied nor modified: `id` goes to the action line, and fields to
+override, e.g. `kb_id`, are written in place of the document's own. Fields are encoded by
+orjson when it is installed, NumPy vectors straight from their buffers, and by the json
+module otherwise.
+"""
+import datetime
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, (datetime.date, datetime.datetime)):
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _json_dumps(o) -> bytes:
+    # Same output as the JSON serializer of the Elasticsearch client.
+    return json.dumps(o, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8", "surrogatepass")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(o) -> bytes:
+        try:
+            return orjson.dumps(o, default=_default, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # orjson rejects lone surrogates, which text extracted from some PDFs contains.
+            return _json_dumps(o)
+else:
+    dumps = _json_dumps
+
+
+def index_body(documents: list[dict], index_name: str, overrides: dict | None = None) -> bytes:
+    """Bulk body indexing each of `documents` under its `id`, with the fields of `overrides` set."""
+    overrides = overrides or {}
+    encoded_overrides = [dumps(k) + b":" + dumps(v) for k, v in overrides.items()]
+    buf = bytearray()
+    for d in documents:
+        assert "_id" not in d
+        assert "id" in d
+        buf += dumps({"index": {"_index": index_name, "_id": d["id"]}})
+        buf += b"\n{"
+        fields = 0
+        for k, v in d.items():
+            if k == "id" or k in overrides:
+                continue
+            if fields:
+                buf += b","
+            buf += dumps(k)
+            buf += b":"
+            buf += dumps(v)
+            fields += 1
+        for field in encoded_overrides:
+            if fields:
+                buf += b","
+            buf += field
+            fields += 1
+        buf += b"}\n"
+    return bytes(buf)
@@ -16,6 +16,7 @@
 
 import logging
 import json
+import os
 import uuid
 
 import valkey as redis
@@ -24,6 +25,12 @@ from common import settings
 from valkey.lock import Lock
 import trio
 
+from rag.utils.client_pool import AsyncClient, get_client_pool
+
+# Connections of each client; concurrent calls beyond that wait up to REDIS_POOL_TIMEOUT seconds for one.
+REDIS_POOL_SIZE = int(os.environ.get("REDIS_POOL_SIZE", "64"))
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", "20"))
+
 REDIS = {}
 try:
     REDIS = settings.decrypt_database_config(name="redis")
@@ -70,7 +77,10 @@ class RedisDB:
 
     def __init__(self):
         self.REDIS = None
+        self.REDIS_BIN = None
         self.config = REDIS
+        # Async variants of the methods, e.g. `await REDIS_CONN.aio.get(k)`.
+        self.aio = AsyncClient(self, get_client_pool("redis", REDIS_POOL_SIZE))
         self.__open__()
 
     def register_scripts(self) -> None:
@@ -90,7 +100,11 @@ class RedisDB:
             if password:
                 conn_params["password"] = password
 
-            self.REDIS = redis.StrictRedis(**conn_params)
+            self.REDIS = redis.StrictRedis(connection_pool=redis.BlockingConnectionPool(
+                max_connections=REDIS_POOL_SIZE, timeout=REDIS_POOL_TIMEOUT, **conn_params))
+            # Same server, but values are returned as bytes, e.g. for binary embedding blobs.
+            self.REDIS_BIN = redis.StrictRedis(connection_pool=redis.BlockingConnectionPool(
+                max_connections=REDIS_POOL_SIZE, timeout=REDIS_POOL_TIMEOUT, **{**conn_params, "decode_responses": False}))
 
             self.register_scripts()
         except Exception as e:
@@ -141,6 +155,42 @@ class RedisDB:
             logging.warning("RedisDB.get " + str(k) + " got exception: " + str(e))
             self.__open__()
 
+    def get_bytes(self, k):
+        if not self.REDIS_BIN:
+            return None
+        try:
+            return self.REDIS_BIN.get(k)
+        except Exception as e:
+            logging.warning("RedisDB.get_bytes " + str(k) + " got exception: " + str(e))
+            self.__open__()
+
+    def mget(self, keys: list[str], binary=False) -> list:
+        """Get many keys in one round-trip. Missing keys, or all keys on error, are None."""
+        client = self.REDIS_BIN if binary else self.REDIS
+        if not client or not keys:
+            return [None] * len(keys)
+        try:
+            return client.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+        return [None] * len(keys)
+
+    def set_many(self, mapping: dict, exp=3600):
+        """Set many keys with the same expiry in one pipelined round-trip."""
+        if not mapping:
+            return True
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.set_many " + str(len(mapping)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
     def set_obj(self, k, obj, exp=3600):
         try:
             self.REDIS.set(k, json.dumps(obj, ensure_ascii=False), exp)
@@ -159,18 +209,22 @@ class RedisDB:
             self.__open__()
         return False
 
-    def sadd(self, key: str, member: str):
+    def sadd(self, key: str, *members: str):
+        if not members:
+            return True
         try:
-            self.REDIS.sadd(key, member)
+            self.REDIS.sadd(key, *members)
             return True
         except Exception as e:
             logging.warning("RedisDB.sadd " + str(key) + " got exception: " + str(e))
             self.__open__()
         return False
 
-    def srem(self, key: str, member: str):
+    def srem(self, key: str, *members: str):
+        if not members:
+            return True
         try:
-            self.REDIS.srem(key, member)
+            self.REDIS.srem(key, *members)
             return True
         except Exception as e:
             logging.warning("RedisDB.srem " + str(key) + " got exception: " + str(e))
@@ -188,6 +242,54 @@ class RedisDB:
             self.__open__()
         return None
 
+    def smismember(self, key: str, members: list[str]) -> list[bool] | None:
+        """Whether each of `members` is in the set, None on error."""
+        try:
+            return [bool(m) for m in self.REDIS.smismember(key, members)]
+        except Exception as e:
+            logging.warning("RedisDB.smismember " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
+    def expire(self, key: str, exp: int) -> bool:
+        try:
+            self.REDIS.expire(key, exp)
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.expire " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def spop(self, key: str, count: int) -> list:
+        """Remove and return up to `count` random members of the set, none on error."""
+        try:
+            return self.REDIS.spop(key, count) or []
+        except Exception as e:
+            logging.warning("RedisDB.spop " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return []
+
+    def lpush_capped(self, key: str, value: str, max_len: int) -> bool:
+        """Push `value` to the head of the list, dropping the elements beyond the first `max_len`."""
+        try:
+            pipe = self.REDIS.pipeline()
+            pipe.lpush(key, value)
+            pipe.ltrim(key, 0, max_len - 1)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.lpush_capped " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def lrange(self, key: str, start: int, end: int) -> list:
+        try:
+            return self.REDIS.lrange(key, start, end) or []
+        except Exception as e:
+            logging.warning("RedisDB.lrange " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return []
+
     def zadd(self, key: str, member: str, score: float):
         try:
             self.REDIS.zadd(key, {member: score})
@@ -0,0 +1,154 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Splitting of PDFs into parsing tasks of balanced estimated cost.
+
+A page without a text layer is OCRed, which costs far more than a page with one, and so do the
+images on a page. With TASK_SPLIT_BY_COST, `queue_tasks` cuts the pages of a PDF into no more tasks
+than ranges of `task_page_size` pages, but so that the costliest task, by the estimated costs of its
+pages, costs the least, and no task spans more than MAX_PAGES_FACTOR times `task_page_size` pages.
+The features of the pages are read from their resources, without parsing or rendering them
+(`PdfParser.page_features`), and cached by document and stored file, so re-parsing does not read
+the file again.
+
+Each queued task carries its estimate, which the task executor records along with the actual
+duration of the task in a capped Redis list. The cost of each kind of page is fitted to these by
+
+    python -m rag.utils.task_cost [--parser_id naive]
+"""
+import argparse
+import json
+import logging
+import math
+import os
+
+import numpy as np
+import xxhash
+
+from deepdoc.parser import PdfParser
+from rag.utils.redis_conn import REDIS_CONN
+
+TASK_SPLIT_BY_COST = int(os.environ.get("TASK_SPLIT_BY_COST", "0"))
+# Estimated seconds of parsing a page with a text layer, a page without one, and an image of a page.
+TEXT_PAGE_COST = float(os.environ.get("TASK_COST_TEXT_PAGE", "0.2"))
+SCANNED_PAGE_COST = float(os.environ.get("TASK_COST_SCANNED_PAGE", "10"))
+IMAGE_COST = float(os.environ.get("TASK_COST_IMAGE", "0.5"))
+MAX_PAGES_FACTOR = 4
+# Images counted per page, beyond which a page is no slower to parse.
+MAX_PAGE_IMAGES = 20
+PAGE_FEATURES_KEY = "pdf_page_features:{}:{}"
+PAGE_FEATURES_TTL = 7 * 24 * 3600
+TASK_COST_SAMPLES_KEY = "task_cost_samples"
+TASK_COST_SAMPLES = 10000
+
+
+def pdf_page_features(doc: dict, bucket: str, name: str, read_binary) -> list[tuple[bool, int]] | None:
+    """`PdfParser.page_features` of the PDF of a document stored as `name` in `bucket`, cached;
+    `read_binary()` reads the file."""
+    # Another file stored for the document, or the same name with another size, misses the cache.
+    fingerprint = xxhash.xxh64(f"{bucket}/{name}/{doc.get('size')}".encode("utf-8", "surrogatepass")).hexdigest()
+    key = PAGE_FEATURES_KEY.format(doc["id"], fingerprint)
+    cached = REDIS_CONN.get(key)
+    if cached:
+        try:
+            return [(bool(text), int(images)) for text, images in json.loads(cached)]
+        except Exception:
+            logging.warning(f"pdf_page_features({doc['id']}) got an invalid cache entry")
+    features = PdfParser.page_features(doc["name"], read_binary())
+    if features is not None:
+        REDIS_CONN.set_obj(key, features, PAGE_FEATURES_TTL)
+    return features
+
+
+def page_cost(has_text: bool, images: int) -> float:
+    return (TEXT_PAGE_COST if has_text else SCANNED_PAGE_COST) + IMAGE_COST * min(images, MAX_PAGE_IMAGES)
+
+
+def cost_estimate(features: list[tuple[bool, int]], from_page: int, to_page: int) -> dict:
+    pages = features[from_page:to_page]
+    return {
+        "text_pages": sum(1 for has_text, _ in pages if has_text),
+        "scanned_pages": sum(1 for has_text, _ in pages if not has_text),
+        "images": sum(min(images, MAX_PAGE_IMAGES) for _, images in pages),
+        "estimated_duration": round(sum(page_cost(*f) for f in pages), 3),
+    }
+
+
+def split_by_cost(features: list[tuple[bool, int]], from_page: int, to_page: int, page_size: int) -> list[tuple[int, int]]:
+    """Page ranges covering pages [from_page, to_page), no more than ranges of `page_size` pages,
+    with the least estimated cost of the costliest one."""
+    n = math.ceil((to_page - from_page) / page_size) if to_page > from_page else 0
+    if n <= 1:
+        return [(from_page, to_page)] if n else []
+    costs = [page_cost(*f) for f in features[from_page:to_page]]
+    cum = np.concatenate([[0.], np.cumsum(costs)])
+    max_pages = page_size * MAX_PAGES_FACTOR
+
+    def pack(limit):
+        # Ranges taking as many pages as fit within `limit`.
+        bounds = [0]
+        while bounds[-1] < len(costs):
+            i = bounds[-1]
+            j = int(np.searchsorted(cum, cum[i] + limit, side="right")) - 1
+            bounds.append(max(i + 1, min(j, i + max_pages, len(costs))))
+        return bounds
+
+    # The least cost of the costliest of at most n ranges, by bisection. Ranges are packed greedily,
+    # so pages of equal costs are cut as ranges of `page_size` pages are.
+    lo, hi = max(costs), float(cum[-1])
+    for _ in range(64):
+        if hi - lo <= hi * 1e-9:
+            break
+        mid = (lo + hi) / 2
+        if len(pack(mid)) - 1 <= n:
+            hi = mid
+        else:
+            lo = mid
+    bounds = pack(hi)
+    return [(from_page + s, from_page + e) for s, e in zip(bounds, bounds[1:])]
+
+
+def record_task_cost(task: dict, duration: float):
+    """Record the estimated and actual durations of a task queued with a cost estimate."""
+    estimate = task.get("cost_estimate")
+    if not estimate:
+        return
+    sample = {**estimate, "parser_id": task.get("parser_id", ""), "duration": round(duration, 3)}
+    REDIS_CONN.lpush_capped(TASK_COST_SAMPLES_KEY, json.dumps(sample), TASK_COST_SAMPLES)
+    logging.info(f"Task {task['id']} estimated {estimate['estimated_duration']:.2f}s, took {duration:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the costs of TASK_SPLIT_BY_COST to the recorded task durations")
+    parser.add_argument("--parser_id", default="", help="only fit the tasks of this chunk method")
+    args = parser.parse_args()
+
+    samples = [json.loads(s) for s in REDIS_CONN.lrange(TASK_COST_SAMPLES_KEY, 0, -1)]
+    samples = [s for s in samples if not args.parser_id or s["parser_id"] == args.parser_id]
+    if len(samples) < 4:
+        raise SystemExit(f"{len(samples)} tasks recorded, too few to fit")
+    # The constant term is the time every task takes whatever its pages, which doesn't weigh in the split.
+    x = np.array([[s["text_pages"], s["scanned_pages"], s["images"], 1.] for s in samples])
+    y = np.array([s["duration"] for s in samples])
+    estimated = np.array([s["estimated_duration"] for s in samples])
+    coef, *_ = np.linalg.lstsq(x, y, rcond=None)
+    fitted = x @ coef
+
+    print(f"tasks={len(samples)} duration: mean={y.mean():.2f}s max={y.max():.2f}s")
+    print(f"current: TASK_COST_TEXT_PAGE={TEXT_PAGE_COST} TASK_COST_SCANNED_PAGE={SCANNED_PAGE_COST} "
+          f"TASK_COST_IMAGE={IMAGE_COST}, mean error {np.abs(estimated - y).mean():.2f}s")
+    print(f"fitted:  TASK_COST_TEXT_PAGE={coef[0]:.3f} TASK_COST_SCANNED_PAGE={coef[1]:.3f} "
+          f"TASK_COST_IMAGE={coef[2]:.3f} (+{coef[3]:.2f}s per task), mean error {np.abs(fitted - y).mean():.2f}s")
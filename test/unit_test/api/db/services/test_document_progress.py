@@ -0,0 +1,355 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from peewee import SqliteDatabase
+
+from api.db import PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES, FileType
+from api.db import db_models
+from api.db.db_models import Document, Task
+from api.db.services import document_service
+from api.db.services.document_service import (DOC_PROGRESS_CHANGED_KEY, DOC_PROGRESS_QUEUED_KEY, DocumentService,
+                                              mark_doc_progress_changed)
+from common.constants import StatusEnum, TaskStatus
+
+QUEUE_LENGTH = 7
+MESSAGES = ["", "", "Page(1~12): OCR started", "Page(1~12): Done", "created task graphrag", "created task raptor",
+            "Task has been received."]
+
+
+def legacy_info(doc, tsks, queue_length):
+    """The fields DocumentService._sync_progress wrote for a document, before the aggregation was batched."""
+    msg = []
+    prg = 0
+    finished = True
+    bad = 0
+    status = doc.run
+    doc_progress = doc.progress if doc and doc.progress else 0.0
+    special_task_running = False
+    priority = 0
+    for t in tsks:
+        task_type = (t.task_type or "").lower()
+        if task_type in PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES:
+            special_task_running = True
+        if 0 <= t.progress < 1:
+            finished = False
+        if t.progress == -1:
+            bad += 1
+        prg += t.progress if t.progress >= 0 else 0
+        if t.progress_msg.strip():
+            msg.append(t.progress_msg)
+        priority = max(priority, t.priority)
+    prg /= len(tsks)
+    if finished and bad:
+        prg = -1
+        status = TaskStatus.FAIL.value
+    elif finished:
+        prg = 1
+        status = TaskStatus.DONE.value
+    freeze_progress = special_task_running and doc_progress >= 1 and not finished
+    msg = "\n".join(sorted(msg))
+    info = {"process_duration": datetime.timestamp(datetime.now()) - doc.process_begin_at.timestamp(), "run": status}
+    if prg != 0 and not freeze_progress:
+        info["progress"] = prg
+    if msg:
+        info["progress_msg"] = msg
+        if msg.endswith("created task graphrag") or msg.endswith("created task raptor") or msg.endswith("created task mindmap"):
+            info["progress_msg"] += "\n%d tasks are ahead in the queue..." % queue_length(priority)
+    else:
+        info["progress_msg"] = "%d tasks are ahead in the queue..." % queue_length(priority)
+    return info
+
+
+def random_tasks(rnd):
+    return [SimpleNamespace(task_type=rnd.choice(["", "", "RAPTOR", "graphrag", "mindmap", "dataflow"]),
+                            progress=rnd.choice([-1, 0, 0, 0.1, 0.5, 1, 1, 1]),
+                            progress_msg=rnd.choice(MESSAGES), priority=rnd.choice([0, 0, 1]))
+            for _ in range(rnd.randint(1, 5))]
+
+
+def random_doc(rnd):
+    return SimpleNamespace(run=rnd.choice([TaskStatus.RUNNING.value, TaskStatus.DONE.value]),
+                           progress=rnd.choice([0, 0.3, 1, -1]), progress_msg="",
+                           process_begin_at=datetime.now() - timedelta(seconds=rnd.randint(0, 1000)))
+
+
+def queue_length(priority):
+    return QUEUE_LENGTH + priority
+
+
+def without_duration(info):
+    return {k: v for k, v in info.items() if k != "process_duration"}
+
+
+class TestAggregateProgress:
+
+    @pytest.mark.parametrize("seed", range(200))
+    def test_same_as_legacy(self, seed):
+        """The fields of a document are those the former per-document aggregation wrote"""
+        rnd = random.Random(seed)
+        doc, tsks = random_doc(rnd), random_tasks(rnd)
+        info = DocumentService._aggregate_progress(doc, tsks, queue_length)
+        expected = legacy_info(doc, tsks, queue_length)
+        queued = info.pop("queued")
+        assert without_duration(info) == without_duration(expected)
+        assert abs(info["process_duration"] - expected["process_duration"]) < 5
+        assert queued == info["progress_msg"].endswith("tasks are ahead in the queue...")
+
+    def test_no_tasks(self):
+        """A document without tasks is left as it is"""
+        assert DocumentService._aggregate_progress(random_doc(random.Random(0)), [], queue_length) is None
+
+    def test_finished_with_failures(self):
+        """Finished tasks of which one failed fail the document"""
+        doc = random_doc(random.Random(0))
+        tsks = [SimpleNamespace(task_type="", progress=p, progress_msg="", priority=0) for p in [1, -1, 1]]
+        info = DocumentService._aggregate_progress(doc, tsks, queue_length)
+        assert info["progress"] == -1 and info["run"] == TaskStatus.FAIL.value
+
+    def test_finished(self):
+        """Finished tasks finish the document"""
+        doc = random_doc(random.Random(0))
+        tsks = [SimpleNamespace(task_type="", progress=1, progress_msg="done", priority=0)] * 2
+        info = DocumentService._aggregate_progress(doc, tsks, queue_length)
+        assert info["progress"] == 1 and info["run"] == TaskStatus.DONE.value
+        assert info["progress_msg"] == "done\ndone" and not info["queued"]
+
+    @pytest.mark.parametrize("task_type", sorted(PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES))
+    def test_freeze(self, task_type):
+        """The progress of a parsed document is frozen while a GraphRAG, RAPTOR or mindmap task runs"""
+        doc = SimpleNamespace(run=TaskStatus.DONE.value, progress=1.0, progress_msg="",
+                              process_begin_at=datetime.now())
+        tsks = [SimpleNamespace(task_type="", progress=1, progress_msg="parsed", priority=0),
+                SimpleNamespace(task_type=task_type.upper(), progress=0.2, progress_msg="building", priority=0)]
+        info = DocumentService._aggregate_progress(doc, tsks, queue_length)
+        assert "progress" not in info and info["run"] == TaskStatus.DONE.value
+        doc.progress = 0.5
+        assert DocumentService._aggregate_progress(doc, tsks, queue_length)["progress"] == 0.6
+
+    def test_queued_messages(self):
+        """Tasks without a message, or a created GraphRAG or RAPTOR task, tell how many tasks are ahead in the queue"""
+        doc = random_doc(random.Random(0))
+        info = DocumentService._aggregate_progress(
+            doc, [SimpleNamespace(task_type="", progress=0, progress_msg=" ", priority=1)], queue_length)
+        assert info["progress_msg"] == "8 tasks are ahead in the queue..." and info["queued"]
+        info = DocumentService._aggregate_progress(
+            doc, [SimpleNamespace(task_type="raptor", progress=0, progress_msg="created task raptor", priority=0)],
+            queue_length)
+        assert info["progress_msg"] == "created task raptor\n7 tasks are ahead in the queue..." and info["queued"]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.sets = {}
+
+    def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(members)
+        return True
+
+    def srem(self, key, *members):
+        self.sets.setdefault(key, set()).difference_update(members)
+        return True
+
+    def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    def spop(self, key, count):
+        members = self.sets.get(key, set())
+        return [members.pop() for _ in range(min(count, len(members)))]
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(document_service, "REDIS_CONN", fake)
+    monkeypatch.setattr(document_service, "get_queue_length", queue_length)
+    monkeypatch.setattr(document_service, "_progress_synced_at", {"queued": float("-inf"), "all": float("-inf")})
+    return fake
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Documents and tasks in an in-memory SQLite database."""
+    database = SqliteDatabase(":memory:")
+    # The connection contexts of the service methods are left to the in-memory database.
+    monkeypatch.setattr(db_models.DB, "is_closed", lambda: False)
+    monkeypatch.setattr(db_models.DB, "close", lambda: None)
+    monkeypatch.setattr(document_service, "DB", database)
+    with database.bind_ctx([Document, Task]):
+        database.create_tables([Document, Task])
+        yield database
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Ids of the documents written by bulk_update."""
+    written = []
+    bulk_update = Document.bulk_update
+
+    def spy(cls, model_list, fields, batch_size=None):
+        written.extend(d.id for d in model_list)
+        return bulk_update(model_list, fields, batch_size=batch_size)
+
+    monkeypatch.setattr(Document, "bulk_update", classmethod(spy))
+    return written
+
+
+def add_doc(doc_id, run=TaskStatus.RUNNING.value, progress=0.0, progress_msg="", doc_type="pdf"):
+    Document.insert(id=doc_id, kb_id="kb", parser_id="naive", type=doc_type, created_by="user", suffix="pdf",
+                    name=f"{doc_id}.pdf", run=run, progress=progress, progress_msg=progress_msg,
+                    status=StatusEnum.VALID.value, process_begin_at=datetime.now() - timedelta(seconds=10)).execute()
+
+
+def add_task(doc_id, n, progress, progress_msg="", task_type="", priority=0):
+    Task.insert(id=f"{doc_id}_{n}", doc_id=doc_id, progress=progress, progress_msg=progress_msg, task_type=task_type,
+                priority=priority, create_time=n).execute()
+
+
+def stored(doc_id):
+    doc = Document.get_by_id(doc_id)
+    return doc.run, doc.progress, doc.progress_msg
+
+
+def expected_state(doc_id):
+    """The fields of a document after the former aggregation, from the database as it is."""
+    doc = Document.get_by_id(doc_id)
+    tsks = list(Task.select().where(Task.doc_id == doc_id).order_by(Task.create_time))
+    if not tsks:
+        return doc.run, doc.progress, doc.progress_msg
+    info = legacy_info(doc, tsks, queue_length)
+    return info["run"], info.get("progress", doc.progress), info["progress_msg"]
+
+
+class TestSyncProgress:
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_same_as_legacy(self, db, redis, seed):
+        """Every unfinished document gets the fields the former per-document loop wrote, others are left alone"""
+        rnd = random.Random(seed)
+        doc_ids = [f"doc{i}" for i in range(rnd.randint(1, 30))]
+        for doc_id in doc_ids:
+            add_doc(doc_id, run=rnd.choice([TaskStatus.RUNNING.value, TaskStatus.DONE.value, TaskStatus.CANCEL.value]),
+                    progress=rnd.choice([0.0, 0.3, 1.0, -1.0]),
+                    doc_type=FileType.VIRTUAL.value if rnd.random() < 0.1 else "pdf")
+            for n, t in enumerate(random_tasks(rnd) if rnd.random() < 0.9 else []):
+                add_task(doc_id, n, t.progress, t.progress_msg, t.task_type, t.priority)
+        unfinished = {d["id"] for d in DocumentService.get_unfinished_docs()}
+        expected = {doc_id: expected_state(doc_id) if doc_id in unfinished else stored(doc_id) for doc_id in doc_ids}
+
+        mark_doc_progress_changed(*rnd.sample(doc_ids, rnd.randint(0, len(doc_ids))))
+        DocumentService.update_progress()
+        assert {doc_id: stored(doc_id) for doc_id in doc_ids} == expected
+        assert not redis.sets[DOC_PROGRESS_CHANGED_KEY]
+
+    def test_only_changed_documents(self, db, redis, monkeypatch):
+        """Between full syncs, only the documents marked as changed are aggregated"""
+        monkeypatch.setattr(document_service, "DOC_PROGRESS_FULL_SYNC", 0)
+        for doc_id in ["a", "b"]:
+            add_doc(doc_id)
+            add_task(doc_id, 0, 0.5, "Page(1~12): OCR started")
+        mark_doc_progress_changed("a")
+        DocumentService.update_progress()
+        assert stored("a") == (TaskStatus.RUNNING.value, 0.5, "Page(1~12): OCR started")
+        assert stored("b") == (TaskStatus.RUNNING.value, 0.0, "")
+
+    def test_drains_changed_set(self, db, redis, monkeypatch):
+        """Changed documents are popped by batches until none is left"""
+        monkeypatch.setattr(document_service, "DOC_PROGRESS_FULL_SYNC", 0)
+        monkeypatch.setattr(document_service, "DOC_PROGRESS_BATCH_SIZE", 3)
+        doc_ids = [f"doc{i}" for i in range(10)]
+        for doc_id in doc_ids:
+            add_doc(doc_id)
+            add_task(doc_id, 0, 0.5, "running")
+        mark_doc_progress_changed(*doc_ids)
+        DocumentService.update_progress()
+        assert all(stored(doc_id)[1] == 0.5 for doc_id in doc_ids)
+        assert not redis.sets[DOC_PROGRESS_CHANGED_KEY]
+
+    def test_unchanged_documents_not_written(self, db, redis, writes, monkeypatch):
+        """A document whose aggregate did not change is not written again"""
+        monkeypatch.setattr(document_service, "DOC_PROGRESS_FULL_SYNC", 0)
+        add_doc("a")
+        add_task("a", 0, 0.5, "running")
+        add_doc("b")
+        add_task("b", 0, 0.2, "running")
+        mark_doc_progress_changed("a", "b")
+        DocumentService.update_progress()
+        assert sorted(writes) == ["a", "b"]
+
+        Task.update(progress=0.7).where(Task.doc_id == "b").execute()
+        mark_doc_progress_changed("a", "b")
+        DocumentService.update_progress()
+        assert sorted(writes) == ["a", "b", "b"]
+        assert stored("b")[1] == 0.7
+
+    def test_queued_documents(self, db, redis, monkeypatch):
+        """Documents waiting in the queue are refreshed until their tasks start"""
+        monkeypatch.setattr(document_service, "DOC_PROGRESS_FULL_SYNC", 0)
+        add_doc("a")
+        add_task("a", 0, 0.0, "")
+        mark_doc_progress_changed("a")
+        DocumentService.update_progress()
+        assert stored("a")[2] == "7 tasks are ahead in the queue..."
+        assert redis.sets[DOC_PROGRESS_QUEUED_KEY] == {"a"}
+
+        # Not marked as changed, but refreshed as a queued document.
+        monkeypatch.setattr(document_service, "get_queue_length", lambda priority: 3)
+        monkeypatch.setattr(document_service, "_progress_synced_at", {"queued": float("-inf"), "all": float("-inf")})
+        DocumentService.update_progress()
+        assert stored("a")[2] == "3 tasks are ahead in the queue..."
+
+        Task.update(progress=0.1, progress_msg="started").where(Task.doc_id == "a").execute()
+        mark_doc_progress_changed("a")
+        DocumentService.update_progress()
+        assert stored("a") == (TaskStatus.RUNNING.value, 0.1, "started")
+        assert redis.sets[DOC_PROGRESS_QUEUED_KEY] == set()
+
+    def test_canceled_document_not_revived(self, db, redis, monkeypatch):
+        """A canceled document whose tasks report progress again stays canceled"""
+        monkeypatch.setattr(document_service, "DOC_PROGRESS_FULL_SYNC", 0)
+        add_doc("a", run=TaskStatus.CANCEL.value, progress=1.0, progress_msg="canceled")
+        add_task("a", 0, 1.0, "done")
+        mark_doc_progress_changed("a")
+        DocumentService.update_progress()
+        assert stored("a") == (TaskStatus.CANCEL.value, 1.0, "canceled")
+
+    def test_failed_batch_marked_changed_again(self, db, redis, monkeypatch):
+        """The documents of a batch which failed are marked as changed again, the other batches are written"""
+        monkeypatch.setattr(document_service, "DOC_PROGRESS_FULL_SYNC", 0)
+        monkeypatch.setattr(document_service, "DOC_PROGRESS_BATCH_SIZE", 2)
+        doc_ids = ["a", "b", "c", "d"]
+        for doc_id in doc_ids:
+            add_doc(doc_id)
+            add_task(doc_id, 0, 0.5, "running")
+        sync_batch = DocumentService._sync_progress_batch.__func__
+
+        def failing(cls, batch, unfinished_only=False):
+            if "c" in batch:
+                raise ConnectionError("database is down")
+            return sync_batch(cls, batch, unfinished_only)
+
+        monkeypatch.setattr(DocumentService, "_sync_progress_batch", classmethod(failing))
+        DocumentService.update_progress_immediately([{"id": doc_id} for doc_id in doc_ids])
+        assert redis.sets[DOC_PROGRESS_CHANGED_KEY] == {"c", "d"}
+        assert [stored(doc_id)[1] for doc_id in doc_ids] == [0.5, 0.5, 0.0, 0.0]
+
+        monkeypatch.setattr(DocumentService, "_sync_progress_batch", classmethod(sync_batch))
+        DocumentService.update_progress()
+        assert [stored(doc_id)[1] for doc_id in doc_ids] == [0.5] * 4
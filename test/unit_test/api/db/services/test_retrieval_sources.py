@@ -0,0 +1,124 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+import time
+
+import pytest
+
+from api.db.services.dialog_service import run_retrieval_sources
+
+
+@pytest.fixture
+def release():
+    """Set at the end of a test, so that the sources still running finish."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def fast(result, delay=0.0):
+    def source():
+        time.sleep(delay)
+        return result
+    return source
+
+
+def slow(release, result="late"):
+    def source():
+        release.wait(10)
+        return result
+    return source
+
+
+def failing(delay=0.0):
+    def source():
+        time.sleep(delay)
+        raise ValueError("search engine is down")
+    return source
+
+
+class TestRunRetrievalSources:
+
+    def test_no_sources(self):
+        """No source, no result"""
+        time_costs = {}
+        assert run_retrieval_sources({}, time_costs) == {}
+        assert time_costs == {}
+
+    def test_results(self):
+        """Every source finished in time gives its result, and its time in ms"""
+        time_costs = {}
+        results = run_retrieval_sources({"Knowledge base": (fast({"chunks": [1]}, 0.05), 5),
+                                         "Web search": (fast({"chunks": [2]}), 5),
+                                         "Knowledge graph": (fast(None), 5)}, time_costs)
+        assert results == {"Knowledge base": {"chunks": [1]}, "Web search": {"chunks": [2]}, "Knowledge graph": None}
+        assert set(time_costs) == {"Knowledge base", "Web search", "Knowledge graph"}
+        assert 50 <= time_costs["Knowledge base"] < 5000
+
+    def test_concurrent(self):
+        """Sources run at the same time"""
+        st = time.monotonic()
+        results = run_retrieval_sources({f"source {i}": (fast(i, 0.3), 5) for i in range(4)}, {})
+        assert results == {f"source {i}": i for i in range(4)}
+        assert time.monotonic() - st < 1.0
+
+    def test_optional_timeout_skipped(self, release):
+        """A source which does not finish in time is left out, without waiting for it"""
+        time_costs = {}
+        st = time.monotonic()
+        results = run_retrieval_sources({"Knowledge base": (fast("chunks", 0.05), 5),
+                                         "Web search": (slow(release), 0.2)}, time_costs, required=("Knowledge base",))
+        assert time.monotonic() - st < 2
+        assert results == {"Knowledge base": "chunks"}
+        assert set(time_costs) == {"Knowledge base", "Web search"}
+        assert 200 <= time_costs["Web search"] < 2000
+
+    def test_required_timeout_raises(self, release):
+        """A required source which does not finish in time raises TimeoutError"""
+        time_costs = {}
+        st = time.monotonic()
+        with pytest.raises(TimeoutError, match="Knowledge base"):
+            run_retrieval_sources({"Knowledge base": (slow(release), 0.2), "Web search": (fast("web"), 5)},
+                                  time_costs, required=("Knowledge base",))
+        assert time.monotonic() - st < 2
+        assert 200 <= time_costs["Knowledge base"] < 2000
+
+    def test_timeouts_from_start(self, release):
+        """Timeouts count from the start of the call, not from the end of the sources waited for before"""
+        time_costs = {}
+        st = time.monotonic()
+        results = run_retrieval_sources({"Web search": (slow(release), 0.3), "Knowledge graph": (slow(release), 0.3),
+                                         "Knowledge base": (fast("chunks"), 5)}, time_costs)
+        assert time.monotonic() - st < 0.55
+        assert results == {"Knowledge base": "chunks"}
+        assert set(time_costs) == {"Web search", "Knowledge graph", "Knowledge base"}
+
+    def test_error_raised(self):
+        """The exception of a source is raised"""
+        time_costs = {}
+        with pytest.raises(ValueError, match="search engine is down"):
+            run_retrieval_sources({"Knowledge base": (fast("chunks"), 5), "Web search": (failing(0.05), 5)}, time_costs)
+        assert "Web search" in time_costs
+
+    def test_time_cost_of_slow_source_kept(self, release):
+        """A source finishing after its timeout keeps the time it was given up at"""
+        time_costs = {}
+        run_retrieval_sources({"Web search": (slow(release), 0.1)}, time_costs)
+        given_up = time_costs["Web search"]
+        release.set()
+        time.sleep(0.1)
+        assert time_costs["Web search"] == given_up
@@ -0,0 +1,95 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+from collections import Counter
+
+import pytest
+
+from api.db.services.task_service import inherit_prev_task_chunks
+
+
+def task(from_page, to_page, chunk_ids="", progress=0.0):
+    return {"from_page": from_page, "to_page": to_page, "chunk_ids": chunk_ids, "progress": progress}
+
+
+class TestInheritPrevTaskChunks:
+
+    def test_same_pages(self):
+        """The chunks of a previous task go to the new task of the same pages"""
+        prev_tasks = [task(0, 12, "a b"), task(12, 24, "c")]
+        tasks = [task(0, 12), task(12, 24)]
+        inherit_prev_task_chunks(tasks, prev_tasks)
+        assert [t["chunk_ids"] for t in tasks] == ["a b", "c"]
+        assert [t["chunk_ids"] for t in prev_tasks] == ["", ""]
+
+    def test_other_pages(self):
+        """Chunks of pages no new task covers the same way are left to delete"""
+        prev_tasks = [task(0, 12, "a"), task(12, 24, "b")]
+        tasks = [task(0, 24)]
+        inherit_prev_task_chunks(tasks, prev_tasks)
+        assert tasks[0]["chunk_ids"] == ""
+        assert [t["chunk_ids"] for t in prev_tasks] == ["a", "b"]
+
+    def test_chunk_of_several_previous_tasks(self):
+        """A chunk listed by two previous tasks is handed over to none"""
+        prev_tasks = [task(0, 12, "a shared"), task(12, 24, "b shared")]
+        tasks = [task(0, 12), task(12, 24)]
+        inherit_prev_task_chunks(tasks, prev_tasks)
+        assert [t["chunk_ids"] for t in tasks] == ["a", "b"]
+        assert [t["chunk_ids"] for t in prev_tasks] == ["shared", "shared"]
+
+    def test_chunk_reused_by_finished_task(self):
+        """A chunk a finished new task already reuses is not handed over to another"""
+        prev_tasks = [task(0, 12, "a reused")]
+        tasks = [task(12, 24, "reused", progress=1.0), task(0, 12)]
+        inherit_prev_task_chunks(tasks, prev_tasks)
+        assert tasks[0]["chunk_ids"] == "reused" and tasks[1]["chunk_ids"] == "a"
+        assert prev_tasks[0]["chunk_ids"] == "reused"
+
+    def test_finished_tasks_inherit_nothing(self):
+        """Tasks whose chunks were reused inherit no other chunks"""
+        prev_tasks = [task(0, 12, "a")]
+        tasks = [task(0, 12, "b", progress=1.0)]
+        inherit_prev_task_chunks(tasks, prev_tasks)
+        assert tasks[0]["chunk_ids"] == "b" and prev_tasks[0]["chunk_ids"] == "a"
+
+    @pytest.mark.parametrize("seed", range(50))
+    def test_one_owner(self, seed):
+        """Every previous chunk is either handed over to exactly one task or left to delete, never both"""
+        rnd = random.Random(seed)
+        ids = [f"c{i}" for i in range(30)]
+        ranges = [(p, p + 10) for p in range(0, 60, 10)]
+        prev_tasks = [task(*r, " ".join(rnd.sample(ids, rnd.randint(0, 8)))) for r in rnd.sample(ranges, rnd.randint(1, 6))]
+        tasks = []
+        for r in rnd.sample(ranges, rnd.randint(1, 6)):
+            if rnd.random() < 0.2:
+                tasks.append(task(*r, " ".join(rnd.sample(ids, rnd.randint(1, 5))), progress=1.0))
+            else:
+                tasks.append(task(*r))
+        before = Counter(i for t in prev_tasks for i in t["chunk_ids"].split())
+        reused = {i for t in tasks if t["progress"] >= 1.0 for i in t["chunk_ids"].split()}
+
+        inherit_prev_task_chunks(tasks, prev_tasks)
+        inherited = Counter(i for t in tasks if t["progress"] < 1.0 for i in t["chunk_ids"].split())
+        left = Counter(i for t in prev_tasks for i in t["chunk_ids"].split())
+        assert all(n == 1 for n in inherited.values())
+        assert not set(inherited) & set(left)
+        assert not set(inherited) & reused
+        assert set(inherited) | set(left) == set(before)
+        for chunk_id, n in before.items():
+            if n > 1 or chunk_id in reused:
+                assert left[chunk_id] == n
@@ -0,0 +1,106 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+
+import pytest
+
+from deepdoc.vision.recognizer import Recognizer, SpatialIndex
+
+
+def random_boxes(rnd, n, size=40, grid=True):
+    """Boxes on a small page, on a grid of integers if `grid` so that ties, touching and degenerate boxes are common."""
+    boxes = []
+    for _ in range(n):
+        if grid:
+            x0, y0 = rnd.randint(0, size), rnd.randint(0, size)
+            w, h = rnd.randint(0, size // 4), rnd.randint(0, size // 4)
+        else:
+            x0, y0 = rnd.uniform(0, size), rnd.uniform(0, size)
+            w, h = rnd.uniform(0, size / 4), rnd.uniform(0, size / 4)
+        box = {"x0": x0, "x1": x0 + w, "top": y0, "bottom": y0 + h}
+        if rnd.random() < 0.8:
+            box["layoutno"] = rnd.choice(["0", "1", "2"])
+        boxes.append(box)
+    return boxes
+
+
+CASES = [(seed, grid) for seed in range(20) for grid in (True, False)]
+
+
+class TestSpatialIndex:
+
+    @pytest.mark.parametrize("seed,grid", CASES)
+    @pytest.mark.parametrize("naive", [False, True])
+    def test_find_overlapped(self, seed, grid, naive):
+        """Same boxes as Recognizer.find_overlapped on boxes sorted by y"""
+        rnd = random.Random(seed)
+        boxes = sorted(random_boxes(rnd, rnd.randint(0, 60), grid=grid), key=lambda b: (b["top"], b["x0"]))
+        queries = random_boxes(rnd, 80, grid=grid)
+        expected = [Recognizer.find_overlapped(q, boxes, naive) for q in queries]
+        assert SpatialIndex(boxes).find_overlapped(queries, naive) == expected
+
+    @pytest.mark.parametrize("seed,grid", CASES)
+    @pytest.mark.parametrize("thr", [0.0, 0.3, 0.4])
+    def test_find_overlapped_with_threshold(self, seed, grid, thr):
+        """Same boxes as Recognizer.find_overlapped_with_threshold, ties going to the last box"""
+        rnd = random.Random(seed)
+        boxes = random_boxes(rnd, rnd.randint(0, 60), grid=grid)
+        queries = random_boxes(rnd, 80, grid=grid)
+        expected = [Recognizer.find_overlapped_with_threshold(q, boxes, thr) for q in queries]
+        assert SpatialIndex(boxes).find_overlapped_with_threshold(queries, thr) == expected
+
+    @pytest.mark.parametrize("seed,grid", CASES)
+    def test_find_horizontally_tightest_fit(self, seed, grid):
+        """Same boxes as Recognizer.find_horizontally_tightest_fit, by layout number"""
+        rnd = random.Random(seed)
+        boxes = random_boxes(rnd, rnd.randint(0, 60), grid=grid)
+        queries = random_boxes(rnd, 80, grid=grid)
+        expected = [Recognizer.find_horizontally_tightest_fit(q, boxes) for q in queries]
+        assert SpatialIndex(boxes).find_horizontally_tightest_fit(queries) == expected
+
+    @pytest.mark.parametrize("seed,grid", CASES)
+    def test_overlapped_area_sum(self, seed, grid):
+        """Same sum as adding up Recognizer.overlapped_area in order"""
+        rnd = random.Random(seed)
+        boxes = random_boxes(rnd, rnd.randint(0, 60), grid=grid)
+        index = SpatialIndex(boxes)
+        for layout in random_boxes(rnd, 20, grid=grid):
+            expected = 0
+            for b in boxes:
+                expected += Recognizer.overlapped_area(b, layout, False)
+            assert index.overlapped_area_sum(layout) == expected
+
+    def test_blocks(self, monkeypatch):
+        """Queries split into blocks give the same results"""
+        rnd = random.Random(0)
+        boxes = sorted(random_boxes(rnd, 50), key=lambda b: (b["top"], b["x0"]))
+        queries = random_boxes(rnd, 200)
+        index = SpatialIndex(boxes)
+        expected = (index.find_overlapped(queries), index.find_overlapped_with_threshold(queries),
+                    index.find_horizontally_tightest_fit(queries))
+        monkeypatch.setattr(SpatialIndex, "BLOCK_PAIRS", 128)
+        assert (index.find_overlapped(queries), index.find_overlapped_with_threshold(queries),
+                index.find_horizontally_tightest_fit(queries)) == expected
+
+    def test_empty(self):
+        """No boxes or no queries"""
+        box = {"x0": 0, "x1": 1, "top": 0, "bottom": 1}
+        assert SpatialIndex([]).find_overlapped([box]) == [None]
+        assert SpatialIndex([]).find_overlapped_with_threshold([box]) == [None]
+        assert SpatialIndex([]).find_horizontally_tightest_fit([box]) == [None]
+        assert SpatialIndex([]).overlapped_area_sum(box) == 0
+        assert SpatialIndex([box]).find_overlapped([]) == []
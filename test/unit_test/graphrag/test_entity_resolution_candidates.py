@@ -0,0 +1,92 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+
+import pytest
+
+from graphrag.entity_resolution import EntityResolution
+from graphrag.entity_resolution_benchmark import legacy_pairs, synthetic_entities
+from graphrag.entity_resolution_candidates import similar_pairs
+
+
+@pytest.fixture(scope="module")
+def er():
+    # is_similarity uses no state, so no LLM is needed.
+    return EntityResolution.__new__(EntityResolution)
+
+
+def random_names(rnd, n, alphabet, min_len=1, max_len=12):
+    """Names over a small alphabet, so that many pairs are similar, half of them variants of earlier ones."""
+    names = []
+    while len(names) < n:
+        if names and rnd.random() < 0.5:
+            chars = list(rnd.choice(names))
+            for _ in range(rnd.randint(1, 3)):
+                i = rnd.randrange(len(chars) + 1)
+                if rnd.random() < 0.5 and i < len(chars):
+                    chars[i] = rnd.choice(alphabet)
+                elif rnd.random() < 0.5 and i < len(chars) and len(chars) > 1:
+                    del chars[i]
+                else:
+                    chars.insert(i, rnd.choice(alphabet))
+            name = "".join(chars)
+        else:
+            name = "".join(rnd.choices(alphabet, k=rnd.randint(min_len, max_len)))
+        if name.strip():
+            names.append(name)
+    return sorted(set(names))
+
+
+ALPHABETS = [
+    "abcde ",
+    "abc12 -",
+    "中国人民银行1",
+    "ab中国1 é",
+]
+
+
+class TestSimilarPairs:
+
+    @pytest.mark.parametrize("seed", range(8))
+    @pytest.mark.parametrize("alphabet", ALPHABETS)
+    @pytest.mark.parametrize("new", [1.0, 0.3, 0.02])
+    def test_same_as_all_pairs(self, er, seed, alphabet, new):
+        """similar_pairs finds the pairs is_similarity accepts among all pairs, in the same order"""
+        rnd = random.Random(seed)
+        names = random_names(rnd, rnd.randint(1, 150), alphabet)
+        new_names = set(rnd.sample(names, max(1, round(len(names) * new))))
+        assert similar_pairs(names, new_names) == legacy_pairs(er, names, new_names)
+
+    @pytest.mark.parametrize("seed", range(3))
+    def test_long_names(self, er, seed):
+        """Names longer than the 64-bit masks of the bit-parallel edit distance"""
+        rnd = random.Random(seed)
+        names = random_names(rnd, 60, "abcdef ", min_len=40, max_len=140)
+        new_names = set(rnd.sample(names, len(names) // 2))
+        assert similar_pairs(names, new_names) == legacy_pairs(er, names, new_names)
+
+    @pytest.mark.parametrize("seed", range(3))
+    def test_synthetic_entities(self, er, seed):
+        """The entity names of the benchmark, English and Chinese"""
+        names = synthetic_entities(400, 0.3, seed)
+        new_names = set(random.Random(seed).sample(names, 100))
+        assert similar_pairs(names, new_names) == legacy_pairs(er, names, new_names)
+
+    def test_no_new_names(self):
+        """Only pairs with a new name are candidates"""
+        assert similar_pairs(["Apple Inc", "Apple Inc."], set()) == []
+        assert similar_pairs(["Apple Inc", "Apple Inc."], {"Apple Inc"}) == [("Apple Inc", "Apple Inc.")]
@@ -0,0 +1,238 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import random
+from types import SimpleNamespace
+
+import networkx as nx
+import pytest
+import trio
+from cachetools import LRUCache
+
+from graphrag import utils
+from graphrag.entity_resolution import EntityResolution
+from graphrag.utils import GRAPH_SNAPSHOT_PREFIX, GraphChange, _changed_sources, dump_graph, get_from_to, get_graph, \
+    load_graph_data
+
+
+def random_graph(rnd, n_sources=5):
+    """A graph whose nodes and edges come from a few sources, attributes as graph extraction sets them."""
+    sources = [f"doc{i}" for i in range(n_sources)]
+    graph = nx.Graph()
+    for i in range(rnd.randint(1, 30)):
+        graph.add_node(f"ENTITY {i}", entity_name=f"ENTITY {i}", entity_type=rnd.choice(["PERSON", "ORG"]),
+                       description=f"description of entity {i} 实体", rank=0,
+                       source_id=sorted(rnd.sample(sources, rnd.randint(1, 2))))
+    nodes = list(graph.nodes)
+    for _ in range(rnd.randint(0, 2 * len(nodes))):
+        a, b = rnd.sample(nodes, 2) if len(nodes) > 1 else (nodes[0], nodes[0])
+        if a != b:
+            graph.add_edge(a, b, weight=rnd.randint(1, 5), description=f"{a} relates to {b}", keywords=["k"],
+                           source_id=sorted(set(graph.nodes[a]["source_id"]) & set(graph.nodes[b]["source_id"])) or [sources[0]])
+    graph.graph["source_id"] = sources
+    return graph
+
+
+def same_graph(g1, g2):
+    return (dict(g1.nodes(data=True)) == dict(g2.nodes(data=True))
+            and {get_from_to(a, b): d for a, b, d in g1.edges(data=True)} == {get_from_to(a, b): d for a, b, d in g2.edges(data=True)}
+            and g1.graph == g2.graph)
+
+
+class TestGraphRecords:
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_compressed(self, seed):
+        """Records are written compressed and read back as the node-link data of the graph"""
+        graph = random_graph(random.Random(seed))
+        content = dump_graph(graph)
+        assert content.startswith(GRAPH_SNAPSHOT_PREFIX)
+        data = load_graph_data(content)
+        assert same_graph(nx.node_link_graph(data, edges="edges"), graph)
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_legacy_json(self, seed):
+        """Records written as plain JSON by earlier versions are still read"""
+        graph = random_graph(random.Random(seed))
+        content = json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False)
+        assert load_graph_data(content) == nx.node_link_data(graph, edges="edges")
+
+
+class FakeRetriever:
+    """The graph record found by `get_graph`, as its fields."""
+
+    def __init__(self):
+        self.record = None
+
+    def search(self, conds, index_name, kb_ids):
+        if self.record is None:
+            return SimpleNamespace(total=0, ids=[], field={})
+        return SimpleNamespace(total=1, ids=[self.record["id"]], field={self.record["id"]: self.record})
+
+
+class FakeDocStore:
+    def __init__(self):
+        self.aio = self
+        self.chunks = {}
+        self.gets = []
+
+    async def get(self, chunk_id, index_name, kb_ids):
+        await trio.lowlevel.checkpoint()
+        self.gets.append(chunk_id)
+        return self.chunks[chunk_id]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    retriever, doc_store = FakeRetriever(), FakeDocStore()
+    monkeypatch.setattr(utils.settings, "retriever", retriever, raising=False)
+    monkeypatch.setattr(utils.settings, "docStoreConn", doc_store, raising=False)
+    monkeypatch.setattr(utils, "_graph_cache", LRUCache(4))
+
+    def write(record_id, graph, content=None, source_id=None):
+        doc_store.chunks[record_id] = {"content_with_weight": content or dump_graph(graph)}
+        retriever.record = {"id": record_id, "removed_kwd": "N", "source_id": source_id or graph.graph["source_id"]}
+
+    return SimpleNamespace(retriever=retriever, doc_store=doc_store, write=write)
+
+
+def load(kb_id="kb"):
+    return trio.run(get_graph, "tenant", kb_id)
+
+
+class TestGetGraph:
+
+    def test_no_graph(self, store):
+        """Without a graph record, there is no graph"""
+        assert load() is None
+
+    @pytest.mark.parametrize("legacy", [False, True])
+    def test_loads_record(self, store, legacy):
+        """The current record is fetched and loaded, compressed or as plain JSON"""
+        graph = random_graph(random.Random(0))
+        store.write("r1", graph, json.dumps(nx.node_link_data(graph, edges="edges")) if legacy else None)
+        assert same_graph(load(), graph)
+        assert store.doc_store.gets == ["r1"]
+
+    def test_source_id_of_record(self, store):
+        """A graph saved without its sources gets those of its record"""
+        graph = random_graph(random.Random(0))
+        del graph.graph["source_id"]
+        store.write("r1", graph, source_id=["doc0", "doc1"])
+        assert load().graph["source_id"] == ["doc0", "doc1"]
+
+    def test_cache_hit(self, store):
+        """The same record is loaded once, every caller gets its own copy"""
+        graph = random_graph(random.Random(0))
+        store.write("r1", graph)
+        g1 = load()
+        g1.add_node("ADDED", source_id=["doc0"])
+        g1.graph["source_id"].append("doc9")
+        for n in list(g1.nodes)[:1]:
+            g1.nodes[n]["description"] = "changed"
+        g2 = load()
+        assert store.doc_store.gets == ["r1"]
+        assert same_graph(g2, graph) and g2 is not g1
+        assert not same_graph(g1, g2)
+
+    def test_new_record_misses(self, store):
+        """A graph written since is fetched again, under the id of its new record"""
+        store.write("r1", random_graph(random.Random(0)))
+        load()
+        graph = random_graph(random.Random(1))
+        store.write("r2", graph)
+        assert same_graph(load(), graph)
+        assert store.doc_store.gets == ["r1", "r2"]
+        assert [k for k in utils._graph_cache] == [("kb", "r2")]
+
+    def test_scoped_by_kb(self, store):
+        """Graphs of different knowledge bases are cached apart"""
+        store.write("r1", random_graph(random.Random(0)))
+        load("kb1")
+        load("kb2")
+        assert store.doc_store.gets == ["r1", "r1"]
+
+    def test_cache_disabled(self, store, monkeypatch):
+        """With GRAPH_CACHE_SIZE 0, every call fetches the record"""
+        monkeypatch.setattr(utils, "_graph_cache", None)
+        store.write("r1", random_graph(random.Random(0)))
+        load()
+        load()
+        assert store.doc_store.gets == ["r1", "r1"]
+
+
+def expected_sources(graph, change):
+    """Sources of the nodes changed, and of both ends of the edges changed, among the sources of the graph."""
+    sources = set()
+    for node in list(change.added_updated_nodes) + [n for edge in change.added_updated_edges for n in edge]:
+        if graph.has_node(node):
+            sources.update(graph.nodes[node]["source_id"])
+    return sources & set(graph.graph["source_id"])
+
+
+class TestChangedSources:
+
+    @pytest.mark.parametrize("seed", range(30))
+    def test_changed_nodes_and_edges(self, seed):
+        """The sources of changed nodes and of the ends of changed edges are changed"""
+        rnd = random.Random(seed)
+        graph = random_graph(rnd)
+        nodes, edges = list(graph.nodes), [get_from_to(a, b) for a, b in graph.edges]
+        change = GraphChange(added_updated_nodes=set(rnd.sample(nodes, rnd.randint(0, len(nodes)))),
+                             added_updated_edges=set(rnd.sample(edges, rnd.randint(0, len(edges)))))
+        got = _changed_sources(graph, change)
+        assert got == expected_sources(graph, change)
+        for node in change.added_updated_nodes:
+            assert set(graph.nodes[node]["source_id"]) <= got
+        for a, b in change.added_updated_edges:
+            assert set(graph.nodes[a]["source_id"]) | set(graph.nodes[b]["source_id"]) <= got
+
+    def test_unchanged(self):
+        """No change, no source to rewrite"""
+        assert _changed_sources(random_graph(random.Random(0)), GraphChange()) == set()
+
+    def test_unknown_nodes(self):
+        """Nodes no longer in the graph, and sources no longer of the graph, are left out"""
+        graph = random_graph(random.Random(0))
+        node = next(iter(graph.nodes))
+        graph.nodes[node]["source_id"] = ["doc0", "removed doc"]
+        change = GraphChange(added_updated_nodes={node, "GONE"}, added_updated_edges={("GONE", "ALSO GONE")})
+        assert _changed_sources(graph, change) == {"doc0"}
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_entity_resolution(self, seed, monkeypatch):
+        """Nodes merged by entity resolution leave their sources to the node they are merged into"""
+        rnd = random.Random(seed)
+        graph = random_graph(rnd, n_sources=8)
+        while graph.number_of_nodes() < 3:
+            graph = random_graph(rnd, n_sources=8)
+        merged = rnd.sample(list(graph.nodes), rnd.randint(2, min(4, graph.number_of_nodes())))
+        merged_sources = set().union(*(graph.nodes[n]["source_id"] for n in merged))
+
+        er = EntityResolution.__new__(EntityResolution)
+
+        async def summary(name, description, task_id=""):
+            return description
+
+        monkeypatch.setattr(er, "_handle_entity_relation_summary", summary)
+        change = GraphChange()
+        trio.run(er._merge_graph_nodes, graph, merged, change)
+
+        assert all(not graph.has_node(n) for n in merged[1:])
+        got = _changed_sources(graph, change)
+        assert merged_sources <= got
+        assert got == expected_sources(graph, change)
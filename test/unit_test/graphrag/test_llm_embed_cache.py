@@ -0,0 +1,214 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import random
+import struct
+
+import numpy as np
+import pytest
+import xxhash
+
+from graphrag import utils
+from graphrag.utils import (cache_stats, decode_embedding, encode_embedding, get_embed_cache, get_embed_cache_many,
+                            get_llm_cache, get_llm_cache_many, set_embed_cache, set_embed_cache_many, set_llm_cache,
+                            set_llm_cache_many)
+
+
+class FakeRedis:
+    """Values are stored as bytes; the text client decodes them, as with decode_responses=True."""
+
+    def __init__(self):
+        self.store = {}
+
+    def _put(self, k, v):
+        self.store[k] = v if isinstance(v, bytes) else str(v).encode("utf-8")
+
+    def get(self, k):
+        v = self.store.get(k)
+        return v.decode("utf-8") if v is not None else None
+
+    def get_bytes(self, k):
+        return self.store.get(k)
+
+    def mget(self, keys, binary=False):
+        return [self.store.get(k) if binary else self.get(k) for k in keys]
+
+    def set(self, k, v, exp=3600):
+        self._put(k, v)
+        return True
+
+    def set_many(self, mapping, exp=3600):
+        for k, v in mapping.items():
+            self._put(k, v)
+        return True
+
+
+def legacy_set_embed_cache(redis, llmnm, txt, arr):
+    """set_embed_cache before embeddings were stored as binary blobs."""
+    hasher = xxhash.xxh64()
+    hasher.update(str(llmnm).encode("utf-8"))
+    hasher.update(str(txt).encode("utf-8"))
+    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
+    redis.set(hasher.hexdigest(), arr.encode("utf-8"), 24 * 3600)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(utils, "REDIS_CONN", fake)
+    monkeypatch.setattr(utils, "_cache_stats", {"llm": {"hit": 0, "miss": 0}, "embed": {"hit": 0, "miss": 0}})
+    return fake
+
+
+class TestEmbeddingFormat:
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_float32_round_trip(self, seed):
+        """float32 entries hold the exact float32 values behind the EB1 header"""
+        rnd = np.random.default_rng(seed)
+        arr = rnd.standard_normal(int(rnd.integers(1, 2048)))
+        bin = encode_embedding(arr, "float32")
+        assert bin[:4] == b"EB1f"
+        assert struct.unpack("<I", bin[4:8])[0] == len(arr)
+        assert len(bin) == 8 + 4 * len(arr)
+        got = decode_embedding(bin)
+        assert got.dtype == np.float32
+        assert np.array_equal(got, arr.astype(np.float32))
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_float16_round_trip(self, seed):
+        """float16 entries are half the size and decoded as float32"""
+        rnd = np.random.default_rng(seed)
+        arr = rnd.standard_normal(int(rnd.integers(1, 2048)))
+        bin = encode_embedding(arr, "float16")
+        assert bin[:4] == b"EB1e" and len(bin) == 8 + 2 * len(arr)
+        got = decode_embedding(bin)
+        assert got.dtype == np.float32
+        assert np.array_equal(got, arr.astype(np.float16).astype(np.float32))
+
+    def test_default_dtype(self, monkeypatch):
+        """EMBED_CACHE_DTYPE picks the dtype of the entries"""
+        monkeypatch.setattr(utils, "EMBED_CACHE_DTYPE", "float16")
+        assert encode_embedding([1.0, 2.0])[:4] == b"EB1e"
+        monkeypatch.setattr(utils, "EMBED_CACHE_DTYPE", "float32")
+        assert encode_embedding([1.0, 2.0])[:4] == b"EB1f"
+
+    def test_decoded_vector_is_writable(self):
+        """The decoded vector does not share the buffer of the entry"""
+        got = decode_embedding(encode_embedding([1.0, 2.0], "float32"))
+        got[0] = 3.0
+        assert got.tolist() == [3.0, 2.0]
+
+    @pytest.mark.parametrize("dtype", ["float32", "float16"])
+    def test_malformed_entries(self, dtype):
+        """Truncated entries, entries whose dimension does not match their length and unknown dtypes are misses"""
+        bin = encode_embedding(np.arange(16, dtype=np.float32), dtype)
+        assert decode_embedding(bin[:-1]) is None
+        assert decode_embedding(bin[:8]) is None
+        assert decode_embedding(bin[:6]) is None
+        assert decode_embedding(bin + b"\0\0\0\0") is None
+        assert decode_embedding(bin[:4] + struct.pack("<I", 17) + bin[8:]) is None
+        assert decode_embedding(bin[:4] + struct.pack("<I", 15) + bin[8:]) is None
+        assert decode_embedding(b"EB1x" + bin[4:]) is None
+        assert decode_embedding(b"not json") is None
+        assert decode_embedding(b"[[1, 2], [3, 4]]") is None
+
+    def test_empty(self):
+        """No entry, no vector"""
+        assert decode_embedding(None) is None and decode_embedding(b"") is None
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_legacy_json(self, redis, seed):
+        """Entries written as JSON lists by the previous format are still read"""
+        rnd = random.Random(seed)
+        arr = np.array([rnd.uniform(-1, 1) for _ in range(rnd.randint(1, 64))])
+        legacy_set_embed_cache(redis, "bge", "text", arr)
+        assert np.allclose(get_embed_cache("bge", "text"), arr)
+        assert np.allclose(get_embed_cache_many("bge", ["text"])[0], arr)
+        assert np.allclose(decode_embedding(json.dumps(arr.tolist())), arr)
+
+
+class TestCacheMany:
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_embed_cache_aligned(self, redis, seed):
+        """Vectors read in one MGET follow the order of the texts, with None where they are missing"""
+        rnd = random.Random(seed)
+        txts = [f"entity {i}" for i in range(rnd.randint(1, 40))]
+        cached = rnd.sample(txts, rnd.randint(0, len(txts)))
+        arrs = {t: np.array([rnd.uniform(-1, 1) for _ in range(8)]) for t in cached}
+        # Some entries of the previous format, some written one by one.
+        legacy = set(rnd.sample(cached, len(cached) // 3))
+        for t in legacy:
+            legacy_set_embed_cache(redis, "bge", t, arrs[t])
+        rest = [t for t in cached if t not in legacy]
+        set_embed_cache_many("bge", rest[::2], [arrs[t] for t in rest[::2]])
+        for t in rest[1::2]:
+            set_embed_cache("bge", t, arrs[t])
+
+        queried = rnd.sample(txts, len(txts))
+        got = get_embed_cache_many("bge", queried)
+        assert len(got) == len(queried)
+        for t, v in zip(queried, got):
+            if t in arrs:
+                assert np.allclose(v, arrs[t], atol=1e-6)
+            else:
+                assert v is None
+            one = get_embed_cache("bge", t)
+            assert (one is None) == (v is None)
+        assert get_embed_cache_many("other model", cached) == [None] * len(cached)
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_llm_cache_aligned(self, redis, seed):
+        """Responses read in one MGET follow the order of the texts, with None where they are missing"""
+        rnd = random.Random(seed)
+        txts = [f"prompt {i}" for i in range(rnd.randint(1, 40))]
+        answers = {t: f"answer to {t}" for t in rnd.sample(txts, rnd.randint(0, len(txts)))}
+        items = list(answers.items())
+        set_llm_cache_many("gpt", items[::2], [{"role": "user"}], {"temperature": 0.1})
+        for t, v in items[1::2]:
+            set_llm_cache("gpt", t, v, [{"role": "user"}], {"temperature": 0.1})
+
+        queried = rnd.sample(txts, len(txts))
+        got = get_llm_cache_many("gpt", queried, [{"role": "user"}], {"temperature": 0.1})
+        assert got == [answers.get(t) for t in queried]
+        assert got == [get_llm_cache("gpt", t, [{"role": "user"}], {"temperature": 0.1}) for t in queried]
+        assert get_llm_cache_many("gpt", queried, [], {"temperature": 0.1}) == [None] * len(queried)
+
+    def test_empty_responses_not_cached(self, redis):
+        """An empty response is neither cached nor a hit"""
+        set_llm_cache_many("gpt", [("a", ""), ("b", "B")], [], {})
+        assert get_llm_cache_many("gpt", ["a", "b"], [], {}) == [None, "B"]
+
+
+class TestCacheStats:
+
+    def test_counters(self, redis):
+        """Every text read counts one hit or one miss, by cache"""
+        set_embed_cache_many("bge", ["a", "b"], [np.ones(4), np.zeros(4)])
+        get_embed_cache_many("bge", ["a", "b", "c"])
+        get_embed_cache("bge", "d")
+        set_llm_cache("gpt", "q", "answer", [], {})
+        get_llm_cache("gpt", "q", [], {})
+        get_llm_cache_many("gpt", ["q", "r", "s"], [], {})
+        assert cache_stats() == {"llm": {"hit": 2, "miss": 2}, "embed": {"hit": 2, "miss": 2}}
+
+    def test_copy(self, redis):
+        """The counters returned are a copy"""
+        stats = cache_stats()
+        stats["embed"]["hit"] = 100
+        assert cache_stats()["embed"]["hit"] == 0
@@ -0,0 +1,94 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import math
+import random
+import string
+
+import datrie
+import pytest
+
+from rag.nlp.rag_tokenizer import RagTokenizer
+
+CHARS = "中国人民银行发展大学生"
+
+
+def tokenizer_with_words(rnd, n_words):
+    """A RagTokenizer whose dictionary holds `n_words` random words of CHARS, without loading huqie."""
+    tok = RagTokenizer.__new__(RagTokenizer)
+    tok.DENOMINATOR = 1000000
+    tok.trie_ = datrie.Trie(string.printable)
+    for _ in range(n_words):
+        word = "".join(rnd.choices(CHARS, k=rnd.choice([1, 2, 2, 2, 3, 3, 4])))
+        freq = int(math.log(rnd.randint(1, 500000) / tok.DENOMINATOR) + .5)
+        tok.trie_[tok.key_(word)] = (freq, rnd.choice(["n", "v", "nr"]))
+        tok.trie_[tok.rkey_(word)] = 1
+    return tok
+
+
+def random_text(rnd, max_len):
+    n, chars = rnd.randint(1, max_len), []
+    while len(chars) < n:
+        # Runs of a repeated character take their own path in dfs_.
+        chars.extend(rnd.choice(CHARS) * (rnd.randint(5, 8) if rnd.random() < 0.05 else 1))
+    return "".join(chars)
+
+
+def dfs_segmentations(tok, text, topn):
+    tkslist = []
+    tok.dfs_(text, 0, [], tkslist)
+    return tok._sort_tokens(tkslist)[:topn]
+
+
+def assert_same_segmentations(got, expected):
+    assert [tks for tks, _ in got] == [tks for tks, _ in expected]
+    assert [sc for _, sc in got] == pytest.approx([sc for _, sc in expected])
+
+
+class TestDagSegmentation:
+
+    @pytest.mark.parametrize("seed", range(30))
+    @pytest.mark.parametrize("topn", [1, 2])
+    def test_same_as_dfs(self, seed, topn):
+        """dag_ returns the best segmentations dfs_ enumerates, in the same order"""
+        rnd = random.Random(seed)
+        tok = tokenizer_with_words(rnd, rnd.choice([5, 20, 60]))
+        for _ in range(20):
+            text = random_text(rnd, 18)
+            assert_same_segmentations(tok.dag_(text, topn), dfs_segmentations(tok, text, topn))
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_beyond_max_depth(self, seed):
+        """Texts with more tokens than dfs_ recurses into end with the same unknown token"""
+        rnd = random.Random(seed)
+        tok = tokenizer_with_words(rnd, 3)
+        text = "".join(rnd.choices(CHARS, k=16))
+        assert_same_segmentations(tok.dag_(text, 2), dfs_segmentations(tok, text, 2))
+
+    def test_empty_dictionary(self):
+        """Unknown characters are single tokens"""
+        tok = tokenizer_with_words(random.Random(0), 0)
+        assert_same_segmentations(tok.dag_("中国人", 1), dfs_segmentations(tok, "中国人", 1))
+        assert tok.dag_("中国人", 1)[0][0] == ["中", "国", "人"]
+
+    @pytest.mark.parametrize("engine", ["dag", "dfs"])
+    def test_segment_engine(self, engine):
+        """RAG_TOKENIZER_ENGINE selects the segmentation, with the same result"""
+        rnd = random.Random(0)
+        tok = tokenizer_with_words(rnd, 30)
+        tok.SEGMENT_ENGINE = engine
+        text = random_text(rnd, 12)
+        assert_same_segmentations(tok._best_segmentations(text, 2), dfs_segmentations(tok, text, 2))
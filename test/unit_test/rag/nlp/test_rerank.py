@@ -0,0 +1,92 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from rag.nlp import rerank
+from rag.nlp.rerank_benchmark import legacy_rerank, synthetic_search_result
+from rag.nlp.search import Dealer
+from rag.utils.doc_store_conn import DocStoreConnection
+
+
+def random_search_result(seed):
+    rnd = random.Random(seed)
+    dim = rnd.choice([4, 16, 64])
+    sres, keywords = synthetic_search_result(rnd.randint(1, 60), dim, rnd.choice([20, 200]), rnd.randint(1, 40),
+                                             as_str=rnd.random() < 0.5, seed=seed)
+    for chunk_id in sres.ids:
+        fields = sres.field[chunk_id]
+        r = rnd.random()
+        if r < 0.1:
+            del fields[f"q_{dim}_vec"]
+        elif r < 0.2:
+            fields[f"q_{dim}_vec"] = [0.0] * dim
+        if fields["important_kwd"] and rnd.random() < 0.3:
+            fields["important_kwd"] = fields["important_kwd"][0]
+    if rnd.random() < 0.1:
+        sres.query_vector = [0.0] * dim
+    # Repeated keywords and keywords no chunk contains.
+    keywords = keywords[:rnd.randint(1, len(keywords))] + rnd.choices(keywords, k=2) + ["missing"]
+    return sres, keywords
+
+
+@pytest.fixture
+def dealer():
+    return Dealer(mock.MagicMock(spec=DocStoreConnection))
+
+
+class TestRerank:
+
+    @pytest.mark.parametrize("seed", range(40))
+    def test_same_as_legacy(self, dealer, monkeypatch, seed):
+        """Dealer.rerank scores match the per-chunk term-weight dicts of FulltextQueryer.hybrid_similarity"""
+        sres, keywords = random_search_result(seed)
+        monkeypatch.setattr(dealer.qryr, "question", lambda *args, **kwargs: (None, keywords))
+        sim, tksim, vtsim = dealer.rerank(sres, "question")
+        # legacy_rerank expects important_kwd as a list, which Dealer.rerank has made it.
+        sim0, tksim0, vtsim0 = legacy_rerank(dealer.qryr, sres, keywords)
+        rank_fea = dealer._rank_feature_scores(None, sres)
+        assert np.max(np.abs(np.array(tksim0) - tksim)) <= rerank.TOKEN_SIM_TOLERANCE
+        assert np.max(np.abs(np.array(vtsim0) - vtsim)) <= rerank.VECTOR_SIM_TOLERANCE
+        assert np.max(np.abs(np.array(sim0) + rank_fea - sim)) <= rerank.VECTOR_SIM_TOLERANCE
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_token_similarity(self, dealer, seed):
+        """QueryTerms.similarity is FulltextQueryer.token_similarity over the concatenated fields"""
+        rnd = random.Random(seed)
+        vocab = [f"term{i}" for i in range(30)]
+        keywords = rnd.choices(vocab, k=rnd.randint(1, 10))
+        chunks = [tuple(rnd.choices(vocab, k=rnd.randint(0, 8)) for _ in range(rnd.randint(1, 4))) for _ in range(50)]
+        expected = dealer.qryr.token_similarity(keywords, [[t for tks in fields for t in tks] for fields in chunks])
+        got = rerank.QueryTerms(dealer.qryr.tw, keywords).similarity(chunks)
+        assert np.max(np.abs(np.array(expected) - got)) <= rerank.TOKEN_SIM_TOLERANCE
+
+    def test_decode_vectors(self):
+        """Vectors as lists or tab separated strings, zeros when missing"""
+        fields = {"a": {"q_3_vec": [1, 2, 3]}, "b": {"q_3_vec": "4\t5\t6"}, "c": {}}
+        mat = rerank.decode_vectors(fields, ["c", "b", "a"], "q_3_vec", 3)
+        assert mat.dtype == np.float32
+        assert mat.tolist() == [[0, 0, 0], [4, 5, 6], [1, 2, 3]]
+
+    def test_no_results(self, dealer, monkeypatch):
+        """No chunks, no scores"""
+        monkeypatch.setattr(dealer.qryr, "question", lambda *args, **kwargs: (None, ["term"]))
+        sres = Dealer.SearchResult(total=0, ids=[], query_vector=[0.1, 0.2], field={})
+        assert dealer.rerank(sres, "question") == ([], [], [])
@@ -0,0 +1,176 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import itertools
+
+import pytest
+
+from rag.nlp import retrieval_cache
+from rag.nlp.retrieval_cache import RetrievalCache, bump_kb_generation, bumps_kb_generation, kb_generations
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    def set_many(self, mapping, exp=3600):
+        self.store.update(mapping)
+        return True
+
+    def mget(self, keys, binary=False):
+        return [self.store.get(k) for k in keys]
+
+
+class FakeDocStore:
+    def __init__(self):
+        self.calls = []
+
+    @bumps_kb_generation
+    def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None):
+        self.calls.append("insert")
+        return []
+
+    @bumps_kb_generation
+    def delete(self, condition: dict, indexName: str, knowledgebaseId: str):
+        self.calls.append("delete")
+        raise ConnectionError("doc store is down")
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(retrieval_cache, "_redis", lambda: fake)
+    # A new generation at every write; writes long ago, so that results are cached.
+    clock = itertools.count(1000)
+    monkeypatch.setattr(retrieval_cache.time, "time", lambda: float(next(clock)))
+    return fake
+
+
+def ranks(*chunk_ids):
+    return {"total": len(chunk_ids), "chunks": [{"chunk_id": c, "similarity": 0.5} for c in chunk_ids],
+            "doc_aggs": [{"doc_name": "doc", "doc_id": "d", "count": len(chunk_ids)}]}
+
+
+class TestKbGenerations:
+
+    def test_bump(self, redis):
+        """A write sets a new generation for each knowledge base it touches"""
+        before = kb_generations(["idx"], ["kb1", "kb2"])
+        bump_kb_generation("idx", "kb1")
+        after = kb_generations(["idx"], ["kb1", "kb2"])
+        assert before == (None, None, None)
+        assert after[0] is not None and after[1:] == (None, None)
+        bump_kb_generation("idx", ["kb1", "kb2"])
+        again = kb_generations(["idx"], ["kb1", "kb2"])
+        assert again[0] != after[0] and again[1] is not None and again[2] is None
+
+    def test_bump_without_kb(self, redis):
+        """A write to an unknown knowledge base bumps the index"""
+        bump_kb_generation("idx", None)
+        assert kb_generations(["idx"], ["kb1"])[1] is not None
+        assert kb_generations([], None) == ()
+
+    def test_decorator(self, redis):
+        """Decorated writes bump their knowledge base, given as positional or keyword argument"""
+        store = FakeDocStore()
+        g0 = kb_generations(["idx"], ["kb"])
+        store.insert([], "idx", "kb")
+        g1 = kb_generations(["idx"], ["kb"])
+        store.insert([], indexName="idx", knowledgebaseId="kb")
+        g2 = kb_generations(["idx"], ["kb"])
+        assert len({g0, g1, g2}) == 3
+
+    def test_decorator_bumps_on_error(self, redis):
+        """A failed write may have changed some chunks, so it bumps too"""
+        store = FakeDocStore()
+        g0 = kb_generations(["idx"], ["kb"])
+        with pytest.raises(ConnectionError):
+            store.delete({"id": ["c"]}, "idx", "kb")
+        assert kb_generations(["idx"], ["kb"]) != g0
+
+    def test_decorator_redis_error(self, monkeypatch):
+        """A failed bump does not fail the write"""
+        def broken():
+            raise ConnectionError("redis is down")
+        monkeypatch.setattr(retrieval_cache, "_redis", broken)
+        assert FakeDocStore().insert([], "idx", "kb") == []
+
+
+class TestRetrievalCache:
+
+    def test_hit_until_write(self, redis):
+        """A result is returned while its knowledge bases are not written to"""
+        cache = RetrievalCache()
+        key = cache.result_key("what  is ragflow", None, None, ["idx"], ["kb"], page=1, top=1024)
+        cache.set_result(key, kb_generations(["idx"], ["kb"]), ranks("c1"))
+        assert cache.get_result(key, kb_generations(["idx"], ["kb"])) == ranks("c1")
+        FakeDocStore().insert([], "idx", "kb")
+        assert cache.get_result(key, kb_generations(["idx"], ["kb"])) is None
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1 and cache.stats()["results"] == 0
+
+    def test_other_kb_write(self, redis):
+        """Writes to other knowledge bases keep the result"""
+        cache = RetrievalCache()
+        key = cache.result_key("q", None, None, ["idx"], ["kb"])
+        cache.set_result(key, kb_generations(["idx"], ["kb"]), ranks("c1"))
+        FakeDocStore().insert([], "idx", "other_kb")
+        assert cache.get_result(key, kb_generations(["idx"], ["kb"])) == ranks("c1")
+
+    def test_not_cached_within_grace(self, redis, monkeypatch):
+        """Results computed right after a write are not cached, the doc store may not have refreshed yet"""
+        monkeypatch.setattr(retrieval_cache.time, "time", lambda: 1000.5)
+        bump_kb_generation("idx", "kb")
+        cache = RetrievalCache()
+        key = cache.result_key("q", None, None, ["idx"], ["kb"])
+        cache.set_result(key, kb_generations(["idx"], ["kb"]), ranks("c1"))
+        assert cache.get_result(key, kb_generations(["idx"], ["kb"])) is None
+
+    def test_results_are_copies(self, redis):
+        """Callers changing a result do not change the cached one"""
+        cache = RetrievalCache()
+        key = cache.result_key("q", None, None, ["idx"], ["kb"])
+        generations = kb_generations(["idx"], ["kb"])
+        result = ranks("c1")
+        cache.set_result(key, generations, result)
+        result["chunks"][0]["similarity"] = 1.0
+        got = cache.get_result(key, generations)
+        got["chunks"].append({"chunk_id": "c2"})
+        got["doc_aggs"][0]["count"] = 9
+        assert cache.get_result(key, generations) == ranks("c1")
+
+    def test_result_key(self):
+        """Keys differ by question, models and parameters, not by whitespace"""
+        class Model:
+            def __init__(self, tenant_id, llm_name):
+                self.tenant_id, self.llm_name = tenant_id, llm_name
+
+        key = RetrievalCache.result_key
+        assert key("a  b", None, None, ["idx"], ["kb"], top=1) == key("a b", None, None, ["idx"], ["kb"], top=1)
+        assert key("a", None, None, ["idx"], ["kb"], top=1) != key("a", None, None, ["idx"], ["kb"], top=2)
+        assert key("a", Model("t1", "m"), None, ["idx"], ["kb"]) != key("a", Model("t2", "m"), None, ["idx"], ["kb"])
+        assert key("a", None, None, ["idx"], ["kb1"]) != key("a", None, None, ["idx"], ["kb2"])
+
+    def test_vectors_by_model(self):
+        """Query vectors are cached by tenant and model"""
+        class Model:
+            def __init__(self, tenant_id, llm_name):
+                self.tenant_id, self.llm_name = tenant_id, llm_name
+
+        cache = RetrievalCache()
+        cache.set_vector(Model("t1", "bge"), "q", [1.0])
+        assert cache.get_vector(Model("t1", "bge"), "q") == [1.0]
+        assert cache.get_vector(Model("t2", "bge"), "q") is None
+        assert cache.get_vector(Model("t1", "other"), "q") is None
@@ -0,0 +1,381 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import logging
+import random
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from common.constants import PAGERANK_FLD, TAG_FLD
+from rag.nlp import rag_tokenizer
+from rag.nlp.search import Dealer
+from rag.utils import es_conn
+from rag.utils.doc_store_conn import DocStoreConnection, FusionExpr, MatchDenseExpr, MatchTextExpr, OrderByExpr
+
+DIM = 8
+
+
+def es_connection():
+    """An ESConnection which is not connected, its class being wrapped by @singleton."""
+    cls = next(c.cell_contents for c in es_conn.ESConnection.__closure__ if isinstance(c.cell_contents, type))
+    return cls.__new__(cls)
+
+
+def question_vector(i):
+    v = [0.0] * DIM
+    v[i % DIM] = 1.0
+    v[(i // DIM) % DIM] += 0.5
+    return v
+
+
+class EmbeddingModel:
+    def __init__(self, questions):
+        self.vectors = {q: question_vector(i) for i, q in enumerate(questions)}
+
+    def encode_queries(self, txt):
+        return np.array(self.vectors[txt]), 1
+
+
+def fake_question(txt, tbl="qa", min_match=0.6):
+    keywords = txt.split()
+    return MatchTextExpr(["content_ltks^2"], " ".join(keywords), 100, {"minimum_should_match": min_match}), keywords
+
+
+def normalized(args):
+    """The arguments of a search call, with the match expressions as comparable tuples."""
+    exprs = []
+    for m in args["matchExprs"]:
+        if isinstance(m, MatchTextExpr):
+            exprs.append(("text", m.matching_text, m.extra_options.get("minimum_should_match")))
+        elif isinstance(m, MatchDenseExpr):
+            exprs.append(("dense", m.vector_column_name, tuple(m.embedding_data), m.topn, m.extra_options.get("similarity")))
+        elif isinstance(m, FusionExpr):
+            exprs.append(("fusion", m.method, m.topn, tuple(sorted(m.fusion_params.items()))))
+    return {**args, "selectFields": list(args["selectFields"]), "condition": dict(args["condition"]),
+            "matchExprs": exprs, "orderBy": list(args["orderBy"].fields)}
+
+
+class FakeIndex:
+    """Answers searches by the question their query vector stands for.
+
+    A question of mode "first" has hits, one of mode "relaxed" only with the relaxed conditions of the retry,
+    and one of mode "none" never has hits but for searches of its documents without a question.
+    """
+
+    def __init__(self, questions, modes, rnd):
+        self.questions = questions
+        self.modes = modes
+        self.by_vector = {tuple(question_vector(i)): i for i in range(len(questions))}
+        self.chunks = {}
+        for i, q in enumerate(questions):
+            self.chunks[i] = [self.chunk(i, j, rnd) for j in range(rnd.randint(1, 6))]
+
+    def chunk(self, i, j, rnd):
+        keyword = rnd.choice(self.questions[i].split())
+        return {"_id": f"q{i}c{j}", "_score": round(rnd.uniform(0.1, 3), 3), "_source": {
+            "docnm_kwd": f"doc{i}.pdf", "doc_id": f"doc{i}", "kb_id": "kb", "content_with_weight": f"chunk {j} of question {i}",
+            "content_ltks": f"{keyword} chunk {j}", "title_tks": "", "important_kwd": [], "question_kwd": [],
+            "position_int": [], "page_num_int": [1], "top_int": [1], "available_int": 1, PAGERANK_FLD: 0,
+            f"q_{DIM}_vec": [round(rnd.uniform(-1, 1), 4) for _ in range(DIM)]}}
+
+    def hits(self, args):
+        dense = [m for m in args["matchExprs"] if isinstance(m, MatchDenseExpr)]
+        if not dense:
+            doc_ids = args["condition"].get("doc_id") or []
+            return [c for i, cs in self.chunks.items() for c in cs if f"doc{i}" in doc_ids]
+        i = self.by_vector[tuple(dense[0].embedding_data)]
+        text = [m for m in args["matchExprs"] if isinstance(m, MatchTextExpr)][0]
+        relaxed = text.extra_options["minimum_should_match"] == 0.1 and dense[0].extra_options["similarity"] == 0.17
+        if self.modes[i] == "first" or (self.modes[i] == "relaxed" and relaxed):
+            return self.chunks[i]
+        return []
+
+    def response(self, args):
+        hits = self.hits(args)
+        fields = set(args["selectFields"])
+        hits = [{**h, "_source": {k: v for k, v in h["_source"].items() if k in fields}} for h in hits]
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+
+def fake_store(index):
+    """A doc store answering from `index`, recording the searches of every call."""
+    es = es_connection()
+    store = mock.MagicMock(spec=DocStoreConnection)
+    store.calls = []
+    store.batches = []
+
+    def search(selectFields, highlightFields, condition, matchExprs, orderBy, offset, limit, indexNames,
+               knowledgebaseIds, aggFields=[], rank_feature=None):
+        args = {"selectFields": selectFields, "highlightFields": highlightFields, "condition": condition,
+                "matchExprs": matchExprs, "orderBy": orderBy, "offset": offset, "limit": limit,
+                "indexNames": indexNames, "knowledgebaseIds": knowledgebaseIds, "rank_feature": rank_feature}
+        store.calls.append(normalized(args))
+        return index.response(args)
+
+    def search_many(searches):
+        store.batches.append(len(searches))
+        return [search(**s) for s in searches]
+
+    store.search.side_effect = search
+    store.search_many.side_effect = search_many
+    for name in ["get_total", "get_chunk_ids", "get_fields", "get_highlight", "get_aggregation"]:
+        getattr(store, name).side_effect = getattr(es, name)
+    return store
+
+
+def legacy_search(dealer, req, idx_names, kb_ids, emb_mdl=None, highlight=None, rank_feature=None):
+    """Dealer.search before searches were batched, for a request with a question."""
+    if highlight is None:
+        highlight = False
+    filters = dealer.get_filters(req)
+    orderBy = OrderByExpr()
+    pg = int(req.get("page", 1)) - 1
+    topk = int(req.get("topk", 1024))
+    ps = int(req.get("size", topk))
+    offset, limit = pg * ps, ps
+    src = req.get("fields",
+                  ["docnm_kwd", "content_ltks", "kb_id", "img_id", "title_tks", "important_kwd", "position_int",
+                   "doc_id", "page_num_int", "top_int", "create_timestamp_flt", "knowledge_graph_kwd",
+                   "question_kwd", "question_tks", "doc_type_kwd",
+                   "available_int", "content_with_weight", PAGERANK_FLD, TAG_FLD])
+    kwds = set([])
+    qst = req["question"]
+    highlightFields = ["content_ltks", "title_tks"]
+    if not highlight:
+        highlightFields = []
+    elif isinstance(highlight, list):
+        highlightFields = highlight
+    matchText, keywords = dealer.qryr.question(qst, min_match=0.3)
+    matchDense = dealer.get_vector(qst, emb_mdl, topk, req.get("similarity", 0.1))
+    q_vec = matchDense.embedding_data
+    if req.get("vector", True):
+        src.append(f"q_{len(q_vec)}_vec")
+    fusionExpr = FusionExpr("weighted_sum", topk, {"weights": "0.05,0.95"})
+    matchExprs = [matchText, matchDense, fusionExpr]
+    res = dealer.dataStore.search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
+                                  idx_names, kb_ids, rank_feature=rank_feature)
+    total = dealer.dataStore.get_total(res)
+    if total == 0:
+        if filters.get("doc_id"):
+            res = dealer.dataStore.search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
+            total = dealer.dataStore.get_total(res)
+        else:
+            matchText, _ = dealer.qryr.question(qst, min_match=0.1)
+            matchDense.extra_options["similarity"] = 0.17
+            res = dealer.dataStore.search(src, highlightFields, filters, [matchText, matchDense, fusionExpr],
+                                          orderBy, offset, limit, idx_names, kb_ids, rank_feature=rank_feature)
+            total = dealer.dataStore.get_total(res)
+    for k in keywords:
+        kwds.add(k)
+        for kk in rag_tokenizer.fine_grained_tokenize(k).split():
+            if len(kk) < 2 or kk in kwds:
+                continue
+            kwds.add(kk)
+    ids = dealer.dataStore.get_chunk_ids(res)
+    return Dealer.SearchResult(total=total, ids=ids, query_vector=q_vec,
+                               aggregation=dealer.dataStore.get_aggregation(res, "docnm_kwd"),
+                               highlight=dealer.dataStore.get_highlight(res, list(kwds), "content_with_weight"),
+                               field=dealer.dataStore.get_fields(res, src + ["_score"]), keywords=list(kwds))
+
+
+def random_case(seed):
+    rnd = random.Random(seed)
+    vocab = [f"kw{i}" for i in range(20)]
+    questions = list(dict.fromkeys(" ".join(rnd.sample(vocab, rnd.randint(1, 4))) for _ in range(rnd.randint(1, 8))))
+    modes = [rnd.choice(["first", "first", "relaxed", "none"]) for _ in questions]
+    index = FakeIndex(questions, modes, rnd)
+    reqs = []
+    for i, q in enumerate(questions):
+        req = {"kb_ids": ["kb"], "question": q, "size": 64, "topk": 1024, "similarity": 0.2, "available_int": 1,
+               "vector": rnd.random() < 0.5}
+        if rnd.random() < 0.3:
+            req["doc_ids"] = [f"doc{i}"]
+        reqs.append(req)
+    return questions, modes, index, reqs
+
+
+@pytest.fixture
+def dealer(monkeypatch):
+    dealer = Dealer(mock.MagicMock(spec=DocStoreConnection))
+    monkeypatch.setattr(dealer.qryr, "question", fake_question)
+    return dealer
+
+
+def assert_same_result(got, expected):
+    assert got.total == expected.total
+    assert got.ids == expected.ids
+    assert got.query_vector == expected.query_vector
+    assert sorted(got.keywords) == sorted(expected.keywords)
+    assert dict(got.field) == dict(expected.field)
+    assert got.highlight == expected.highlight
+    assert got.aggregation == expected.aggregation
+
+
+class TestDealerSearchMany:
+
+    @pytest.mark.parametrize("seed", range(30))
+    def test_same_as_legacy_search(self, dealer, seed):
+        """Each request gets the result, and sends the searches, of the former single-request search"""
+        questions, modes, index, reqs = random_case(seed)
+        emb_mdl = EmbeddingModel(questions)
+
+        dealer.dataStore = fake_store(index)
+        expected, expected_calls = [], []
+        for req in reqs:
+            dealer.dataStore.calls = []
+            expected.append(legacy_search(dealer, dict(req), "ragflow_tenant", ["kb"], emb_mdl, rank_feature={PAGERANK_FLD: 10}))
+            expected_calls.append(dealer.dataStore.calls)
+
+        dealer.dataStore = fake_store(index)
+        got = dealer.search_many([dict(req) for req in reqs], "ragflow_tenant", ["kb"], emb_mdl,
+                                 rank_feature={PAGERANK_FLD: 10})
+        assert len(got) == len(reqs)
+        for g, e in zip(got, expected):
+            assert_same_result(g, e)
+
+        # One batch of first searches, then one batch of the retries of those without hits, in request order.
+        retried = [i for i, calls in enumerate(expected_calls) if len(calls) == 2]
+        assert dealer.dataStore.batches == [len(reqs)] + ([len(retried)] if retried else [])
+        calls = dealer.dataStore.calls
+        assert calls[:len(reqs)] == [c[0] for c in expected_calls]
+        assert calls[len(reqs):] == [expected_calls[i][1] for i in retried]
+        assert retried == [i for i, m in enumerate(modes) if m != "first"]
+
+    def test_relaxed_retry(self, dealer):
+        """A question without hits is searched again with min_match 0.1 and similarity 0.17"""
+        questions = ["kw1 kw2", "kw3"]
+        index = FakeIndex(questions, ["relaxed", "first"], random.Random(0))
+        dealer.dataStore = fake_store(index)
+        reqs = [{"kb_ids": ["kb"], "question": q, "similarity": 0.2} for q in questions]
+        got = dealer.search_many(reqs, "ragflow_tenant", ["kb"], EmbeddingModel(questions))
+        assert [r.ids for r in got] == [[c["_id"] for c in index.chunks[0]], [c["_id"] for c in index.chunks[1]]]
+        retry = dealer.dataStore.calls[2]
+        assert retry["matchExprs"][0] == ("text", "kw1 kw2", 0.1)
+        assert retry["matchExprs"][1][-1] == 0.17
+        assert dealer.dataStore.batches == [2, 1]
+
+    def test_retry_of_documents(self, dealer):
+        """A question without hits in given documents is searched again as a listing of the documents"""
+        index = FakeIndex(["kw1"], ["none"], random.Random(0))
+        dealer.dataStore = fake_store(index)
+        req = {"kb_ids": ["kb"], "question": "kw1", "doc_ids": ["doc0"]}
+        got = dealer.search(req, "ragflow_tenant", ["kb"], EmbeddingModel(["kw1"]))
+        assert got.ids == [c["_id"] for c in index.chunks[0]]
+        retry = dealer.dataStore.calls[1]
+        assert retry["matchExprs"] == [] and retry["highlightFields"] == [] and retry["rank_feature"] is None
+
+    def test_no_retry_without_vectors(self, dealer):
+        """Without an embedding model, searches are not retried, as before"""
+        store = mock.MagicMock(spec=DocStoreConnection)
+        store.search_many.return_value = [{"hits": {"total": {"value": 0}, "hits": []}}]
+        es = es_connection()
+        for name in ["get_total", "get_chunk_ids", "get_fields", "get_highlight", "get_aggregation"]:
+            getattr(store, name).side_effect = getattr(es, name)
+        dealer.dataStore = store
+        assert dealer.search({"question": "kw1"}, "ragflow_tenant", ["kb"]).total == 0
+        assert store.search_many.call_count == 1
+
+
+class TestRetrievalMany:
+
+    @pytest.mark.parametrize("seed", range(15))
+    def test_same_as_one_by_one(self, dealer, seed, monkeypatch):
+        """Each question gets the chunks it gets when retrieved alone"""
+        monkeypatch.setenv("DOC_ENGINE", "elasticsearch")
+        questions, modes, index, _ = random_case(seed)
+        emb_mdl = EmbeddingModel(questions)
+        dealer.dataStore = fake_store(index)
+        alone = [dealer.retrieval(q, emb_mdl, "tenant", ["kb"], 1, 10, similarity_threshold=0.0) for q in questions]
+        dealer.dataStore = fake_store(index)
+        together = dealer.retrieval_many(questions + [""], emb_mdl, "tenant", ["kb"], 1, 10, similarity_threshold=0.0)
+        assert together[:-1] == alone
+        assert together[-1] == {"total": 0, "chunks": [], "doc_aggs": {}}
+        for i, ranks in enumerate(together[:-1]):
+            assert {c["chunk_id"] for c in ranks["chunks"]} <= {c["_id"] for c in index.chunks[i]}
+            if modes[i] != "none":
+                assert ranks["chunks"]
+        assert len(dealer.dataStore.batches) <= 2
+
+
+class FakeES:
+    def __init__(self, responses, search_responses=None):
+        self.responses = responses
+        self.search_responses = list(search_responses or [])
+        self.msearches = []
+        self.searches = []
+
+    def msearch(self, searches):
+        self.msearches.append(searches)
+        return {"responses": self.responses}
+
+    def search(self, **kwargs):
+        self.searches.append(kwargs)
+        r = self.search_responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+
+def response(*ids):
+    return {"hits": {"total": {"value": len(ids)}, "hits": [{"_id": i, "_score": 1.0, "_source": {}} for i in ids]}}
+
+
+def es_search(kb):
+    return {"selectFields": ["content_with_weight"], "highlightFields": [], "condition": {}, "matchExprs": [],
+            "orderBy": OrderByExpr(), "offset": 0, "limit": 10, "indexNames": "ragflow_tenant", "knowledgebaseIds": [kb]}
+
+
+class TestESSearchMany:
+
+    def test_one_request(self):
+        """The searches are sent as one multi search, and their responses returned in order"""
+        conn = es_connection()
+        conn.es = FakeES([response("a"), response(), response("c1", "c2")])
+        res = conn.search_many([es_search("kb0"), es_search("kb1"), es_search("kb2")])
+        assert [conn.get_chunk_ids(r) for r in res] == [["a"], [], ["c1", "c2"]]
+        assert len(conn.es.msearches) == 1 and conn.es.searches == []
+        operations = conn.es.msearches[0]
+        assert [op["index"] for op in operations[::2]] == [["ragflow_tenant"]] * 3
+        assert [op["_source"] for op in operations[1::2]] == [["content_with_weight"]] * 3
+
+    def test_single_search(self):
+        """A single search is sent as a search"""
+        conn = es_connection()
+        conn.es = FakeES([], [response("a")])
+        assert [conn.get_chunk_ids(r) for r in conn.search_many([es_search("kb0")])] == [["a"]]
+        assert conn.es.msearches == [] and len(conn.es.searches) == 1
+
+    def test_failed_search_sent_again(self, caplog):
+        """A failed or timed out search is sent again alone, and the others keep their responses"""
+        conn = es_connection()
+        conn.es = FakeES([response("a"), {"error": {"type": "search_phase_execution_exception"}, "status": 500},
+                          response("c"), {**response("partial"), "timed_out": True}],
+                         [response("b"), response("d")])
+        with caplog.at_level(logging.WARNING):
+            res = conn.search_many([es_search("kb0"), es_search("kb1"), es_search("kb2"), es_search("kb3")])
+        assert [conn.get_chunk_ids(r) for r in res] == [["a"], ["b"], ["c"], ["d"]]
+        assert [s["body"]["query"]["bool"]["filter"] for s in conn.es.searches] == \
+               [[{"terms": {"kb_id": ["kb1"]}}], [{"terms": {"kb_id": ["kb3"]}}]]
+
+    def test_search_failing_again(self):
+        """A search failing again fails search_many, as it fails `search`"""
+        conn = es_connection()
+        conn.es = FakeES([response("a"), {"error": {"type": "index_not_found_exception"}, "status": 404}],
+                         [RuntimeError("index_not_found_exception")])
+        with pytest.raises(RuntimeError):
+            conn.search_many([es_search("kb0"), es_search("kb1")])
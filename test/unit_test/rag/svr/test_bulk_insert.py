@@ -0,0 +1,117 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import random
+
+from rag.svr import bulk_insert
+from rag.svr.bulk_insert import AdaptiveBulkSize, estimate_chunk_bytes, get_bulk_size
+
+
+def chunk(content_len=10, dim=4):
+    return {"id": "x", "content_with_weight": "a" * content_len, "important_kwd": ["k1", "k2"],
+            "q_%d_vec" % dim: [0.123456789] * dim, "page_num_int": [1]}
+
+
+class TestAdaptiveBulkSize:
+
+    def test_initial_size_bounds(self):
+        """The initial size is clamped to [1, max_size]"""
+        assert AdaptiveBulkSize(4, 16, 1 << 20, 1.0).size == 4
+        assert AdaptiveBulkSize(64, 16, 1 << 20, 1.0).size == 16
+        assert AdaptiveBulkSize(0, 16, 1 << 20, 1.0).size == 1
+        assert AdaptiveBulkSize(4, 0, 1 << 20, 1.0).size == 1
+
+    def test_grows_while_fast(self):
+        """Full batches well under the target latency double the size, up to max_size"""
+        sizing = AdaptiveBulkSize(4, 20, 1 << 20, 1.0)
+        sizes = []
+        for _ in range(5):
+            sizing.record(sizing.size, 0.1)
+            sizes.append(sizing.size)
+        assert sizes == [8, 16, 20, 20, 20]
+
+    def test_partial_batches_do_not_grow(self):
+        """Batches cut short, e.g. the last of a document or by bytes, say nothing of a larger size"""
+        sizing = AdaptiveBulkSize(8, 64, 1 << 20, 1.0)
+        sizing.record(3, 0.01)
+        assert sizing.size == 8
+
+    def test_shrinks_when_slow(self):
+        """A request slower than the target halves the size, down to 1"""
+        sizing = AdaptiveBulkSize(8, 64, 1 << 20, 1.0)
+        sizes = []
+        for _ in range(5):
+            sizing.record(sizing.size, 1.5)
+            sizes.append(sizing.size)
+        assert sizes == [4, 2, 1, 1, 1]
+
+    def test_steady_between_half_and_target(self):
+        """Latencies between half the target and the target keep the size"""
+        sizing = AdaptiveBulkSize(8, 64, 1 << 20, 1.0)
+        sizing.record(8, 0.5)
+        sizing.record(8, 1.0)
+        assert sizing.size == 8
+
+    def test_batch_end_by_size(self):
+        """Batches are `size` chunks, the last one what is left"""
+        sizing = AdaptiveBulkSize(4, 64, 1 << 20, 1.0)
+        chunks = [chunk() for _ in range(10)]
+        assert [sizing.batch_end(chunks, s) for s in (0, 4, 8)] == [4, 8, 10]
+
+    def test_batch_end_by_bytes(self):
+        """A batch ends with the chunk reaching max_bytes, and has at least one chunk"""
+        chunks = [chunk(content_len=1000) for _ in range(10)]
+        n = estimate_chunk_bytes(chunks[0])
+        sizing = AdaptiveBulkSize(10, 64, 3 * n, 1.0)
+        assert sizing.batch_end(chunks, 0) == 3
+        assert sizing.batch_end(chunks, 8) == 10
+        sizing = AdaptiveBulkSize(10, 64, 1, 1.0)
+        assert sizing.batch_end(chunks, 5) == 6
+
+    def test_batches_cover_chunks(self):
+        """Consecutive batches cover every chunk once, whatever the sizes and limits"""
+        rnd = random.Random(0)
+        for _ in range(100):
+            chunks = [chunk(content_len=rnd.randint(0, 5000), dim=rnd.choice([4, 1024])) for _ in range(rnd.randint(0, 50))]
+            sizing = AdaptiveBulkSize(rnd.randint(1, 16), 64, rnd.randint(1, 50000), 1.0)
+            bounds = [0]
+            while bounds[-1] < len(chunks):
+                bounds.append(sizing.batch_end(chunks, bounds[-1]))
+                assert 0 < bounds[-1] - bounds[-2] <= sizing.size
+                sizing.record(bounds[-1] - bounds[-2], rnd.uniform(0, 2))
+            assert bounds[-1] == len(chunks)
+
+
+class TestEstimateChunkBytes:
+
+    def test_close_to_json_size(self):
+        """The estimate is within a factor of two of the JSON size of the chunk"""
+        for c in [chunk(), chunk(content_len=5000), chunk(dim=1024)]:
+            size = len(json.dumps(c))
+            assert size / 2 <= estimate_chunk_bytes(c) <= size * 2
+
+
+class TestGetBulkSize:
+
+    def test_shared_by_index(self, monkeypatch):
+        """Inserts into the same index share one sizing"""
+        monkeypatch.setattr(bulk_insert, "_BULK_SIZES", {})
+        a = get_bulk_size("idx1", 4, 64, 1 << 20, 1.0)
+        a.record(4, 0.1)
+        assert get_bulk_size("idx1", 4, 64, 1 << 20, 1.0) is a
+        assert get_bulk_size("idx1", 4, 64, 1 << 20, 1.0).size == 8
+        assert get_bulk_size("idx2", 4, 64, 1 << 20, 1.0).size == 4
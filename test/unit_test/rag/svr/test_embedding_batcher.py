@@ -0,0 +1,201 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+
+import numpy as np
+import pytest
+import trio
+import trio.testing
+
+from rag.svr import embedding_batcher
+from rag.svr.embedding_batcher import EmbeddingBatcher, embedding_batcher_stats, get_embedding_batcher
+
+
+class FakeModel:
+    """Embeds "t<i>" as [i], and counts one token per character."""
+
+    def __init__(self, tenant_id="tenant", llm_name="bge", api_key="key", fail_on=None):
+        self.tenant_id = tenant_id
+        self.llm_name = llm_name
+        self.model_config = {"llm_factory": "BAAI", "api_key": api_key, "api_base": ""}
+        self.fail_on = fail_on
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def encode(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+        if self.fail_on in texts:
+            raise ValueError("embedding service error")
+        return np.array([[float(t[1:])] for t in texts]), sum(len(t) for t in texts)
+
+
+def texts(start, n):
+    return [f"t{i}" for i in range(start, start + n)]
+
+
+def run_concurrently(batcher, requests, results):
+    async def encode(i, txts):
+        try:
+            results[i] = await batcher.encode(txts)
+        except Exception as e:
+            results[i] = e
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            for i, txts in enumerate(requests):
+                nursery.start_soon(encode, i, txts)
+
+    trio.run(main)
+
+
+class TestEmbeddingBatcher:
+
+    def test_coalesces_requests(self):
+        """Concurrent requests share full batches, and each gets its own vectors in order"""
+        mdl = FakeModel()
+        batcher = EmbeddingBatcher(mdl, batch_size=8, max_wait=0.05)
+        requests = [texts(0, 3), texts(3, 3), texts(6, 3), texts(9, 7)]
+        results = {}
+        run_concurrently(batcher, requests, results)
+        for i, txts in enumerate(requests):
+            vectors, _ = results[i]
+            assert vectors[:, 0].tolist() == [float(t[1:]) for t in txts]
+        assert sorted(t for batch in mdl.batches for t in batch) == sorted(t for r in requests for t in r)
+        assert [len(b) for b in mdl.batches] == [8, 8]
+        assert batcher.stats()["batches"] == 2 and batcher.stats()["fill_ratio"] == 1.0
+
+    def test_token_counts(self):
+        """The tokens of a batch are shared out by text length"""
+        mdl = FakeModel()
+        batcher = EmbeddingBatcher(mdl, batch_size=64, max_wait=0.05)
+        requests = [["t1", "t2"], ["t100", "t200", "t300"]]
+        results = {}
+        run_concurrently(batcher, requests, results)
+        assert results[0][1] == 4
+        assert results[1][1] == 12
+
+    def test_large_request_split(self):
+        """A request larger than a batch is split across batches"""
+        mdl = FakeModel()
+        batcher = EmbeddingBatcher(mdl, batch_size=4, max_wait=0.05)
+        vectors, token_count = trio.run(batcher.encode, texts(0, 10))
+        assert vectors[:, 0].tolist() == list(range(10))
+        assert [len(b) for b in mdl.batches] == [4, 4, 2]
+        assert token_count == sum(len(t) for t in texts(0, 10))
+
+    def test_partial_batch_after_max_wait(self):
+        """A batch which is not filled is sent once its oldest request waited max_wait"""
+        mdl = FakeModel()
+        batcher = EmbeddingBatcher(mdl, batch_size=64, max_wait=0.2)
+
+        async def main():
+            start = trio.current_time()
+            vectors, _ = await batcher.encode(["t7"])
+            return vectors, trio.current_time() - start
+
+        vectors, waited = trio.run(main)
+        assert vectors.tolist() == [[7.0]]
+        assert 0.2 <= waited < 2
+
+    def test_queue_latency(self):
+        """The average queue latency is the mean wait of the requests, whatever number of batches they fill"""
+        mdl = FakeModel()
+        batcher = EmbeddingBatcher(mdl, batch_size=64, max_wait=0.2)
+
+        async def encode(delay, txts):
+            await trio.sleep(delay)
+            await batcher.encode(txts)
+
+        async def main():
+            async with trio.open_nursery() as nursery:
+                for delay, txts in [(0.0, ["t1"]), (0.05, ["t2"]), (0.15, ["t3"])]:
+                    nursery.start_soon(encode, delay, txts)
+
+        trio.run(main, clock=trio.testing.MockClock(autojump_threshold=0))
+        stats = batcher.stats()
+        assert stats["batches"] == 1
+        assert stats["queue_latency_max"] == pytest.approx(0.2, abs=1e-4)
+        assert stats["queue_latency_avg"] == pytest.approx((0.2 + 0.15 + 0.05) / 3, abs=1e-4)
+        assert stats["queue_latency_avg"] <= stats["queue_latency_max"]
+
+    def test_failed_batch(self):
+        """An error fails the requests of its batch only"""
+        mdl = FakeModel(fail_on="t1")
+        batcher = EmbeddingBatcher(mdl, batch_size=4, max_wait=0.05)
+        requests = [texts(0, 2), texts(2, 2), texts(4, 4)]
+        results = {}
+        run_concurrently(batcher, requests, results)
+        assert isinstance(results[0], ValueError) and isinstance(results[1], ValueError)
+        assert results[2][0][:, 0].tolist() == [4, 5, 6, 7]
+        assert batcher.stats()["pending"] == 0
+
+    def test_cancelled_driver(self):
+        """When the caller sending the batches is cancelled, another waiting caller takes over"""
+        mdl = FakeModel()
+        batcher = EmbeddingBatcher(mdl, batch_size=64, max_wait=0.3)
+        results = {}
+
+        async def main():
+            async with trio.open_nursery() as nursery:
+                with trio.move_on_after(0.05):
+                    async with trio.open_nursery() as inner:
+                        inner.start_soon(batcher.encode, ["t1"])
+                        await trio.sleep(0.01)
+
+                        async def second():
+                            results["second"] = await batcher.encode(["t2"])
+
+                        nursery.start_soon(second)
+                        await trio.sleep_forever()
+
+        trio.run(main)
+        assert results["second"][0].tolist() == [[2.0]]
+
+    def test_empty(self):
+        """No texts, no request"""
+        mdl = FakeModel()
+        vectors, token_count = trio.run(EmbeddingBatcher(mdl, 8, 0.05).encode, [])
+        assert len(vectors) == 0 and token_count == 0 and mdl.batches == []
+
+
+class TestGetEmbeddingBatcher:
+
+    @pytest.fixture(autouse=True)
+    def batchers(self, monkeypatch):
+        monkeypatch.setattr(embedding_batcher, "_BATCHERS", {})
+
+    def test_shared_by_tenant_and_model(self):
+        """Tasks of the same tenant, model and model config share a batcher"""
+        a = get_embedding_batcher(FakeModel(), 8, 0.05)
+        assert get_embedding_batcher(FakeModel(), 8, 0.05) is a
+        assert get_embedding_batcher(FakeModel(tenant_id="other"), 8, 0.05) is not a
+        assert get_embedding_batcher(FakeModel(llm_name="other"), 8, 0.05) is not a
+
+    def test_new_model_config(self):
+        """A tenant changing the API key of its model gets a new batcher"""
+        a = get_embedding_batcher(FakeModel(api_key="old"), 8, 0.05)
+        b = get_embedding_batcher(FakeModel(api_key="new"), 8, 0.05)
+        assert b is not a and b.mdl.model_config["api_key"] == "new"
+
+    def test_idle_batchers_dropped(self, monkeypatch):
+        """Batchers idle for IDLE_TTL are dropped"""
+        a = get_embedding_batcher(FakeModel(api_key="old"), 8, 0.05)
+        a.last_used -= embedding_batcher.IDLE_TTL
+        get_embedding_batcher(FakeModel(api_key="new"), 8, 0.05)
+        assert a not in embedding_batcher._BATCHERS.values()
+        assert len(embedding_batcher_stats()) == 1
@@ -0,0 +1,202 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+
+import numpy as np
+import pytest
+
+from rag.svr import embedding_cache
+from rag.svr.embedding_cache import (DiskEmbeddingCache, EmbeddingCache, RedisEmbeddingCache, embedding_model_key,
+                                     init_embedding_cache)
+
+DIM = 4
+# EB1 header, dtype code and dimension, then DIM float32.
+ENTRY_BYTES = 8 + 4 * DIM
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+        self.expiries = {}
+
+    def mget(self, keys, binary=False):
+        return [self.store.get(k) for k in keys]
+
+    def set_many(self, mapping, exp=3600):
+        self.store.update(mapping)
+        self.expiries.update({k: exp for k in mapping})
+        return True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+class Model:
+    def __init__(self, tenant_id, llm_name):
+        self.tenant_id = tenant_id
+        self.llm_name = llm_name
+
+
+def vectors(rnd, n):
+    return [np.array([rnd.uniform(-1, 1) for _ in range(DIM)]) for _ in range(n)]
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(embedding_cache, "REDIS_CONN", fake)
+    return fake
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(embedding_cache, "time", fake)
+    return fake
+
+
+@pytest.fixture(params=["redis", "disk"])
+def backend(request, redis, tmp_path):
+    if request.param == "redis":
+        return RedisEmbeddingCache(3600)
+    return DiskEmbeddingCache(str(tmp_path / "cache" / "embedding_cache.db"), 1024 * 1024)
+
+
+class TestBackends:
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_round_trip(self, backend, seed):
+        """Vectors are read back as the float32 values written, in the order of the texts, None for misses"""
+        rnd = random.Random(seed)
+        txts = [f"chunk {i} " + "x" * rnd.randint(0, 50) for i in range(rnd.randint(1, 30))]
+        vts = vectors(rnd, len(txts))
+        backend.set_many("tenant:bge", txts, vts)
+        queried = rnd.sample(txts, len(txts)) + ["not cached"]
+        got = backend.get_many("tenant:bge", queried)
+        assert got[-1] is None
+        for txt, v in zip(queried[:-1], got[:-1]):
+            assert v.dtype == np.float32
+            assert v.tolist() == vts[txts.index(txt)].astype(np.float32).tolist()
+
+    def test_overwrite(self, backend):
+        """Setting a text again replaces its vector"""
+        backend.set_many("tenant:bge", ["a"], [np.ones(DIM)])
+        backend.set_many("tenant:bge", ["a"], [np.zeros(DIM)])
+        assert backend.get_many("tenant:bge", ["a"])[0].tolist() == [0.0] * DIM
+
+    def test_scoped_by_tenant_and_model(self, backend):
+        """The same text embedded for another tenant or by another model is not a hit"""
+        keys = [embedding_model_key(Model(t, m)) for t, m in [("t1", "bge"), ("t2", "bge"), ("t1", "e5")]]
+        assert len(set(keys)) == 3
+        backend.set_many(keys[0], ["same text"], [np.ones(DIM)])
+        assert backend.get_many(keys[1], ["same text"]) == [None]
+        assert backend.get_many(keys[2], ["same text"]) == [None]
+        backend.set_many(keys[1], ["same text"], [np.zeros(DIM)])
+        assert backend.get_many(keys[0], ["same text"])[0].tolist() == [1.0] * DIM
+        assert backend.get_many(keys[1], ["same text"])[0].tolist() == [0.0] * DIM
+
+    def test_redis_expiry(self, redis):
+        """Redis entries expire after the configured TTL"""
+        RedisEmbeddingCache(7 * 24 * 3600).set_many("tenant:bge", ["a", "b"], vectors(random.Random(0), 2))
+        assert list(redis.expiries.values()) == [7 * 24 * 3600] * 2
+
+
+class TestDiskEmbeddingCache:
+
+    def stored_bytes(self, cache):
+        return cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embedding").fetchone()[0]
+
+    def test_size_accounting(self, tmp_path):
+        """The size of the cache follows inserts and overwrites, and is read back on reopening"""
+        path = str(tmp_path / "embedding_cache.db")
+        cache = DiskEmbeddingCache(path, 1024 * 1024)
+        cache.set_many("tenant:bge", ["a", "b", "c"], vectors(random.Random(0), 3))
+        cache.set_many("tenant:bge", ["a"], vectors(random.Random(1), 1))
+        assert cache._size == self.stored_bytes(cache) == 3 * ENTRY_BYTES
+        assert DiskEmbeddingCache(path, 1024 * 1024)._size == 3 * ENTRY_BYTES
+
+    def test_evicts_least_recently_used(self, tmp_path, clock):
+        """Going over the cap evicts the least recently read or written entries"""
+        cache = DiskEmbeddingCache(str(tmp_path / "embedding_cache.db"), 10 * ENTRY_BYTES)
+        rnd = random.Random(0)
+        for i in range(10):
+            cache.set_many("tenant:bge", [f"t{i}"], vectors(rnd, 1))
+        assert cache.get_many("tenant:bge", ["t0"])[0] is not None
+        cache.set_many("tenant:bge", ["t10"], vectors(rnd, 1))
+
+        cached = [t for t, v in zip([f"t{i}" for i in range(11)],
+                                    cache.get_many("tenant:bge", [f"t{i}" for i in range(11)])) if v is not None]
+        # Down to 90% of the cap: t1 and t2 were the least recently used, t0 was read since it was written.
+        assert cached == ["t0"] + [f"t{i}" for i in range(3, 11)]
+        assert cache._size == self.stored_bytes(cache) <= cache.max_bytes * 0.9
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_stays_under_cap(self, tmp_path, clock, seed):
+        """Whatever is written and read, the stored total never exceeds the cap and the newest entries stay"""
+        rnd = random.Random(seed)
+        cache = DiskEmbeddingCache(str(tmp_path / "embedding_cache.db"), rnd.randint(5, 40) * ENTRY_BYTES)
+        written = []
+        for _ in range(60):
+            if written and rnd.random() < 0.3:
+                cache.get_many("tenant:bge", rnd.sample(written, min(len(written), 3)))
+                continue
+            txts = [f"t{rnd.randint(0, 200)}" for _ in range(rnd.randint(1, 4))]
+            cache.set_many("tenant:bge", txts, vectors(rnd, len(txts)))
+            written.extend(txts)
+            assert cache._size == self.stored_bytes(cache) <= cache.max_bytes
+            assert all(v is not None for v in cache.get_many("tenant:bge", txts))
+
+
+class FailingBackend:
+    def get_many(self, model_key, txts):
+        raise ConnectionError("cache is down")
+
+    def set_many(self, model_key, txts, vectors):
+        raise ConnectionError("cache is down")
+
+
+class TestEmbeddingCache:
+
+    def test_hits_and_misses(self, redis):
+        """Hits and misses are counted per text"""
+        cache = EmbeddingCache(RedisEmbeddingCache(3600))
+        cache.set_many("tenant:bge", ["a", "b"], vectors(random.Random(0), 2))
+        cache.get_many("tenant:bge", ["a", "b", "c"])
+        cache.get_many("tenant:bge", ["d"])
+        assert cache.stats() == {"hits": 2, "misses": 2, "hit_ratio": 0.5}
+
+    def test_errors_are_misses(self):
+        """A failing backend neither fails the task nor returns vectors"""
+        cache = EmbeddingCache(FailingBackend())
+        cache.set_many("tenant:bge", ["a"], vectors(random.Random(0), 1))
+        assert cache.get_many("tenant:bge", ["a", "b"]) == [None, None]
+        assert cache.stats()["misses"] == 2
+
+    def test_init(self, tmp_path, monkeypatch):
+        """The backend is chosen by EMBEDDING_CACHE, none by default"""
+        monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache.db"))
+        monkeypatch.delenv("EMBEDDING_CACHE", raising=False)
+        assert init_embedding_cache() is None
+        assert init_embedding_cache("unknown") is None
+        assert isinstance(init_embedding_cache("redis").backend, RedisEmbeddingCache)
+        assert isinstance(init_embedding_cache("disk").backend, DiskEmbeddingCache)
@@ -0,0 +1,228 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+import threading
+
+import pytest
+import trio
+
+from api.db.services.task_service import inherit_prev_task_chunks
+from common.constants import CHUNK_DIGEST_FLD
+from rag.svr import incremental_chunks
+from rag.svr.incremental_chunks import chunk_digest, reconcile_chunks, set_chunk_digests
+
+
+class FakeDocStore:
+    """Chunks of one document, as chunk id -> digest."""
+
+    def __init__(self, chunks=None, fail_search=False):
+        self.chunks = dict(chunks or {})
+        self.fail_search = fail_search
+        self.deleted = []
+        self.aio = self
+
+    async def search(self, select_fields, highlight_fields, condition, match_expressions, order_by, offset, limit,
+                     index_names, knowledgebase_ids):
+        await trio.lowlevel.checkpoint()
+        if self.fail_search:
+            raise ConnectionError("doc store is down")
+        digests = set(condition[CHUNK_DIGEST_FLD])
+        return {chunk_id: {CHUNK_DIGEST_FLD: [d]} for chunk_id, d in self.chunks.items() if d in digests}
+
+    def get_fields(self, res, fields):
+        return res
+
+    async def delete(self, condition, index_name, knowledgebase_id):
+        await trio.lowlevel.checkpoint()
+        for chunk_id in condition["id"]:
+            self.deleted.append(chunk_id)
+            self.chunks.pop(chunk_id, None)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.sets = {}
+        self.down = False
+        self.aio = self
+
+    async def sadd(self, key, *members):
+        await trio.lowlevel.checkpoint()
+        if self.down:
+            return False
+        self.sets.setdefault(key, set()).update(members)
+        return True
+
+    async def expire(self, key, exp):
+        await trio.lowlevel.checkpoint()
+        return not self.down
+
+    async def smismember(self, key, members):
+        await trio.lowlevel.checkpoint()
+        if self.down:
+            return None
+        return [m in self.sets.get(key, set()) for m in members]
+
+
+class FakeLock:
+    locks = {}
+
+    def __init__(self, lock_key, timeout=10, blocking_timeout=1):
+        self.lock = FakeLock.locks.setdefault(lock_key, threading.Lock())
+
+    def acquire(self):
+        return self.lock.acquire(timeout=1)
+
+    def release(self):
+        self.lock.release()
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(incremental_chunks, "REDIS_CONN", fake)
+    monkeypatch.setattr(incremental_chunks, "RedisDistributedLock", FakeLock)
+    return fake
+
+
+@pytest.fixture
+def doc_store(monkeypatch):
+    store = FakeDocStore()
+    monkeypatch.setattr(incremental_chunks.settings, "docStoreConn", store, raising=False)
+    return store
+
+
+def task(task_id="task", doc_id="doc"):
+    return {"id": task_id, "doc_id": doc_id, "kb_id": "kb", "tenant_id": "tenant"}
+
+
+def chunk(chunk_id, digest):
+    return {"id": chunk_id, CHUNK_DIGEST_FLD: digest}
+
+
+class TestChunkDigest:
+
+    def test_ignores_volatile_fields_and_vectors(self):
+        """Build times, the digest itself and vectors do not change the digest"""
+        d = {"id": "c", "content_with_weight": "text", "create_time": "2025-01-01", "create_timestamp_flt": 1.0,
+             "q_1024_vec": [0.1], CHUNK_DIGEST_FLD: "old"}
+        e = {"q_1024_vec": [0.2], "create_timestamp_flt": 2.0, "content_with_weight": "text", "id": "c"}
+        assert chunk_digest(d, "bge\n0.1") == chunk_digest(e, "bge\n0.1")
+
+    def test_changes_with_fields_and_vector_inputs(self):
+        """Any other field, or what the vector is computed from, changes the digest"""
+        d = {"id": "c", "content_with_weight": "text", "important_kwd": ["a"]}
+        digest = chunk_digest(d, "bge\n0.1")
+        assert chunk_digest({**d, "important_kwd": ["b"]}, "bge\n0.1") != digest
+        assert chunk_digest({**d, "content_with_weight": "text2"}, "bge\n0.1") != digest
+        assert chunk_digest(d, "bge\n0.2") != digest
+        assert chunk_digest(d, "other\n0.1") != digest
+
+    def test_set_chunk_digests(self):
+        """Every chunk gets the digest of its fields and of the embedding model and title weight"""
+        chunks = [{"id": "a", "content_with_weight": "x"}, {"id": "b", "content_with_weight": "y"}]
+        set_chunk_digests(chunks, "bge", 0.1)
+        assert [d[CHUNK_DIGEST_FLD] for d in chunks] == [chunk_digest(d, "bge\n0.1") for d in chunks]
+        digests = [d[CHUNK_DIGEST_FLD] for d in chunks]
+        set_chunk_digests(chunks, "bge", 0.1)
+        assert [d[CHUNK_DIGEST_FLD] for d in chunks] == digests
+
+
+class TestReconcileChunks:
+
+    def test_keep_index_delete(self, redis, doc_store):
+        """Unchanged inherited chunks are kept, changed and new ones indexed, and those no longer built deleted"""
+        doc_store.chunks = {"same": "d1", "changed": "d2", "gone": "d3"}
+        chunks = [chunk("same", "d1"), chunk("changed", "d2_new"), chunk("new", "d4")]
+        kept, deleted = trio.run(reconcile_chunks, task(), chunks, ["same", "changed", "gone"])
+        assert kept == ["same"]
+        assert deleted == 1 and doc_store.deleted == ["gone"]
+        assert redis.sets["doc_built_chunks:doc"] == {"same", "changed", "new"}
+
+    def test_not_inherited(self, redis, doc_store):
+        """A chunk stored with the same digest but not inherited is indexed again"""
+        doc_store.chunks = {"a": "d1"}
+        kept, deleted = trio.run(reconcile_chunks, task(), [chunk("a", "d1")], [])
+        assert kept == [] and deleted == 0
+
+    def test_built_by_another_task(self, redis, doc_store):
+        """A chunk moved to the pages of another task is not deleted"""
+        doc_store.chunks = {"moved": "d1", "gone": "d2"}
+        trio.run(reconcile_chunks, task("other"), [chunk("moved", "d1")], [])
+        kept, deleted = trio.run(reconcile_chunks, task(), [], ["moved", "gone"])
+        assert kept == [] and deleted == 1 and doc_store.deleted == ["gone"]
+        assert "moved" in doc_store.chunks
+
+    def test_lookup_failure(self, redis, doc_store):
+        """When the digests cannot be looked up, every chunk is indexed again"""
+        doc_store.chunks = {"same": "d1", "gone": "d2"}
+        doc_store.fail_search = True
+        kept, deleted = trio.run(reconcile_chunks, task(), [chunk("same", "d1")], ["same", "gone"])
+        assert kept == [] and deleted == 1
+
+    def test_redis_failure(self, redis, doc_store):
+        """Without the set of built chunks nothing is deleted"""
+        doc_store.chunks = {"gone": "d1"}
+        redis.down = True
+        with pytest.raises(Exception, match="Redis"):
+            trio.run(reconcile_chunks, task(), [], ["gone"])
+        assert doc_store.chunks == {"gone": "d1"}
+
+    @pytest.mark.parametrize("seed", range(30))
+    def test_reparse_leaves_built_chunks(self, redis, doc_store, seed):
+        """Whatever pages chunks move between and in whatever order tasks run, a re-parse leaves exactly the
+        chunks built, each indexed with its digest"""
+        rnd = random.Random(seed)
+        n_tasks = rnd.randint(1, 5)
+        ids = [f"c{i}" for i in range(40)]
+        stored_digest = {i: f"{i}:v1" for i in ids}
+        built_digest = {i: f"{i}:v2" if rnd.random() < 0.3 else f"{i}:v1" for i in ids}
+
+        # The previous parse, a chunk being listed by two of its tasks now and then.
+        prev_tasks = [{"id": f"prev{t}", "from_page": t * 10, "to_page": t * 10 + 10, "progress": 1.0, "chunk_ids": ""}
+                      for t in range(n_tasks)]
+        prev_ids = rnd.sample(ids, 25)
+        for chunk_id in prev_ids:
+            for prev_task in rnd.sample(prev_tasks, 2 if len(prev_tasks) > 1 and rnd.random() < 0.1 else 1):
+                prev_task["chunk_ids"] = (prev_task["chunk_ids"] + " " + chunk_id).strip()
+        doc_store.chunks = {i: stored_digest[i] for i in prev_ids}
+
+        tasks = [{"id": f"task{t}", "doc_id": "doc", "kb_id": "kb", "tenant_id": "tenant", "from_page": t * 10,
+                  "to_page": t * 10 + 10, "progress": 0.0} for t in range(n_tasks)]
+        inherit_prev_task_chunks(tasks, prev_tasks)
+        # queue_tasks deletes what was not handed over.
+        for prev_task in prev_tasks:
+            for chunk_id in prev_task["chunk_ids"].split():
+                doc_store.chunks.pop(chunk_id, None)
+
+        built = {t["id"]: [chunk(i, built_digest[i]) for i in rnd.sample(ids, rnd.randint(0, 15))] for t in tasks}
+
+        async def run_task(t):
+            await trio.sleep(rnd.random() / 100)
+            kept, _ = await reconcile_chunks(t, built[t["id"]], (t.get("chunk_ids") or "").split())
+            for d in built[t["id"]]:
+                if d["id"] in kept:
+                    assert doc_store.chunks[d["id"]] == d[CHUNK_DIGEST_FLD]
+                else:
+                    doc_store.chunks[d["id"]] = d[CHUNK_DIGEST_FLD]
+
+        async def main():
+            async with trio.open_nursery() as nursery:
+                for t in rnd.sample(tasks, len(tasks)):
+                    nursery.start_soon(run_task, t)
+
+        trio.run(main)
+        assert doc_store.chunks == {d["id"]: d[CHUNK_DIGEST_FLD] for chunks in built.values() for d in chunks}
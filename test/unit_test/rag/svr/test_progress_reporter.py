@@ -0,0 +1,167 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+import time
+
+from rag.svr.progress_reporter import ProgressReporter, ProgressReporters
+
+
+class Recorder:
+    def __init__(self, canceled=False):
+        self.writes = []
+        self.cancel_checks = 0
+        self.is_canceled_value = canceled
+
+    def write(self, task_id, info):
+        self.writes.append((task_id, info))
+
+    def is_canceled(self, task_id):
+        self.cancel_checks += 1
+        return self.is_canceled_value
+
+
+def reporter(recorder, flush_interval=3600., flush_messages=100, cancel_check_interval=3600.):
+    return ProgressReporter("task", recorder.write, recorder.is_canceled, flush_interval, flush_messages,
+                            cancel_check_interval)
+
+
+class TestProgressReporter:
+
+    def test_first_report_written(self):
+        """The first report, after a quiet period, is written at once"""
+        rec = Recorder()
+        reporter(rec).report(0.1, "Page(1~12): OCR started")
+        assert rec.writes == [("task", {"progress_msg": "Page(1~12): OCR started", "progress": 0.1})]
+
+    def test_reports_coalesced(self):
+        """Reports within flush_interval are written together, with the highest progress"""
+        rec = Recorder()
+        r = reporter(rec)
+        r.report(0.1, "a")
+        r.report(0.3, "b")
+        r.report(0.2, "c")
+        r.report(msg="d")
+        assert len(rec.writes) == 1
+        r.flush()
+        assert rec.writes[1] == ("task", {"progress_msg": "b\nc\nd", "progress": 0.3})
+        r.flush()
+        assert len(rec.writes) == 2
+        assert r.stats() == {"reports": 4, "writes": 2, "cancel_checks": 0}
+
+    def test_final_and_error_written_at_once(self):
+        """Final progress and errors are written at once, after the messages before them"""
+        rec = Recorder()
+        r = reporter(rec)
+        r.report(0.1, "start")
+        r.report(0.5, "embedding")
+        r.report(1.0, "done")
+        assert rec.writes[-1] == ("task", {"progress_msg": "embedding\ndone", "progress": 1.0})
+        r.report(0.6, "more")
+        r.report(-1, "error")
+        assert rec.writes[-1] == ("task", {"progress_msg": "more\nerror", "progress": -1})
+
+    def test_flush_messages(self):
+        """A buffer of flush_messages messages is written"""
+        rec = Recorder()
+        r = reporter(rec, flush_messages=3)
+        r.report(msg="0")
+        for i in range(1, 7):
+            r.report(msg=str(i))
+        assert [info["progress_msg"] for _, info in rec.writes] == ["0", "1\n2\n3", "4\n5\n6"]
+
+    def test_flush_interval(self):
+        """A report after flush_interval is written"""
+        rec = Recorder()
+        r = reporter(rec, flush_interval=0.5)
+        r.report(0.1, "a")
+        r.report(0.2, "b")
+        assert len(rec.writes) == 1 and not r.due()
+        time.sleep(0.55)
+        assert r.due()
+        r.report(0.3, "c")
+        assert rec.writes[-1] == ("task", {"progress_msg": "b\nc", "progress": 0.3})
+
+    def test_cancel_check_cached(self):
+        """Cancellation is checked at most once per cancel_check_interval unless refreshed"""
+        rec = Recorder()
+        r = reporter(rec)
+        assert not r.canceled()
+        rec.is_canceled_value = True
+        assert not r.canceled()
+        assert rec.cancel_checks == 1
+        assert r.canceled(refresh=True)
+        assert rec.cancel_checks == 2
+
+    def test_cancel_sticks(self):
+        """A canceled task stays canceled without checking again"""
+        rec = Recorder(canceled=True)
+        r = reporter(rec, cancel_check_interval=0.)
+        assert r.canceled()
+        rec.is_canceled_value = False
+        assert r.canceled() and r.canceled(refresh=True)
+        assert rec.cancel_checks == 1
+
+    def test_concurrent_reports(self):
+        """Reports from several threads are all written, in order per thread"""
+        rec = Recorder()
+        r = reporter(rec, flush_interval=0., flush_messages=7)
+
+        def work(t):
+            for i in range(200):
+                r.report(msg=f"{t}:{i}")
+
+        threads = [threading.Thread(target=work, args=(t,)) for t in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        r.flush()
+        messages = [m for _, info in rec.writes for m in info["progress_msg"].split("\n")]
+        assert len(messages) == 800
+        for t in range(4):
+            assert [m for m in messages if m.startswith(f"{t}:")] == [f"{t}:{i}" for i in range(200)]
+
+
+class TestProgressReporters:
+
+    def test_background_flush(self):
+        """Buffered reports are written by the flusher thread after flush_interval"""
+        rec = Recorder()
+        reporters = ProgressReporters(rec.write, rec.is_canceled, 0.05, 100, 3600.)
+        r = reporters.get("task")
+        assert reporters.get("task") is r
+        r.report(0.1, "a")
+        r.report(0.2, "b")
+        deadline = time.monotonic() + 2
+        while len(rec.writes) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert rec.writes == [("task", {"progress_msg": "a", "progress": 0.1}),
+                              ("task", {"progress_msg": "b", "progress": 0.2})]
+
+    def test_close(self):
+        """Closing a reporter writes its buffer and keeps its stats"""
+        rec = Recorder()
+        reporters = ProgressReporters(rec.write, rec.is_canceled, 3600., 100, 3600.)
+        r = reporters.get("task")
+        r.report(0.1, "a")
+        r.report(0.2, "b")
+        r.canceled()
+        reporters.close("task")
+        reporters.close("task")
+        assert rec.writes[-1] == ("task", {"progress_msg": "b", "progress": 0.2})
+        assert reporters.stats() == {"reports": 2, "writes": 2, "cancel_checks": 1}
+        assert reporters.get("task") is not r
@@ -0,0 +1,188 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from rag.utils import es_conn
+from rag.utils.doc_store_conn import ChunkFields, OrderByExpr
+
+FIELDS = ["id", "_score", "content_with_weight", "docnm_kwd", "important_kwd", "page_num_int", "available_int",
+          "weight_flt", "q_4_vec"]
+
+
+def es_connection():
+    """An ESConnection which is not connected, its class being wrapped by @singleton."""
+    cls = next(c.cell_contents for c in es_conn.ESConnection.__closure__ if isinstance(c.cell_contents, type))
+    return cls.__new__(cls)
+
+
+class FakeES:
+    def __init__(self, res):
+        self.res = res
+        self.calls = []
+
+    def search(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.res
+
+
+def legacy_get_fields(res, fields):
+    """ESConnection.get_fields before chunk fields were stored by column."""
+    res_fields = {}
+    if not fields:
+        return {}
+    for d in res["hits"]["hits"]:
+        d["_source"]["id"] = d["_id"]
+        d["_source"]["_score"] = d["_score"]
+        d = d["_source"]
+        m = {n: d.get(n) for n in fields if d.get(n) is not None}
+        for n, v in m.items():
+            if isinstance(v, list):
+                continue
+            if n == "available_int" and isinstance(v, (int, float)):
+                continue
+            if not isinstance(v, str):
+                m[n] = str(m[n])
+        if m:
+            res_fields[d["id"]] = m
+    return res_fields
+
+
+def random_vector(rnd):
+    v = [round(rnd.uniform(-1, 1), 4) for _ in range(4)]
+    return "\t".join(str(x) for x in v) if rnd.random() < 0.3 else v
+
+
+def random_response(rnd):
+    values = {
+        "content_with_weight": lambda: rnd.choice(["text", "", "长文本"]),
+        "docnm_kwd": lambda: rnd.choice(["a.pdf", "b.docx"]),
+        "important_kwd": lambda: rnd.sample(["k1", "k2", "k3"], rnd.randint(0, 3)),
+        "page_num_int": lambda: [rnd.randint(1, 9)] if rnd.random() < 0.5 else rnd.randint(1, 9),
+        "available_int": lambda: rnd.choice([0, 1, 1.0]),
+        "weight_flt": lambda: rnd.random(),
+        "q_4_vec": lambda: random_vector(rnd),
+    }
+    hits = []
+    for i in range(rnd.randint(0, 20)):
+        src = {n: f() for n, f in values.items() if rnd.random() < 0.7}
+        hits.append({"_id": f"chunk{i}", "_score": round(rnd.uniform(0, 10), 3), "_source": src})
+    return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+
+class TestSearchProjection:
+
+    @pytest.mark.parametrize("select_fields, source", [
+        (["content_with_weight", "docnm_kwd", "content_with_weight"], ["content_with_weight", "docnm_kwd"]),
+        (["id", "q_1024_vec"], ["id", "q_1024_vec"]),
+        ([], True),
+    ])
+    def test_source_follows_select_fields(self, select_fields, source):
+        """Only the selected fields are fetched, every field when none is selected"""
+        conn = es_connection()
+        conn.es = FakeES({"hits": {"total": {"value": 0}, "hits": []}})
+        conn.search(select_fields, [], {}, [], OrderByExpr(), 0, 10, "ragflow_tenant", ["kb"])
+        assert conn.es.calls[0]["_source"] == source
+
+
+class TestGetFields:
+
+    @pytest.mark.parametrize("seed", range(30))
+    def test_same_as_legacy(self, seed):
+        """get_fields reads as the dict of chunk id to fields it returned before"""
+        rnd = random.Random(seed)
+        res = random_response(rnd)
+        fields = rnd.sample(FIELDS, rnd.randint(1, len(FIELDS))) + ["not_a_field"]
+        expected = legacy_get_fields(copy.deepcopy(res), fields)
+        got = es_connection().get_fields(res, fields)
+        assert isinstance(got, ChunkFields)
+        assert list(got) == list(expected) and got.ids == list(expected)
+        assert len(got) == len(expected)
+        assert {chunk_id: got[chunk_id] for chunk_id in got} == expected
+        assert dict(got.items()) == expected
+
+    def test_no_fields(self):
+        """No fields, no chunks"""
+        res = random_response(random.Random(0))
+        assert es_connection().get_fields(res, []) == {}
+
+
+class TestChunkFields:
+
+    def fields(self):
+        return ChunkFields(["a", "b", "c"], {
+            "content_with_weight": ["x", None, "z"],
+            "q_3_vec": [[1, 2, 3], "4\t5\t6", None],
+        })
+
+    def test_mapping(self):
+        """Chunks are looked up by id, missing fields are left out, unknown ids raise KeyError"""
+        fields = self.fields()
+        assert fields["a"] == {"content_with_weight": "x", "q_3_vec": [1, 2, 3]}
+        assert fields["b"] == {"q_3_vec": "4\t5\t6"}
+        assert "content_with_weight" not in fields["b"] and fields["b"].get("content_with_weight") is None
+        assert fields["c"]["content_with_weight"] == "z"
+        assert "a" in fields and "d" not in fields
+        assert fields.get("d") is None
+        with pytest.raises(KeyError):
+            fields["d"]
+        assert fields.keys() == {"a", "b", "c"}
+
+    def test_row_dict_cached(self):
+        """The dict of a chunk is built once, so changes to it are kept like changes to the former dicts"""
+        fields = self.fields()
+        fields["a"]["extra"] = 1
+        assert fields["a"]["extra"] == 1
+
+    def test_vectors(self):
+        """Vector columns are stacked into float32, tab separated strings parsed, missing vectors zeros"""
+        mat = self.fields().vectors("q_3_vec", 3)
+        assert mat.dtype == np.float32 and mat.shape == (3, 3)
+        assert mat.tolist() == [[1, 2, 3], [4, 5, 6], [0, 0, 0]]
+
+    def test_vectors_by_ids(self):
+        """Rows follow the ids asked for, zeros for unknown ids"""
+        mat = self.fields().vectors("q_3_vec", 3, ["c", "a", "unknown", "b"])
+        assert mat.tolist() == [[0, 0, 0], [1, 2, 3], [0, 0, 0], [4, 5, 6]]
+
+    def test_vectors_of_lists(self):
+        """A column of vector lists is converted as is"""
+        fields = ChunkFields(["a", "b"], {"q_2_vec": [[0.5, 1.5], [2.5, 3.5]]})
+        assert fields.vectors("q_2_vec", 2).tolist() == [[0.5, 1.5], [2.5, 3.5]]
+
+    def test_missing_vector_column(self):
+        """Without the vector column, every vector is zeros"""
+        fields = ChunkFields(["a", "b"], {"content_with_weight": ["x", "y"]})
+        assert fields.vectors("q_2_vec", 2).tolist() == [[0, 0], [0, 0]]
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_vectors_from_response(self, seed):
+        """The matrix of a search response holds the vectors of its chunks, as lists or tab separated strings"""
+        rnd = random.Random(seed)
+        res = random_response(rnd)
+        fields = es_connection().get_fields(res, ["id", "q_4_vec"])
+        mat = fields.vectors("q_4_vec", 4)
+        for chunk_id, row in zip(fields.ids, mat):
+            v = fields[chunk_id].get("q_4_vec")
+            if v is None:
+                assert row.tolist() == [0.0] * 4
+            else:
+                v = [float(x) for x in v.split("\t")] if isinstance(v, str) else v
+                assert np.allclose(row, np.array(v, dtype=np.float32))
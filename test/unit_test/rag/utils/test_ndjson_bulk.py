@@ -0,0 +1,126 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import copy
+import json
+import random
+
+import numpy as np
+import pytest
+
+from rag.utils import ndjson_bulk
+
+
+def random_chunks(seed, n=20):
+    rnd = random.Random(seed)
+    chunks = []
+    for i in range(n):
+        d = {
+            "id": f"chunk{i}",
+            "doc_id": "doc",
+            "content_with_weight": "".join(rnd.choices("abc 中文\"\\\n\té", k=rnd.randint(0, 30))),
+            "important_kwd": rnd.choices(["k1", "k2", "关键"], k=rnd.randint(0, 3)),
+            "page_num_int": [rnd.randint(1, 9)],
+            "position_int": [[rnd.randint(0, 9) for _ in range(5)]],
+            "top_int": [rnd.randint(0, 99)],
+            "create_timestamp_flt": rnd.random() * 1e9,
+            "available_int": 1,
+            "q_8_vec": [rnd.uniform(-1, 1) for _ in range(8)],
+        }
+        if rnd.random() < 0.3:
+            d["kb_id"] = "stale_kb"
+        if rnd.random() < 0.3:
+            d["q_8_vec"] = np.array(d["q_8_vec"], dtype=np.float32)
+        if rnd.random() < 0.3:
+            d["weight_flt"] = np.float32(rnd.random())
+        chunks.append(d)
+    return chunks
+
+
+def legacy_operations(documents, index_name, kb_id):
+    # The operations ESConnection.insert built before, by deep-copying every chunk.
+    operations = []
+    for d in documents:
+        d_copy = copy.deepcopy(d)
+        d_copy["kb_id"] = kb_id
+        meta_id = d_copy.pop("id", "")
+        operations.append({"index": {"_index": index_name, "_id": meta_id}})
+        operations.append(d_copy)
+    return json.loads(json.dumps(operations, default=ndjson_bulk._default))
+
+
+def parse(body: bytes):
+    assert body.endswith(b"\n")
+    return [json.loads(line) for line in body.decode("utf-8").split("\n")[:-1]]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def serializer(request, monkeypatch):
+    if request.param == "orjson":
+        if ndjson_bulk.orjson is None:
+            pytest.skip("orjson is not installed")
+    else:
+        monkeypatch.setattr(ndjson_bulk, "dumps", ndjson_bulk._json_dumps)
+    return request.param
+
+
+class TestIndexBody:
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_same_as_deep_copies(self, serializer, seed):
+        """The body holds the operations of the deep-copied chunks, vectors within float32 precision"""
+        chunks = random_chunks(seed)
+        body = ndjson_bulk.index_body(chunks, "ragflow_tenant", {"kb_id": "kb"})
+        got, expected = parse(body), legacy_operations(chunks, "ragflow_tenant", "kb")
+        assert len(got) == len(expected)
+        for g, e in zip(got, expected):
+            assert g.keys() == e.keys()
+            for k in g:
+                if k == "q_8_vec" or k == "weight_flt":
+                    assert g[k] == pytest.approx(e[k], rel=1e-6)
+                else:
+                    assert g[k] == e[k]
+
+    def test_chunks_not_modified(self, serializer):
+        """Chunks are neither copied nor modified"""
+        chunks = random_chunks(0)
+        before = copy.deepcopy(chunks)
+        ndjson_bulk.index_body(chunks, "idx", {"kb_id": "kb"})
+        for c, b in zip(chunks, before):
+            assert c.keys() == b.keys()
+            assert all(np.array_equal(c[k], b[k]) if isinstance(c[k], np.ndarray) else c[k] == b[k] for k in c)
+
+    def test_overrides_replace_fields(self, serializer):
+        """An overridden field is written once, with the override"""
+        body = ndjson_bulk.index_body([{"id": "a", "kb_id": "old", "x": 1}], "idx", {"kb_id": "new"})
+        assert body.count(b'"kb_id"') == 1
+        assert parse(body) == [{"index": {"_index": "idx", "_id": "a"}}, {"x": 1, "kb_id": "new"}]
+
+    def test_only_id(self, serializer):
+        """A chunk with no other field than its id"""
+        assert parse(ndjson_bulk.index_body([{"id": "a"}], "idx")) == [{"index": {"_index": "idx", "_id": "a"}}, {}]
+
+    def test_lone_surrogate(self, serializer):
+        """Text with a lone surrogate is encoded as the json module does"""
+        body = ndjson_bulk.index_body([{"id": "a", "content_with_weight": "x\ud800y"}], "idx")
+        assert body.split(b"\n")[1] == b'{"content_with_weight":"x' + "\ud800".encode("utf-8", "surrogatepass") + b'y"}'
+
+    def test_requires_id(self):
+        """Chunks without an id, or with an _id, are rejected"""
+        with pytest.raises(AssertionError):
+            ndjson_bulk.index_body([{"x": 1}], "idx")
+        with pytest.raises(AssertionError):
+            ndjson_bulk.index_body([{"id": "a", "_id": "a"}], "idx")
@@ -0,0 +1,149 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import math
+import random
+
+import pytest
+
+from rag.utils import task_cost
+from rag.utils.task_cost import MAX_PAGES_FACTOR, cost_estimate, page_cost, pdf_page_features, split_by_cost
+
+
+def random_features(rnd, n):
+    # Mostly text pages, with runs of scanned pages and pages full of images.
+    features = []
+    while len(features) < n:
+        has_text = rnd.random() < 0.7
+        features.extend([(has_text, rnd.choice([0, 0, 0, 1, 3, 30]))] * rnd.randint(1, 6))
+    return features[:n]
+
+
+def optimal_max_cost(costs, n, max_pages):
+    """Least cost of the costliest of at most `n` ranges of at most `max_pages` pages, by dynamic programming."""
+    m = len(costs)
+    cum = [0.]
+    for c in costs:
+        cum.append(cum[-1] + c)
+    best = [0.] + [math.inf] * m
+    for _ in range(n):
+        nxt = [0.] + [math.inf] * m
+        for i in range(1, m + 1):
+            for j in range(max(0, i - max_pages), i):
+                nxt[i] = min(nxt[i], max(best[j], cum[i] - cum[j]))
+        best = nxt
+    return best[m]
+
+
+class TestSplitByCost:
+
+    @pytest.mark.parametrize("seed", range(40))
+    def test_optimal_split(self, seed):
+        """Ranges cover the pages in order, no more of them than page ranges, with the least costliest range"""
+        rnd = random.Random(seed)
+        features = random_features(rnd, rnd.randint(1, 80))
+        page_size = rnd.choice([1, 2, 4, 12])
+        from_page = rnd.randint(0, len(features) - 1)
+        to_page = rnd.randint(from_page + 1, len(features))
+        ranges = split_by_cost(features, from_page, to_page, page_size)
+
+        assert ranges[0][0] == from_page and ranges[-1][1] == to_page
+        assert all(s < e for s, e in ranges)
+        assert all(e == s for (_, e), (s, _) in zip(ranges, ranges[1:]))
+        n = math.ceil((to_page - from_page) / page_size)
+        assert len(ranges) <= n
+        assert all(e - s <= page_size * MAX_PAGES_FACTOR for s, e in ranges)
+
+        costs = [page_cost(*f) for f in features[from_page:to_page]]
+        max_cost = max(sum(costs[s - from_page:e - from_page]) for s, e in ranges)
+        assert max_cost <= optimal_max_cost(costs, n, page_size * MAX_PAGES_FACTOR) * (1 + 1e-6)
+
+    def test_scanned_pages_get_smaller_tasks(self):
+        """A run of scanned pages is cut into shorter ranges than text pages"""
+        features = [(True, 0)] * 40 + [(False, 0)] * 8
+        assert split_by_cost(features, 0, len(features), 12) == [(0, 42), (42, 44), (44, 46), (46, 48)]
+
+    def test_equal_costs(self):
+        """Pages of equal costs are cut as ranges of page_size pages are"""
+        assert split_by_cost([(True, 0)] * 100, 0, 100, 12) == [(s, min(s + 12, 100)) for s in range(0, 100, 12)]
+        assert split_by_cost([(False, 1)] * 30, 5, 29, 6) == [(5, 11), (11, 17), (17, 23), (23, 29)]
+
+    def test_single_and_empty(self):
+        """No more than one range of pages is one task, no pages no task"""
+        features = [(False, 3)] * 10
+        assert split_by_cost(features, 2, 10, 12) == [(2, 10)]
+        assert split_by_cost(features, 5, 5, 12) == []
+
+
+class TestCostEstimate:
+
+    def test_estimate(self):
+        """Counts of the pages of a range, and their cost; images per page are capped"""
+        features = [(True, 0), (False, 2), (True, 100), (False, 0)]
+        estimate = cost_estimate(features, 1, 3)
+        assert estimate == {"text_pages": 1, "scanned_pages": 1, "images": 2 + task_cost.MAX_PAGE_IMAGES,
+                            "estimated_duration": round(page_cost(False, 2) + page_cost(True, 100), 3)}
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set_obj(self, key, obj, exp):
+        self.store[key] = json.dumps(obj)
+        return True
+
+
+class TestPdfPageFeatures:
+
+    @pytest.fixture
+    def parsed(self, monkeypatch):
+        monkeypatch.setattr(task_cost, "REDIS_CONN", FakeRedis())
+        calls = []
+
+        def page_features(fnm, binary):
+            calls.append(binary)
+            return [(True, 0), (False, len(binary))]
+
+        monkeypatch.setattr(task_cost.PdfParser, "page_features", staticmethod(page_features))
+        return calls
+
+    def test_cached(self, parsed):
+        """Features are read from the file once"""
+        doc = {"id": "doc", "name": "a.pdf", "size": 3}
+        assert pdf_page_features(doc, "kb", "a.pdf", lambda: b"abc") == [(True, 0), (False, 3)]
+        assert pdf_page_features(doc, "kb", "a.pdf", lambda: b"abc") == [(True, 0), (False, 3)]
+        assert parsed == [b"abc"]
+
+    def test_other_file(self, parsed):
+        """Another stored file of the document, or a new size, misses the cache"""
+        pdf_page_features({"id": "doc", "name": "a.pdf", "size": 3}, "kb", "a.pdf", lambda: b"abc")
+        assert pdf_page_features({"id": "doc", "name": "a.pdf", "size": 4}, "kb", "a.pdf", lambda: b"abcd")[1] == (False, 4)
+        assert pdf_page_features({"id": "doc", "name": "a.pdf", "size": 4}, "kb", "b.pdf", lambda: b"xyzzy")[1] == (False, 5)
+        assert len(parsed) == 3
+
+    def test_invalid_cache_entry(self, parsed):
+        """An unreadable cache entry is parsed again"""
+        doc = {"id": "doc", "name": "a.pdf", "size": 3}
+        pdf_page_features(doc, "kb", "a.pdf", lambda: b"abc")
+        for key in task_cost.REDIS_CONN.store:
+            task_cost.REDIS_CONN.store[key] = "not json"
+        assert pdf_page_features(doc, "kb", "a.pdf", lambda: b"abc") == [(True, 0), (False, 3)]
+        assert len(parsed) == 2